@@ -0,0 +1,23 @@
+"""Add a revision counter to packages, used to cache the frontend cards.
+
+Revision ID: 1f3b8a9c2d47
+Revises: 410bc2e9d804
+Create Date: 2026-10-19 09:12:41.331027
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f3b8a9c2d47'
+down_revision = '410bc2e9d804'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('package', sa.Column(
+        'revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('package', 'revision')
@@ -0,0 +1,33 @@
+"""Store the average rating and number of ratings of the packages.
+
+Revision ID: 2a8f5c3e7b91
+Revises: 4d7e2b9a6c15
+Create Date: 2026-10-19 15:22:54.170338
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a8f5c3e7b91'
+down_revision = '4d7e2b9a6c15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('package', sa.Column('avg_rating', sa.Float()))
+    op.add_column('package', sa.Column(
+        'n_ratings', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE package SET '
+        'avg_rating = (SELECT AVG(rating.rating) FROM rating '
+        'WHERE rating.package_id = package.id), '
+        'n_ratings = (SELECT COUNT(rating.id) FROM rating '
+        'WHERE rating.package_id = package.id)')
+    op.create_index('ix_package_avg_rating', 'package', ['avg_rating'])
+
+
+def downgrade():
+    op.drop_index('ix_package_avg_rating', 'package')
+    op.drop_column('package', 'n_ratings')
+    op.drop_column('package', 'avg_rating')
@@ -0,0 +1,42 @@
+"""Store the banned flag of the tags.
+
+Revision ID: 3c7e9a1d5f62
+Revises: 5b1d9e4c8a20
+Create Date: 2026-10-19 18:05:41.219874
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c7e9a1d5f62'
+down_revision = '5b1d9e4c8a20'
+
+from alembic import op
+import sqlalchemy as sa
+
+from fedoratagger.lib import blacklist
+
+
+def upgrade():
+    op.add_column('tag', sa.Column(
+        'banned', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    # Backfill the flag, label by label.
+    tag = sa.table('tag', sa.column('label'), sa.column('banned'))
+    connection = op.get_bind()
+    labels = [
+        label for label, in connection.execute(
+            sa.select([tag.c.label]).distinct())
+        if blacklist.banned(label)
+    ]
+    for start in range(0, len(labels), 500):
+        connection.execute(tag.update().where(
+            tag.c.label.in_(labels[start:start + 500])
+        ).values(banned=True))
+
+    op.create_index('ix_tag_package_id_banned', 'tag',
+                    ['package_id', 'banned'])
+
+
+def downgrade():
+    op.drop_index('ix_tag_package_id_banned', 'tag')
+    op.drop_column('tag', 'banned')
@@ -0,0 +1,32 @@
+"""Add the change feed table.
+
+Revision ID: 4d7e2b9a6c15
+Revises: 52c4e6a1f3d8
+Create Date: 2026-10-19 13:41:08.904715
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d7e2b9a6c15'
+down_revision = '52c4e6a1f3d8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # No foreign key on package_id: the changes outlive the packages, a
+    # removal is itself recorded as a change.
+    op.create_table(
+        'changes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.Unicode(length=16), nullable=False),
+        sa.Column('package_id', sa.Integer(), nullable=False),
+        sa.Column('label', sa.Unicode(length=255), nullable=True),
+        sa.Column('created_on', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('changes')
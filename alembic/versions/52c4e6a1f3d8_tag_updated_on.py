@@ -0,0 +1,25 @@
+"""Add a modification timestamp to tags, used to dump the changes only.
+
+Revision ID: 52c4e6a1f3d8
+Revises: 1f3b8a9c2d47
+Create Date: 2026-10-19 11:03:27.518204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52c4e6a1f3d8'
+down_revision = '1f3b8a9c2d47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('tag', sa.Column('updated_on', sa.DateTime()))
+    op.execute('UPDATE tag SET updated_on = CURRENT_TIMESTAMP')
+    op.create_index('ix_tag_updated_on', 'tag', ['updated_on'])
+
+
+def downgrade():
+    op.drop_index('ix_tag_updated_on', 'tag')
+    op.drop_column('tag', 'updated_on')
@@ -0,0 +1,36 @@
+"""Index the columns used by the hot lookups.
+
+Revision ID: 5b1d9e4c8a20
+Revises: 2a8f5c3e7b91
+Create Date: 2026-10-19 16:48:12.603981
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b1d9e4c8a20'
+down_revision = '2a8f5c3e7b91'
+
+from alembic import op
+import sqlalchemy as sa
+
+MISSING_SUMMARY = "summary IN ('', '(no summary)')"
+
+
+def upgrade():
+    op.create_index('ix_tag_label', 'tag', ['label'])
+    op.create_index('ix_vote_tag_id', 'vote', ['tag_id'])
+    op.create_index('ix_rating_package_id', 'rating', ['package_id'])
+    op.create_index('ix_usage_package_id', 'usage', ['package_id'])
+    op.create_index('ix_user_anonymous_score', 'user', ['anonymous', 'score'])
+    op.create_index('ix_package_missing_summary', 'package', ['id'],
+                    postgresql_where=sa.text(MISSING_SUMMARY),
+                    sqlite_where=sa.text(MISSING_SUMMARY))
+
+
+def downgrade():
+    op.drop_index('ix_package_missing_summary', 'package')
+    op.drop_index('ix_user_anonymous_score', 'user')
+    op.drop_index('ix_usage_package_id', 'usage')
+    op.drop_index('ix_rating_package_id', 'rating')
+    op.drop_index('ix_vote_tag_id', 'vote')
+    op.drop_index('ix_tag_label', 'tag')
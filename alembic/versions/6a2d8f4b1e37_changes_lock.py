@@ -0,0 +1,28 @@
+"""Add the lock ordering the change sequences by commit.
+
+Revision ID: 6a2d8f4b1e37
+Revises: 3c7e9a1d5f62
+Create Date: 2026-10-19 21:12:37.501392
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a2d8f4b1e37'
+down_revision = '3c7e9a1d5f62'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    table = op.create_table(
+        'changes_lock',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('commits', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.bulk_insert(table, [{'id': 1, 'commits': 0}])
+
+
+def downgrade():
+    op.drop_table('changes_lock')
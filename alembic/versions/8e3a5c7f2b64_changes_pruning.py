@@ -0,0 +1,28 @@
+"""Index the change feed and keep track of its pruning.
+
+Revision ID: 8e3a5c7f2b64
+Revises: 6a2d8f4b1e37
+Create Date: 2026-10-19 23:05:41.218573
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e3a5c7f2b64'
+down_revision = '6a2d8f4b1e37'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # The feed is read by sequence, the primary key.
+    op.create_index('ix_changes_package_id', 'changes', ['package_id'])
+    op.create_index('ix_changes_created_on', 'changes', ['created_on'])
+    op.add_column('changes_lock', sa.Column(
+        'pruned', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('changes_lock', 'pruned')
+    op.drop_index('ix_changes_created_on', 'changes')
+    op.drop_index('ix_changes_package_id', 'changes')
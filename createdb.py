@@ -4,10 +4,10 @@
 __requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
 import pkg_resources
 
-from fedoratagger import APP
+from fedoratagger import CONFIG
 from fedoratagger.lib import model
 
-session = model.create_tables(APP.config['DB_URL'], debug=True)
+session = model.create_tables(CONFIG['DB_URL'], debug=True)
 
 import sys
 
@@ -0,0 +1,137 @@
+""" Show the query plans and timings of the hot lookups before and after
+the indexes of the 5b1d9e4c8a20 alembic revision, on a synthetic dataset.
+
+Run it against a scratch database, it (re)creates all the tables:
+
+    python doc/benchmark_indexes.py --db-url sqlite:////tmp/bench.sqlite
+    python doc/benchmark_indexes.py --db-url postgresql://...@localhost/bench
+
+The dataset has 100k packages by default, see --help.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import create_engine, distinct, func, text
+from sqlalchemy.orm import sessionmaker
+
+import fedoratagger.lib.model as m
+from fedoratagger.lib.bench import populate
+
+# The indexes added by the 5b1d9e4c8a20 revision.
+INDEXES = [
+    'ix_tag_label',
+    'ix_vote_tag_id',
+    'ix_rating_package_id',
+    'ix_usage_package_id',
+    'ix_user_anonymous_score',
+    'ix_package_missing_summary',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', default='sqlite:////tmp/bench.sqlite')
+    parser.add_argument('--packages', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--labels', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Number of runs of each query')
+    return parser.parse_args()
+
+
+def _indexes(metadata):
+    """ Return the indexes of INDEXES defined in the model. """
+    return [index for table in metadata.sorted_tables
+            for index in table.indexes if index.name in INDEXES]
+
+
+def queries(session, args):
+    """ Return the (title, query) of the hot lookups. """
+    package_id = args.packages / 2
+    user_id = args.users / 2
+    scores = session.query(func.count(distinct(m.FASUser.score))).filter(
+        m.FASUser.anonymous == False)
+    return [
+        ('Tag.by_label', session.query(m.Tag).filter(
+            m.Tag.label == u'label-%i' % (args.labels / 2))),
+        ('Vote.get_votes_user', session.query(m.Vote).filter(
+            m.Vote.user_id == user_id)),
+        ('Vote by tag_id (retired, merge_tags)', session.query(m.Vote).filter(
+            m.Vote.tag_id == 1)),
+        ('Rating.rating_of_package', session.query(
+            func.avg(m.Rating.rating)).filter(
+                m.Rating.package_id == package_id)),
+        ('Usage.usage_of_package', session.query(m.Usage).filter(
+            m.Usage.package_id == package_id)),
+        ('FASUser.top', session.query(m.FASUser).filter(
+            m.FASUser.anonymous == False).order_by(
+                m.FASUser.score.desc(), m.FASUser.id).limit(10)),
+        ('FASUser.rank', scores.filter(m.FASUser.score > 10)),
+        ('update_summaries', session.query(m.Package).filter(
+            text(m.MISSING_SUMMARY))),
+    ]
+
+
+def explain(session, query):
+    """ Return the query plan of the query as a string. """
+    statement = str(query.statement.compile(
+        dialect=session.bind.dialect, compile_kwargs={'literal_binds': True}))
+    if session.bind.dialect.name == 'sqlite':
+        rows = session.execute('EXPLAIN QUERY PLAN ' + statement)
+        return '\n'.join(row[-1] for row in rows)
+    return '\n'.join(row[0] for row in session.execute('EXPLAIN ' + statement))
+
+
+def measure(session, args):
+    """ Print the plan and the mean duration of each query. """
+    results = {}
+    for title, query in queries(session, args):
+        start = time.time()
+        for _ in range(args.runs):
+            query.all()
+        results[title] = (time.time() - start) / args.runs * 1000
+        print '== %s: %.2f ms' % (title, results[title])
+        print explain(session, query)
+        print
+    return results
+
+
+def main():
+    args = parse_args()
+    engine = create_engine(args.db_url)
+    session = sessionmaker(bind=engine)()
+
+    m.DeclarativeBase.metadata.drop_all(engine)
+    m.DeclarativeBase.metadata.create_all(engine)
+    for index in _indexes(m.DeclarativeBase.metadata):
+        index.drop(engine)
+
+    print 'Populating %i packages and %i users...' % (
+        args.packages, args.users)
+    counts = populate(
+        session, packages=args.packages, tags=args.packages * 5,
+        votes=args.packages * 10, users=args.users, ratings=args.packages,
+        usages=args.packages, labels=args.labels)
+    print '... with %(tag)i tags and %(vote)i votes.' % counts
+    engine.execute('ANALYZE')
+
+    print '\n#### Without the indexes\n'
+    before = measure(session, args)
+
+    for index in _indexes(m.DeclarativeBase.metadata):
+        index.create(engine)
+    engine.execute('ANALYZE')
+    # Start over with a connection seeing the new schema.
+    session.close()
+
+    print '\n#### With the indexes\n'
+    after = measure(session, args)
+
+    print '\n#### Summary (ms)\n'
+    for title, _ in queries(session, args):
+        print '%-40s %10.2f %10.2f' % (title, before[title], after[title])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+""" Compare the throughput of the JSON encoders on an answer shaped like
+the one of /api/v1/tag/export/:
+
+    python doc/benchmark_json.py
+    python doc/benchmark_json.py --packages 50000 --tags 10
+
+The encoders which are not installed are skipped.
+"""
+
+import argparse
+import json
+import time
+
+import flask
+
+import fedoratagger.flask_utils
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--packages', type=int, default=20000)
+    parser.add_argument('--tags', type=int, default=5,
+                        help='Number of tags per package')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs of each encoder')
+    return parser.parse_args()
+
+
+def payload(args):
+    """ Return an export of `packages` packages with `tags` tags each. """
+    return {'packages': [
+        {u'package-%i' % i: [
+            {'tag': u'label-%i' % ((i + j) % 3000), 'total': j}
+            for j in range(args.tags)
+        ]}
+        for i in range(args.packages)
+    ]}
+
+
+def encoders():
+    """ Return the (title, function) of the encoders to compare. """
+    output = [
+        ('flask.jsonify (indent=2, sorted keys)',
+         lambda obj: flask.json.dumps(obj, indent=2, sort_keys=True)),
+        ('json, compact', lambda obj: json.dumps(obj, separators=(',', ':'))),
+        ('flask.json, compact (simplejson or json)',
+         lambda obj: flask.json.dumps(obj, separators=(',', ':'))),
+    ]
+    try:
+        import simplejson
+        output.append(('simplejson, compact', lambda obj: simplejson.dumps(
+            obj, separators=(',', ':'))))
+    except ImportError:
+        pass
+    try:
+        import ujson
+        output.append(('ujson', ujson.dumps))
+    except ImportError:
+        pass
+
+    def stream(obj):
+        response = fedoratagger.flask_utils.jsonify_stream(
+            'packages', iter(obj['packages']))
+        return ''.join(response.response)
+    output.append(('jsonify_stream, json', stream))
+    return output
+
+
+def main():
+    args = parse_args()
+    obj = payload(args)
+    app = flask.Flask(__name__)
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    app.config['JSON_SORT_KEYS'] = False
+    app.config['JSON_BACKEND'] = 'json'
+
+    print '%-45s %10s %10s' % ('encoder', 'ms', 'MB/s')
+    with app.test_request_context('/'):
+        for title, dumps in encoders():
+            start = time.time()
+            for _ in range(args.runs):
+                size = len(dumps(obj))
+            duration = (time.time() - start) / args.runs
+            print '%-45s %10.1f %10.1f' % (
+                title, duration * 1000, size / duration / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+""" Compare the sequential and the parallel fetch of the retired packages
+from a fake PDC answering with a fixed latency.
+
+    python doc/benchmark_pdc.py --packages 5000 --latency 0.2
+
+See --help for the other options.
+"""
+
+import argparse
+import time
+
+from fedoratagger.lib import retired
+from fedoratagger.lib.fake_pdc import FakePDC
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--packages', type=int, default=5000,
+                        help='Number of retired packages per branch')
+    parser.add_argument('--branches', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Number of seconds of each answer')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    branches = ['f%i' % (28 + i) for i in range(args.branches)]
+    pdc = FakePDC(dict(
+        (branch, ['%s-pkg%i' % (branch, i) for i in range(args.packages)])
+        for branch in branches), latency=args.latency)
+
+    with pdc:
+        for workers in args.workers:
+            start = time.time()
+            count = sum(1 for _ in retired.get_retired_packages(
+                branches, url=pdc.url, workers=workers))
+            print '%2i workers: %i packages in %.2f s' % (
+                workers, count, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
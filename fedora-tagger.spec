@@ -143,6 +143,8 @@ cp -rf alembic/* %{buildroot}%{_datadir}/%{modname}/alembic
 %{_bindir}/fedoratagger-update-db
 %{_bindir}/fedoratagger-merge-tag
 %{_bindir}/fedoratagger-remove-pkgs
+%{_bindir}/fedoratagger-compact-users
+%{_bindir}/fedoratagger-bench
 %config %{_sysconfdir}/%{modname}/
 %{_datadir}/%{modname}/
 %config %{_datadir}/%{modname}/alembic.ini
@@ -17,47 +17,95 @@
 #
 # Refer to the README.rst and LICENSE files for full details of the license
 # -*- coding: utf-8 -*-
-"""The flask application"""
+"""The flask application
+
+Importing fedoratagger is cheap: its attributes are built the first time
+they are used, so the command line tools and the library only load the
+web stack when they need it.
+
+ - CONFIG, the settings of default_config.py overridden by the ones of
+   the file named by the FEDORATAGGER_CONFIG environment variable,
+ - SESSION, the scoped session connected to the database of CONFIG,
+ - APP, the flask application, see application.create_app,
+ - FAS, the flask_fas_openid extension of APP.
+"""
 
 ## These two lines are needed to run on EL6
 __requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
 import pkg_resources
 
+import imp
 import os
+import sys
+import threading
+import types
+
+
+def load_config():
+    """ Return the settings of default_config.py overridden by the ones of
+    the file named by the FEDORATAGGER_CONFIG environment variable, like
+    flask's Config.from_envvar would.
+    """
+    import fedoratagger.default_config
+    modules = [fedoratagger.default_config]
+    if 'FEDORATAGGER_CONFIG' in os.environ:  # pragma: no cover
+        filename = os.environ['FEDORATAGGER_CONFIG']
+        module = imp.new_module('config')
+        module.__file__ = filename
+        execfile(filename, module.__dict__)
+        modules.append(module)
+
+    config = {}
+    for module in modules:
+        config.update((key, getattr(module, key))
+                      for key in dir(module) if key.isupper())
+    return config
+
+
+def _create_session(module):
+    from fedoratagger.lib import create_session
+    config = module.CONFIG
+    return create_session(
+        config['DB_URL'],
+        pool_recycle=config.get('DB_POOL_RECYCLE', 3600),
+        read_urls=config.get('DB_READ_URLS'),
+        pool_size=config.get('DB_POOL_SIZE'),
+        max_overflow=config.get('DB_MAX_OVERFLOW'),
+        pool_timeout=config.get('DB_POOL_TIMEOUT'),
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', False),
+        statement_timeout=config.get('DB_STATEMENT_TIMEOUT'),
+    )
 
-from tw2.core.middleware import make_middleware as make_tw2_middleware
 
-import flask
-from flask_fas_openid import FAS
-from flask.ext.mako import MakoTemplates
+def _create_app(module):
+    from fedoratagger.application import create_app
+    return create_app()
 
-from fedoratagger.lib import create_session
 
-# Create the application.
-APP = flask.Flask(__name__)
-# set up FAS
-APP.config.from_object('fedoratagger.default_config')
-if 'FEDORATAGGER_CONFIG' in os.environ:  # pragma: no cover
-    APP.config.from_envvar('FEDORATAGGER_CONFIG')
-APP.config['FAS_OPENID_CHECK_CERT'] = False
-FAS = FAS(APP)
-mako = MakoTemplates(APP)
-SESSION = create_session(APP.config['DB_URL'])
+_builders = {
+    'CONFIG': lambda module: load_config(),
+    'SESSION': _create_session,
+    'APP': _create_app,
+    'FAS': lambda module: module.APP.extensions['fas'],
+}
+_lock = threading.RLock()
 
-from fedoratagger.api import API
-from fedoratagger.frontend import FRONTEND
 
+class _LazyModule(types.ModuleType):
+    """ The fedoratagger module, building its attributes on first use. """
 
-APP.register_blueprint(API)
-APP.register_blueprint(FRONTEND)
-APP.wsgi_app = make_tw2_middleware(
-    APP.wsgi_app,
-    res_prefix=APP.config['RES_PREFIX'],
-)
+    def __getattr__(self, name):
+        if name not in _builders:
+            raise AttributeError(name)
+        with _lock:
+            if name not in self.__dict__:
+                setattr(self, name, _builders[name](self))
+        return self.__dict__[name]
 
 
-# pylint: disable=W0613
-@APP.teardown_request
-def shutdown_session(exception=None):
-    """ Remove the DB session at the end of each request. """
-    SESSION.remove()
+# Keep a reference to the original module, python 2 clears the globals of
+# the modules it deletes.
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(globals())
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
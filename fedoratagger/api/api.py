@@ -21,15 +21,14 @@
 
 import base64
 import datetime
+import hashlib
+import itertools
+import math
+import operator
 from urlparse import urljoin, urlparse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
-try:
-    from collections import OrderedDict
-except ImportError:
-    from ordereddict import OrderedDict
-
 import flask
 from functools import wraps
 
@@ -38,6 +37,9 @@ import fedoratagger as ft
 import fedoratagger.lib
 import fedoratagger.lib.model as model
 import fedoratagger.flask_utils
+from fedoratagger.flask_utils import jsonify, jsonify_stream
+from fedoratagger.lib.compression import ENCODINGS, ExportCache
+from fedoratagger.lib.tag_index import INDEX
 
 # Relative import
 import forms as forms
@@ -56,15 +58,20 @@ def pkg_get(pkgname):
     httpcode = 200
     output = {}
     try:
+        top = top_arg()
         package = model.Package.by_name(ft.SESSION, pkgname)
-        output = package.__json__(ft.SESSION)
+        output = package.__json__(ft.SESSION, top=top)
     except NoResultFound, err:
         ft.SESSION.rollback()
         output['output'] = 'notok'
         output['error'] = 'Package "%s" not found' % pkgname
         httpcode = 404
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -74,15 +81,20 @@ def pkg_get_tag(pkgname):
     httpcode = 200
     output = {}
     try:
+        top = top_arg()
         package = model.Package.by_name(ft.SESSION, pkgname)
-        output = package.__tag_json__()
+        output = package.__tag_json__(top=top)
     except NoResultFound, err:
         ft.SESSION.rollback()
         output['output'] = 'notok'
         output['error'] = 'Package "%s" not found' % pkgname
         httpcode = 404
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -107,7 +119,7 @@ def pkg_get_usage(pkgname):
         output['error'] = 'Package "%s" not found' % pkgname
         httpcode = 404
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -132,30 +144,157 @@ def pkg_get_rating(pkgname):
         output['error'] = 'Package "%s" not found' % pkgname
         httpcode = 404
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
+    jsonout.status_code = httpcode
+    return jsonout
+
+
+def tag_index():
+    """ Return the tag index of the worker, up to date according to the
+    TAG_INDEX_REFRESH setting.
+    """
+    return INDEX.update(
+        ft.SESSION, refresh=ft.APP.config.get('TAG_INDEX_REFRESH', 10))
+
+
+def pkg_get_suggest(pkgname):
+    """ Performs the GET request of pkg_suggest. """
+    httpcode = 200
+    output = {}
+    try:
+        _, limit = page_args()
+        package = model.Package.by_name(ft.SESSION, pkgname)
+        suggestions = tag_index().suggest(
+            package.id, exclude=[tag.label for tag in package.tags],
+            limit=limit)
+        output['name'] = package.name
+        output['suggestions'] = [
+            {'tag': label, 'score': score} for label, score in suggestions]
+    except NoResultFound, err:
+        ft.SESSION.rollback()
+        output['output'] = 'notok'
+        output['error'] = 'Package "%s" not found' % pkgname
+        httpcode = 404
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
+
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
 
+def pkg_get_similar(pkgname):
+    """ Performs the GET request of pkg_similar. """
+    httpcode = 200
+    output = {}
+    try:
+        _, limit = page_args()
+        package = model.Package.by_name(ft.SESSION, pkgname)
+        similar = tag_index().similar(package.id, limit=limit)
+        names = {}
+        if similar:
+            names = dict(ft.SESSION.query(
+                model.Package.id, model.Package.name
+            ).filter(
+                model.Package.id.in_([pkg_id for pkg_id, _ in similar])
+            ))
+        output['name'] = package.name
+        # A package removed since the last refresh has no name anymore.
+        output['similar'] = [
+            {'name': names[pkg_id], 'score': score}
+            for pkg_id, score in similar if pkg_id in names]
+    except NoResultFound, err:
+        ft.SESSION.rollback()
+        output['output'] = 'notok'
+        output['error'] = 'Package "%s" not found' % pkgname
+        httpcode = 404
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
+
+    jsonout = jsonify(output)
+    jsonout.status_code = httpcode
+    return jsonout
+
+
+def page_args():
+    """ Return the `after` and `limit` arguments of the request used to
+    paginate the lists.
+
+    The limit defaults to the API_PAGE_SIZE setting and is capped by the
+    API_MAX_PAGE_SIZE one.  Raises a ValueError on invalid arguments.
+    """
+    try:
+        after = flask.request.args.get('after')
+        if after is not None:
+            after = int(after)
+        limit = int(flask.request.args.get(
+            'limit', ft.APP.config.get('API_PAGE_SIZE', 100)))
+        if limit < 1:
+            raise ValueError()
+    except ValueError:
+        raise ValueError('Invalid after or limit argument submitted')
+    return after, min(limit, ft.APP.config.get('API_MAX_PAGE_SIZE', 1000))
+
+
+def top_arg():
+    """ Return the `top` argument of the request, the number of tags
+    returned for each package, or None to return all of them.
+
+    Raises a ValueError on invalid arguments.
+    """
+    top = flask.request.args.get('top') or None
+    if top is None:
+        return None
+    try:
+        top = int(top)
+        if top < 1:
+            raise ValueError()
+    except ValueError:
+        raise ValueError('Invalid top argument submitted')
+    return top
+
+
+def paginate(items, limit, key):
+    """ Trim a list fetched with limit + 1 items to limit items.
+
+    Returns the list and the key of its last item if there are more items
+    to fetch, None otherwise.
+    """
+    if len(items) > limit:
+        items = items[:limit]
+        return items, key(items[-1])
+    return items, None
+
+
 def tag_pkg_get(tag):
     """ Performs the GET request of tag_pkg.
-    Returns all the package associated to this tag.
+    Returns the packages associated to this tag, paginated.
     """
     httpcode = 200
     output = {}
     try:
-        package = model.Tag.by_label(ft.SESSION, tag)
-        if not package:
+        after, limit = page_args()
+        package = model.Tag.by_label(ft.SESSION, tag, after, limit + 1)
+        if not package and after is None:
             raise NoResultFound()
-        output = {'tag': tag}
+        package, next_tag = paginate(package, limit, lambda tag: tag.id)
+        output = {'tag': tag, 'next': next_tag}
         output['packages'] = [pkg.__pkg_json__() for pkg in package]
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
     except NoResultFound, err:
         ft.SESSION.rollback()
         output['output'] = 'notok'
         output['error'] = 'Tag "%s" not found' % tag
         httpcode = 404
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -209,7 +348,7 @@ def tag_pkg_put(pkgname):
             output['error_detail'] = detail
         httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -221,16 +360,22 @@ def rating_pkg_get(rating):
     httpcode = 200
     output = {}
     try:
-        rating = float(rating)
-        packages = model.Rating.by_rating(ft.SESSION, rating)
-        if not packages:
+        try:
+            rating = float(rating)
+        except ValueError:
+            raise ValueError('Invalid rating provided "%s"' % rating)
+        after, limit = page_args()
+        packages = model.Rating.by_rating(ft.SESSION, rating, after,
+                                          limit + 1)
+        if not packages and after is None:
             raise NoResultFound()
-        output = {'rating': rating}
+        packages, next_package = paginate(
+            packages, limit, lambda package: package.id)
+        output = {'rating': rating, 'next': next_package}
         output['packages'] = [package.name for package in packages]
     except ValueError, err:
-        ft.SESSION.rollback()
         output['output'] = 'notok'
-        output['error'] = 'Invalid rating provided "%s"' % rating
+        output['error'] = str(err)
         httpcode = 500
     except NoResultFound, err:
         ft.SESSION.rollback()
@@ -238,7 +383,7 @@ def rating_pkg_get(rating):
         output['error'] = 'No packages found with rating "%s"' % rating
         httpcode = 404
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -275,7 +420,7 @@ def rating_pkg_put(pkgname):
             output['error_detail'] = detail
         httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -286,14 +431,16 @@ def usage_pkg_get(pkgname):
     output = dict(
         user=user.__json__(ft.SESSION),
         pkgname=pkgname,
-        usage=False,
     )
 
-    for usage in user.usages:
-        if pkgname == usage.package.name:
-            output['usage'] = True
+    if isinstance(pkgname, list):
+        used = user.uses_packages(ft.SESSION, pkgname)
+        output['usage'] = dict([(pkg, pkg in used) for pkg in pkgname])
+    else:
+        output['usage'] = pkgname in user.uses_packages(
+            ft.SESSION, [pkgname])
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = 200
     return jsonout
 
@@ -318,7 +465,7 @@ def usage_pkg_put(pkgname):
             output['error'] = 'Invalid input submitted'
             output['error_detail'] = 'usage must be "true" or "false"'
             httpcode = 500
-            jsonout = flask.jsonify(output)
+            jsonout = jsonify(output)
             jsonout.status_code = httpcode
             return jsonout
 
@@ -346,7 +493,7 @@ def usage_pkg_put(pkgname):
             output['error_detail'] = detail
         httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -387,7 +534,7 @@ def vote_pkg_put(pkgname):
             output['error_detail'] = detail
         httpcode = 500
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -397,16 +544,22 @@ def statistics_by_user_get(username, fields="all"):
     Get statistics per user from username (if exist)
     """
     httpcode = 200
+    output = {}
     try:
+        after, limit = page_args()
         user = model.FASUser.by_name(ft.SESSION, username)
-        output = fedoratagger.lib.statistics_by_user(ft.SESSION,
-                                                     user, fields)
+        output = fedoratagger.lib.statistics_by_user(
+            ft.SESSION, user, fields, after=after, limit=limit)
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
     except NoResultFound, err:
         ft.SESSION.rollback()
         output['output'] = 'notok'
         output['error'] = 'User "%s" not found' % username
         httpcode = 404
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -426,6 +579,117 @@ def fas_login_required(function):
     return decorated_function
 
 
+def change_sequence(function):
+    """ Flask decorator adding the sequence of the last change recorded
+    before the export started to the response, in the X-Change-Sequence
+    header.  Consumers can then fetch the changes since that sequence from
+    the change feed to keep their copy of the export up to date.
+    """
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        sequence = model.Change.last(ft.SESSION)
+        response = function(*args, **kwargs)
+        response.headers['X-Change-Sequence'] = str(sequence)
+        return response
+    return decorated_function
+
+
+def export_version():
+    """ Return the version of the exports, which changes when a change is
+    recorded or a package added or removed.
+    """
+    return '%i-%i-%i' % ((model.Change.last(ft.SESSION),) +
+                         model.Package.count_and_last(ft.SESSION))
+
+
+def export_etag(function):
+    """ Flask decorator setting the ETag of an export from its version, and
+    answering 304 before building it when the client already has it.
+    """
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        etag = '%s-%s' % (export_version(), hashlib.sha1(
+            flask.request.query_string).hexdigest()[:16])
+        # The compressed answers get the encoding appended, see
+        # application.compress_response.
+        encoding = fedoratagger.flask_utils.accepted_encoding(ENCODINGS)
+        for candidate in (etag, encoding and '%s-%s' % (etag, encoding)):
+            if candidate and candidate in flask.request.if_none_match:
+                response = flask.Response(status=304)
+                response.set_etag(candidate)
+                return response
+
+        response = function(*args, **kwargs)
+        if response.status_code not in (200, 304):
+            return response
+        if 'Content-Encoding' in response.headers:
+            etag = '%s-%s' % (etag, response.headers['Content-Encoding'])
+        response.set_etag(etag)
+        return response
+    return decorated_function
+
+
+def export_cache():
+    """ Return the cache of the exports set up by the EXPORT_CACHE_*
+    settings, None if they are not cached.
+    """
+    config = flask.current_app.config
+    if not config.get('EXPORT_CACHE_DIR'):
+        return None
+    cache = flask.current_app.extensions.get('export_cache')
+    if cache is None or cache.directory != config['EXPORT_CACHE_DIR']:
+        cache = ExportCache(
+            config['EXPORT_CACHE_DIR'],
+            ttl=config.get('EXPORT_CACHE_TTL', 3600),
+            level=config.get('COMPRESS_LEVEL', 6))
+        flask.current_app.extensions['export_cache'] = cache
+    return cache
+
+
+def cached_export(mimetype):
+    """ Flask decorator storing the exports in the export cache, compressed
+    with every encoding, and serving them from there until a change is
+    recorded or a package added or removed.  On a miss, one worker builds
+    the export while the others wait for it.
+    """
+    def decorator(function):
+        @wraps(function)
+        def decorated_function(*args, **kwargs):
+            cache = export_cache()
+            if cache is None:
+                return function(*args, **kwargs)
+
+            name = '%s-%s' % (function.__name__, hashlib.sha1(
+                flask.request.query_string).hexdigest()[:16])
+            key = export_version()
+            if cache.get(name, key) is None:
+                with cache.lock(name):
+                    # Unless another worker built it while we waited.
+                    if cache.get(name, key) is None:
+                        response = function(*args, **kwargs)
+                        if response.status_code != 200:
+                            return response
+                        cache.store(name, key, response.iter_encoded())
+
+            encoding = fedoratagger.flask_utils.accepted_encoding(
+                cache.encodings)
+            path = encoding and cache.get(name, key, encoding)
+            if not path:
+                encoding, path = None, cache.path(name, key)
+            try:
+                response = flask.send_file(
+                    path, mimetype=mimetype, conditional=True)
+            except (IOError, OSError):
+                # Replaced by another worker meanwhile.
+                return function(*args, **kwargs)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+        return decorated_function
+    return decorator
+
+
 ## Flask application
 
 
@@ -440,6 +704,19 @@ def before_request(*args, **kw):
     if flask.request.method != 'PUT':
         return
 
+    # Refuse the floods of writes before touching the database.
+    limiter = flask.current_app.extensions.get('ratelimit')
+    key = fedoratagger.flask_utils.client_key(flask.request)
+    wait = limiter.take(key) if limiter and key else 0
+    if wait:
+        wait = int(math.ceil(wait))
+        output = {'output': 'notok',
+                  'error': 'Too many requests, retry in %i seconds' % wait}
+        jsonout = jsonify(output)
+        jsonout.status_code = 429
+        jsonout.headers['Retry-After'] = str(wait)
+        return jsonout
+
     flask.g.fas_user = fedoratagger.flask_utils.current_user(flask.request)
     # XXX - the user can be 'authenticated' but still be 'anonymous'.  Odd.
     authenticated = bool(flask.g.fas_user)
@@ -447,7 +724,7 @@ def before_request(*args, **kw):
     # if we don't check that we're requesting /loging/ we can't (log in)
     if not authenticated and flask.request.path != '/api/login/':
         output = {'output': 'notok', 'error': 'Login invalid/expired'}
-        jsonout = flask.jsonify(output)
+        jsonout = jsonify(output)
         jsonout.status_code = 500
         return jsonout
 
@@ -471,6 +748,7 @@ def auth_login():
 
 @API.route('/token/')
 @fas_login_required
+@fedoratagger.flask_utils.primary_database
 def generate_token():
     """ Return the score of the specified user.
     """
@@ -478,7 +756,7 @@ def generate_token():
     output = fedoratagger.lib.get_api_token(ft.SESSION, user)
 
     ft.SESSION.commit()
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     return jsonout
 
 
@@ -497,7 +775,7 @@ def pkg_random():
         output['output'] = 'notok'
         output['error'] = 'No package could be found'
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
 
@@ -534,6 +812,22 @@ def pkg_rating(pkgname):
     return pkg_get_rating(pkgname)
 
 
+@API.route('/<pkgname>/suggest/')
+def pkg_suggest(pkgname):
+    """ Returns the tags most likely to apply to a package, according to
+    the tags it already has.
+    """
+    return pkg_get_suggest(pkgname)
+
+
+@API.route('/<pkgname>/similar/')
+def pkg_similar(pkgname):
+    """ Returns the packages having the tags the most similar to the ones
+    of a package.
+    """
+    return pkg_get_similar(pkgname)
+
+
 @API.route('/ratings/<pkgname>/', methods=['GET'])
 def pkg_ratings(pkgname):
     """ Returns the ratings associated with several packages
@@ -554,44 +848,90 @@ def tag_pkg(pkgname):
         return tag_pkg_put(pkgname)
 
 
+def parse_since(since):
+    """ Parse the `since` argument of the dumps, a UTC date or date and
+    time in ISO 8601 format (ie: 2013-05-27 or 2013-05-27T14:20:00).
+
+    Raises a ValueError if the string cannot be parsed.
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(since, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date "%s", expected YYYY-MM-DD or '
+                     'YYYY-MM-DDTHH:MM:SS' % since)
+
+
 @API.route('/tag/dump/')
+@change_sequence
+@cached_export('text/plain')
 def tag_pkg_dump():
     """ Returns a tab separated list of all tags for all packages
+
+    Only the tags created or voted on after the date given by the
+    optional `since` argument are returned if it is set.
     """
-    output = []
-    for package in model.Package.all(ft.SESSION):
-        tmp = []
-        for tag in package.tags:
-            if tag.label.strip():
-                tmp.append('%s\t%s' % (package.name, tag.label.strip()))
-        if tmp:
-            output.append('\n'.join(tmp))
-    return flask.Response('\n'.join(output), mimetype='text/plain')
+    since = flask.request.args.get('since') or None
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError, err:
+            jsonout = jsonify({'output': 'notok', 'error': str(err)})
+            jsonout.status_code = 500
+            return jsonout
+
+    def generate():
+        separator = ''
+        for name, label, _ in model.Tag.export(ft.SESSION, since=since):
+            if label and label.strip():
+                yield '%s%s\t%s' % (separator, name, label.strip())
+                separator = '\n'
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype='text/plain')
 
 
 @API.route('/tag/export/')
+@change_sequence
+@export_etag
+@cached_export('application/json')
 def tag_pkg_export():
     """ Returns a JSON blob of all tags for all packages.
 
     The format is a little funky, but it exists for backwards compatibility
     with the fedora-packages webapp.  It has a cronjob which scrapes this
     URL on the nightly.
+
+    Only the best `top` tags of each package, best first, are returned if
+    the optional `top` argument is set.
     """
+    try:
+        top = top_arg()
+    except ValueError, err:
+        jsonout = jsonify({'output': 'notok', 'error': str(err)})
+        jsonout.status_code = 500
+        return jsonout
 
-    output = dict(packages=[])
-    for package in model.Package.all(ft.SESSION):
-        tmp = {package.name: []}
-        for tag in package.tags:
-            if tag.label.strip():
-                tmp[package.name].append({
-                    'tag': tag.label.strip(),
-                    'total': tag.total,
-                })
-        output['packages'].append(tmp)
-    return flask.jsonify(output)
+    def packages():
+        rows = model.Tag.export(ft.SESSION, top=top)
+        for name, tags in itertools.groupby(rows, operator.itemgetter(0)):
+            tmp = {name: []}
+            for _, label, total in tags:
+                if label and label.strip():
+                    tmp[name].append({
+                        'tag': label.strip(),
+                        'total': total,
+                    })
+            yield tmp
+
+    return jsonify_stream('packages', packages())
 
 
 @API.route('/tag/sqlitebuildtags/')
+@change_sequence
+@export_etag
+@cached_export('application/x-sqlite3')
 def tag_pkg_sqlite():
     """ Returns a sqlite blob of all tags for all packages.
 
@@ -603,16 +943,89 @@ def tag_pkg_sqlite():
         mimetype='application/x-sqlite3')
 
 
+@API.route('/tag/columnar/')
+@change_sequence
+@export_etag
+@cached_export('application/octet-stream')
+def tag_pkg_columnar():
+    """ Returns a compact binary dump of all tags for all packages.
+
+    The layout is documented in fedoratagger.lib.columnar_export, it is
+    meant to be memory-mapped by the consumers.
+    """
+    return flask.Response(
+        fedoratagger.lib.columnartags(model.Tag.export(ft.SESSION)),
+        mimetype='application/octet-stream')
+
+
 @API.route('/usage/<pkgname>/', methods=['GET', 'PUT'])
 def usage_pkg(pkgname):
-    """ Returns the usage associated with a package
+    """ Returns the usage associated with a package, several packages
+    can be queried at once by separating their names with a comma.
     """
     if flask.request.method == 'GET':
+        if ',' in pkgname:
+            pkgname = pkgname.split(',')
         return usage_pkg_get(pkgname)
     elif flask.request.method == 'PUT':
         return usage_pkg_put(pkgname)
 
 
+@API.route('/rating/range/')
+def rating_range():
+    """ Returns the packages whose average rating is between the `min` and
+    `max` arguments (both included and optional), paginated.
+    """
+    httpcode = 200
+    output = {}
+    try:
+        bounds = []
+        for arg in ('min', 'max'):
+            value = flask.request.args.get(arg)
+            try:
+                bounds.append(float(value) if value is not None else None)
+            except ValueError:
+                raise ValueError('Invalid %s rating provided "%s"' % (
+                    arg, value))
+        after, limit = page_args()
+        packages = model.Rating.by_range(ft.SESSION, bounds[0], bounds[1],
+                                         after, limit + 1)
+        packages, next_package = paginate(
+            packages, limit, lambda package: package.id)
+        output = {'min': bounds[0], 'max': bounds[1], 'next': next_package}
+        output['packages'] = [
+            package.__rating_json__(ft.SESSION) for package in packages]
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
+
+    jsonout = jsonify(output)
+    jsonout.status_code = httpcode
+    return jsonout
+
+
+@API.route('/rating/top/')
+def rating_top():
+    """ Returns the best rated packages, at most `limit` of them.
+    """
+    httpcode = 200
+    output = {}
+    try:
+        _, limit = page_args()
+        output['packages'] = [
+            package.__rating_json__(ft.SESSION)
+            for package in model.Rating.top(ft.SESSION, limit)]
+    except ValueError, err:
+        output['output'] = 'notok'
+        output['error'] = str(err)
+        httpcode = 500
+
+    jsonout = jsonify(output)
+    jsonout.status_code = httpcode
+    return jsonout
+
+
 @API.route('/rating/<pkgname>/', methods=['GET', 'PUT'])
 def rating_pkg(pkgname):
     """ Returns the rating associated with a package
@@ -624,6 +1037,8 @@ def rating_pkg(pkgname):
 
 
 @API.route('/rating/dump/')
+@change_sequence
+@cached_export('text/plain')
 def rating_pkg_dump():
     """ Returns a tab separated list of the rating of each packages
 
@@ -631,23 +1046,34 @@ def rating_pkg_dump():
         NAME    RATING    NUMBER OF VOTES     NUMBER OF INSTALLS
 
     """
-    output = []
-    ratings = OrderedDict(model.Rating.all(ft.SESSION))
-    usages = OrderedDict(model.Usage.all(ft.SESSION))
-
-    # Build a unique list while maintaining order
-    packages = ratings.keys()
-    packages += [p for p in usages.keys() if p not in packages]
-
-    for package in packages:
-        n_ratings = len(package.ratings)
-        output.append('%s\t%0.1f\t%i\t%i' % (
-            package.name,
-            ratings.get(package, -1),
-            n_ratings,
-            usages.get(package, 0),
-        ))
-    return flask.Response('\n'.join(output), mimetype='text/plain')
+    def generate():
+        separator = ''
+        for name, rating, n_ratings, n_usages in model.Rating.dump(
+                ft.SESSION):
+            if rating is None:
+                rating = -1
+            yield '%s%s\t%0.1f\t%i\t%i' % (
+                separator, name, rating, n_ratings, n_usages)
+            separator = '\n'
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype='text/plain')
+
+
+@API.route('/rating/columnar/')
+@change_sequence
+@export_etag
+@cached_export('application/octet-stream')
+def rating_pkg_columnar():
+    """ Returns a compact binary dump of the rating and usage of each
+    package.
+
+    The layout is documented in fedoratagger.lib.columnar_export, it is
+    meant to be memory-mapped by the consumers.
+    """
+    return flask.Response(
+        fedoratagger.lib.columnarratings(model.Rating.dump(ft.SESSION)),
+        mimetype='application/octet-stream')
 
 
 @API.route('/vote/<pkgname>/', methods=['PUT'])
@@ -662,7 +1088,7 @@ def statistics():
     """ Return the statistics of the package/tags in the database
     """
     output = fedoratagger.lib.statistics(ft.SESSION)
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     return jsonout
 
 
@@ -678,7 +1104,7 @@ def leaderboard():
     """ Return the top 10 user, aka the leaderboard
     """
     output = fedoratagger.lib.leaderboard(ft.SESSION)
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
     return jsonout
 
 
@@ -696,6 +1122,48 @@ def score(username):
         output['output'] = 'notok'
         output['error'] = 'User not found'
 
-    jsonout = flask.jsonify(output)
+    jsonout = jsonify(output)
+    jsonout.status_code = httpcode
+    return jsonout
+
+
+@API.route('/changes/')
+def changes():
+    """ Return the changes made to the packages and to their tags, ratings
+    and usages after the sequence given by the `since` argument, at most
+    `limit` of them.
+
+    Each change gives the current state of what changed, applying them in
+    order over an export brings it up to date.  When the changes following
+    `since` were pruned, the answer is 410 and a new export is needed.
+    """
+    httpcode = 200
+    output = {}
+    max_limit = ft.APP.config.get('CHANGES_LIMIT', 1000)
+    try:
+        since = int(flask.request.args.get('since', 0))
+        limit = min(int(flask.request.args.get('limit', max_limit)),
+                    max_limit)
+        if since < 0 or limit < 1:
+            raise ValueError()
+    except ValueError:
+        output['output'] = 'notok'
+        output['error'] = 'Invalid since or limit argument submitted'
+        httpcode = 500
+    else:
+        if since < model.Change.pruned(ft.SESSION):
+            output['output'] = 'notok'
+            output['error'] = 'The changes following this sequence were ' \
+                'pruned, start again from an export'
+            jsonout = jsonify(output)
+            jsonout.status_code = 410
+            return jsonout
+        items = model.Change.since(ft.SESSION, since, limit + 1)
+        output['output'] = 'ok'
+        output['changes'] = items[:limit]
+        output['more'] = len(items) > limit
+        output['last'] = items[:limit][-1]['seq'] if items else since
+
+    jsonout = jsonify(output)
     jsonout.status_code = httpcode
     return jsonout
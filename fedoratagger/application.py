@@ -0,0 +1,143 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+"""The flask application factory, see fedoratagger.APP"""
+
+import time
+
+from tw2.core.middleware import make_middleware as make_tw2_middleware
+
+import flask
+from flask_fas_openid import FAS
+from flask.ext.mako import MakoTemplates
+
+import fedoratagger as ft
+import fedoratagger.flask_utils
+from fedoratagger.lib import compression
+from fedoratagger.lib.ratelimit import create_limiter
+from fedoratagger.lib.vote_buffer import BUFFER
+
+
+def create_app(config=None):
+    """ Create the flask application.
+
+    :kwarg config: a dictionnary of settings overriding the ones of
+        fedoratagger.CONFIG.
+    """
+    app = flask.Flask('fedoratagger')
+    app.config.update(ft.CONFIG)
+    app.config.update(config or {})
+    app.config['FAS_OPENID_CHECK_CERT'] = False
+    app.extensions['fas'] = FAS(app)
+    app.extensions['ratelimit'] = create_limiter(app.config)
+    if app.config.get('VOTE_BUFFER_INTERVAL'):
+        BUFFER.start(ft.SESSION, app.config['VOTE_BUFFER_INTERVAL'])
+    MakoTemplates(app)
+
+    from fedoratagger.api import API
+    from fedoratagger.frontend import FRONTEND
+
+    app.register_blueprint(API)
+    app.register_blueprint(FRONTEND)
+    app.before_request(route_session)
+    app.after_request(remember_writes)
+    app.after_request(compress_response)
+    app.teardown_request(shutdown_session)
+    app.wsgi_app = make_tw2_middleware(
+        app.wsgi_app,
+        res_prefix=app.config['RES_PREFIX'],
+    )
+    return app
+
+
+def route_session():
+    """ Send the reads of the anonymous GET requests to a read replica.
+
+    Authenticated users, and the visitors who wrote something in the last
+    DB_READ_STICKINESS seconds, stay on the primary to read their writes.
+    So do the GET endpoints which write, see flask_utils.primary_database.
+    """
+    config = flask.current_app.config
+    view = flask.current_app.view_functions.get(flask.request.endpoint)
+    if not config.get('DB_READ_URLS') \
+            or flask.request.method not in ('GET', 'HEAD') \
+            or getattr(view, 'primary_database', False) \
+            or getattr(flask.g, 'fas_user', None) \
+            or 'Authorization' in flask.request.headers:
+        return
+    wrote_on = flask.session.get('db_wrote_on', 0)
+    if time.time() - wrote_on > config.get('DB_READ_STICKINESS', 10):
+        ft.SESSION().use_replica()
+
+
+def remember_writes(response):
+    """ Remember when the visitor last wrote, see route_session. """
+    if flask.current_app.config.get('DB_READ_URLS') \
+            and ft.SESSION.registry.has() and ft.SESSION().wrote:
+        flask.session['db_wrote_on'] = time.time()
+    return response
+
+
+def compress_response(response):
+    """ Compress the answers with the content coding preferred by the
+    client, see the COMPRESS_* settings.  The streamed answers are
+    compressed as they are sent.
+    """
+    config = flask.current_app.config
+    if response.status_code != 200 or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or response.mimetype not in config.get('COMPRESS_MIMETYPES', ()):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = fedoratagger.flask_utils.accepted_encoding(
+        compression.ENCODINGS)
+    if encoding is None or (not response.is_streamed and len(
+            response.get_data()) < config.get('COMPRESS_MIN_SIZE', 1024)):
+        return response
+
+    # The compressed answer is another representation.
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag('%s-%s' % (etag, encoding), weak)
+        response.make_conditional(flask.request)
+        if response.status_code == 304:
+            return response
+
+    level = config.get('COMPRESS_LEVEL', 6)
+    if response.is_streamed:
+        iterable = response.response
+        if hasattr(iterable, 'close'):
+            response.call_on_close(iterable.close)
+        response.response = compression.compress_iter(
+            response.iter_encoded(), encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compression.compress(
+            response.get_data(), encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# pylint: disable=W0613
+def shutdown_session(exception=None):
+    """ Remove the DB session at the end of each request, if the request
+    used one.
+    """
+    if ft.SESSION.registry.has():
+        ft.SESSION.remove()
@@ -26,6 +26,35 @@ Default configuration for taggerapi
 # url to the database server:
 DB_URL = 'sqlite:////var/tmp/taggerapi.sqlite'
 
+# urls to read-only replicas of the database, the GET requests of the
+# anonymous visitors are sent to one of them at random:
+DB_READ_URLS = []
+
+# Number of seconds a visitor keeps reading from the primary database
+# after writing to it, to see their changes despite the replication lag.
+DB_READ_STICKINESS = 10
+
+# Connection pool of each process, per database (ignored with SQLite):
+# number of connections kept open, number of extra connections opened
+# under load and number of seconds to wait for a connection before
+# failing.  The waits are reported by the /_stats page.
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+
+# The addresses allowed to read the /_stats page, which is never served
+# through a proxy (requests with an X-Forwarded-For header).
+STATS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Number of seconds after which the connections are reopened, and wether
+# they are tested before being used.
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = False
+
+# Number of milliseconds after which a statement is aborted, on PostgreSQL
+# and MySQL.  None for no limit.
+DB_STATEMENT_TIMEOUT = None
+
 # This is the secret key used to generate teh CSRF
 SECRET_KEY = 'CHANGE ME'
 
@@ -35,3 +64,77 @@ RES_PREFIX = '/_tw2_resources/'
 
 # This is the secret salt used to hash IP addresses.
 SECRET_SALT = 'CHANGE ME'
+
+# Number of packages whose card is kept pre-computed by each worker.
+CARD_CACHE_SIZE = 1000
+
+# Maximum number of changes returned by one call to the change feed.
+CHANGES_LIMIT = 1000
+
+# Number of days the changes are kept in the change feed, the older ones
+# are removed by fedoratagger-compact-users.  None to keep them forever.
+CHANGES_KEEP_DAYS = 30
+
+# Default and maximum number of items returned by one call to the
+# endpoints returning lists, the following pages are fetched with the
+# `after` argument.
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# The JSON answers are compact, set JSONIFY_PRETTYPRINT_REGULAR to indent
+# them.  JSON_BACKEND is the encoder: 'json' (the C encoder of the standard
+# library), 'ujson' (when it is installed) or None for the one of flask.
+# See doc/benchmark_json.py.
+JSONIFY_PRETTYPRINT_REGULAR = False
+JSON_SORT_KEYS = False
+JSON_BACKEND = 'json'
+
+# The answers of these types and of at least COMPRESS_MIN_SIZE bytes are
+# compressed, with gzip, deflate or zstd (if the zstandard module is
+# installed) depending on the Accept-Encoding header of the client.
+COMPRESS_MIMETYPES = [
+    'text/html', 'text/plain', 'text/css', 'application/javascript',
+    'application/json', 'application/octet-stream',
+    'application/x-sqlite3',
+]
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+# Directory where the bulk exports (/api/v1/tag/dump/...) are stored,
+# uncompressed and compressed, until something changes or for at most
+# EXPORT_CACHE_TTL seconds.  None to build them for each request.
+EXPORT_CACHE_DIR = None
+EXPORT_CACHE_TTL = 3600
+
+# Number of writes (PUT requests to the API) allowed per second and per
+# user or IP address, with bursts of WRITE_RATE_BURST writes.  The
+# refused writes get a 429 answer and are counted by the /_stats page.
+# None to disable the limit.  The anonymous users are told apart by the
+# address of the request: behind a proxy, it is the address of the proxy
+# unless the application is wrapped with werkzeug's ProxyFix in the wsgi
+# file, otherwise all of them share a single limit.
+WRITE_RATE_LIMIT = None
+WRITE_RATE_BURST = 20
+
+# By default each worker has its own limits, set the url of a redis
+# server (ie: redis://localhost:6379/0) to share them.
+WRITE_RATE_REDIS_URL = None
+
+# Number of seconds between two writes of the counters of the tags and of
+# the scores of the users updated by the votes, see
+# fedoratagger/lib/vote_buffer.py.  None to update them with each vote.
+# The pages and the JSON of the packages and tags count the pending votes,
+# the SQL exports, the rankings and the change feed see them once written.
+VOTE_BUFFER_INTERVAL = None
+
+# The PDC queried by fedoratagger-remove-pkgs, the branches whose retired
+# packages are removed and the number of pages fetched at once.
+PDC_URL = 'https://pdc.fedoraproject.org/rest_api/v1/component-branches'
+PDC_BRANCHES = ['f28']
+PDC_WORKERS = 8
+
+# Number of seconds between two updates of the tag statistics of a worker
+# from the change feed, and between two full reloads of them by a
+# background thread, started by apache/fedoratagger.wsgi.
+TAG_INDEX_REFRESH = 10
+TAG_INDEX_REBUILD = 86400
@@ -24,19 +24,138 @@ import flask
 import base64
 import datetime
 import hashlib
+import itertools
+import json
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
 
 import fedoratagger as ft
 import fedoratagger.lib.model as m
 
 
+def dumps(obj):
+    """ Return the JSON representation of obj.
+
+    It is compact unless the JSONIFY_PRETTYPRINT_REGULAR setting is set.
+    The JSON_BACKEND setting picks the encoder: 'json' for the one of the
+    standard library, 'ujson' for ujson if it is installed, otherwise the
+    one of flask (simplejson when it is installed).
+    """
+    app = flask.current_app
+    backend = app.config.get('JSON_BACKEND')
+    if app.config.get('JSONIFY_PRETTYPRINT_REGULAR'):
+        return flask.json.dumps(obj, indent=2)
+    if backend == 'ujson' and ujson is not None:
+        try:
+            return ujson.dumps(obj)
+        except (TypeError, OverflowError):
+            # Leave the types only flask knows about (dates...) to it.
+            pass
+    elif backend == 'json':
+        return json.dumps(obj, separators=(',', ':'),
+                          sort_keys=app.config.get('JSON_SORT_KEYS', False),
+                          default=app.json_encoder().default)
+    return flask.json.dumps(obj, separators=(',', ':'))
+
+
+def jsonify(*args, **kwargs):
+    """ Replaces flask.jsonify, with the encoder of `dumps`. """
+    return flask.current_app.response_class(
+        dumps(dict(*args, **kwargs)), mimetype='application/json')
+
+
+# Number of items encoded at once by jsonify_stream.
+STREAM_CHUNK = 500
+
+
+def jsonify_stream(key, items, **kwargs):
+    """ Return a response streaming the JSON object made of the keyword
+    arguments and of `key`, the list of `items`.
+
+    The items are encoded by chunks of `STREAM_CHUNK` as they are
+    produced, so the whole list is never held in memory, neither as
+    objects nor as text.
+    """
+    def generate():
+        head = dumps(kwargs)[:-1].rstrip()
+        yield '%s%s%s:[' % (head, ',' if kwargs else '', dumps(key))
+        separator = ''
+        iterator = iter(items)
+        while True:
+            chunk = list(itertools.islice(iterator, STREAM_CHUNK))
+            if not chunk:
+                break
+            # Strip the brackets of the list.
+            yield separator + dumps(chunk)[1:-1]
+            separator = ','
+        yield ']}'
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype='application/json')
+
+
 def hsh(remote_addr, salt):
     return hashlib.sha256(salt + remote_addr).hexdigest()
 
 
-def current_user(request):
+def client_key(request):
+    """ Return the key identifying the author of a request for the rate
+    limiting of the writes, without querying the database: the user name
+    of the users already authenticated, the hash of the IP address
+    otherwise.
+
+    The user name of the Authorization header is not used, it is not
+    checked yet: anyone could claim a new name for each request, or the
+    name of someone else to use up their bucket.
+    """
+    if getattr(flask.g, 'fas_user', None):
+        return 'user:' + flask.g.fas_user.username
+    if request.remote_addr:
+        return 'ip:' + hsh(request.remote_addr,
+                           salt=ft.APP.config['SECRET_SALT'])
+    return None
+
+
+def accepted_encoding(encodings):
+    """ Return the content coding of `encodings` preferred by the client,
+    according to the Accept-Encoding header, or None.
+    """
+    accept = flask.request.accept_encodings
+    encoding = accept.best_match(encodings)
+    if encoding and accept.quality(encoding) > 0:
+        return encoding
+    return None
+
+
+def primary_database(function):
+    """ Flask decorator marking the GET endpoints which write to the
+    database: their reads go to the primary, see route_session.
+    """
+    function.primary_database = True
+    return function
+
+
+def use_primary():
+    """ Send the following queries of the request to the primary database,
+    the replicas may not have the rows written a moment ago yet.
+    """
+    session = ft.SESSION()
+    if hasattr(session, 'use_primary'):
+        session.use_primary()
+
+
+def current_user(request, create=True):
     """ Given an instance of flask.request, return a FASUser instance.
 
     returns None if the provided Authorization header is invalid.
+
+    :kwarg create: a boolean specifying if an anonymous user should be
+        stored in the database when we do not know it yet.  When False, a
+        transient FASUser is returned for unknown anonymous users and
+        nothing is written.
     """
 
     # TODO - should this raise an exception instead of returning None?
@@ -44,6 +163,7 @@ def current_user(request):
         # The flask_fas_openid extension has already added
         # our user as a Bunch object.  We need to convert that
         # into a m.FASUser object.
+        use_primary()
         user = m.FASUser.get_or_create(
             ft.SESSION,
             username=flask.g.fas_user.username,
@@ -64,6 +184,9 @@ def current_user(request):
             return user
     elif request.remote_addr:
         hashed = hsh(request.remote_addr, salt=ft.APP.config['SECRET_SALT'])
+        if not create:
+            return m.FASUser.get_or_stub(ft.SESSION, hashed)
+        use_primary()
         user = m.FASUser.get_or_create(ft.SESSION, hashed, anonymous=True)
         ft.SESSION.commit()
         return user
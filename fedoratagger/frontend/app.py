@@ -29,8 +29,10 @@ import tw2.jqplugins.ui
 
 import fedoratagger as ft
 import fedoratagger.lib
+from fedoratagger.flask_utils import jsonify
 from fedoratagger.lib import model as m
-from fedoratagger.frontend.widgets.card import CardWidget
+from fedoratagger.frontend.widgets.card import CardWidget, user_usages
+from fedoratagger.frontend.widgets.voting import user_votes
 from fedoratagger.frontend.widgets.user import UserWidget
 from fedoratagger.frontend.widgets.dialog import (
     HotkeysDialog,
@@ -64,12 +66,23 @@ services = [
 ]
 
 
+NO_USER_ENDPOINTS = (
+    'frontend.heartbeat',
+    'frontend.pool_stats',
+    'frontend.static',
+)
+
+
 @FRONTEND.before_request
 def before_request(*args, **kw):
     """ Function called for each request performed.
     It configures and injects globally required resources.
     """
 
+    # These do not render any page nor touch the database.
+    if flask.request.endpoint in NO_USER_ENDPOINTS:
+        return
+
     # Include jquery on every page.
     tw2.jquery.jquery_js.req().prepare()
 
@@ -87,7 +100,10 @@ def before_request(*args, **kw):
     flask.g.statistics_dialog = StatisticsDialog
     flask.g.user_widget = UserWidget
 
-    flask.g.fas_user = fedoratagger.flask_utils.current_user(flask.request)
+    # Anonymous visitors are not stored until they vote, see notifs_toggle
+    # and the API for the places where they get written to the database.
+    flask.g.fas_user = fedoratagger.flask_utils.current_user(
+        flask.request, create=False)
 
     if flask.g.fas_user and not flask.g.fas_user.anonymous:
         flask.g.add_dialog = AddTagDialog
@@ -99,6 +115,25 @@ def heartbeat():
     return "Lub-Dub"
 
 
+@FRONTEND.route('/_stats')
+def pool_stats():
+    """ Statistics of the database connection pools of this process, to
+    size the number of processes and threads against the database, and of
+    the rate limiting of the writes.
+
+    Only served to the addresses of the STATS_ALLOWED_IPS setting, not
+    through a proxy.
+    """
+    allowed = ft.APP.config.get('STATS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if flask.request.remote_addr not in allowed \
+            or 'X-Forwarded-For' in flask.request.headers:
+        flask.abort(403)
+    output = fedoratagger.lib.pool_stats(ft.SESSION)
+    limiter = flask.current_app.extensions.get('ratelimit')
+    output['ratelimit'] = limiter.stats() if limiter else None
+    return jsonify(output)
+
+
 # TODO -- determine wtf this is used for.. :/
 @FRONTEND.route('/raw/<name>')
 def raw(name):
@@ -111,7 +146,7 @@ def raw(name):
 
     for tag in package.tags:
         html += "<li>"
-        html += tag.label + "  " + str(tag.like - tag.dislike)
+        html += tag.label + "  " + str(tag.total)
         html += "<ul>"
         for vote in tag.votes:
             html += "<li>" + vote.user.username + "</li>"
@@ -217,6 +252,15 @@ def home(name=None):
         except m.NoResultFound:
             packages[1] = m.Package()
 
+    for i in range(4):
+        if packages[i] is None:
+            packages[i] = m.Package.random(ft.SESSION)
+
+    # Load the votes and usages of the user on all the cards at once.
+    user_votes([package.id for package in packages if package.id])
+    if flask.g.fas_user and not flask.g.fas_user.anonymous:
+        user_usages([package.name for package in packages if package.id])
+
     cards = [
         CardWidget(package=packages[i], session=ft.SESSION)
         for i in range(4)
@@ -253,11 +297,16 @@ def auth_logout():
 
 
 @FRONTEND.route('/notifs_toggle/', methods=('GET', 'PATCH'))
+@fedoratagger.flask_utils.primary_database
 def notifs_toggle():
+    if flask.g.fas_user.id is None:
+        # First write of an anonymous visitor, store them for real.
+        flask.g.fas_user = fedoratagger.flask_utils.current_user(
+            flask.request)
     flask.g.fas_user.notifications_on = not flask.g.fas_user.notifications_on
     ft.SESSION.commit()
 
-    jsonout = flask.jsonify(dict(
+    jsonout = jsonify(dict(
         notifications_on=flask.g.fas_user.notifications_on
     ))
     jsonout.status_code = 200
@@ -269,7 +318,7 @@ def notifs_toggle():
 @FRONTEND.route('/notifs_state/', methods=('GET',))
 def notifs_state():
 
-    jsonout = flask.jsonify(dict(
+    jsonout = jsonify(dict(
         notifications_on=flask.g.fas_user.notifications_on
     ))
     jsonout.status_code = 200
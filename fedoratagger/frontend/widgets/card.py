@@ -22,10 +22,11 @@ import tw2.core
 import tw2.forms
 import tw2.jquery
 import tw2.jqplugins.gritter
-import random
+from collections import namedtuple
 
 import fedoratagger as ft
 from fedoratagger.lib import model as m
+from fedoratagger.lib.cache import LRUCache
 from fedoratagger.frontend.widgets.voting import TagWidget, voting_js
 
 rating_js = tw2.core.JSLink(
@@ -38,6 +39,74 @@ rating_css = tw2.core.CSSLink(
     resources=[rating_dir],
 )
 
+CardTag = namedtuple('CardTag', [
+    'id', 'label', 'total', 'package_id', 'package_name'])
+
+
+class PackageCard(object):
+    """ The part of a card which does not depend on the current user.
+
+    It is computed once per revision of the package and kept in the
+    `cards` cache of the worker, the tags shown are picked on every request
+    as are the votes and usage of the user.
+    """
+
+    def __init__(self, package, session):
+        self.name = package.name
+        self.revision = package.revision
+        self.rating = None
+        self.usage = 0
+        self.icon = None
+        self.summary = package.summary
+
+        if package.id is None:
+            # Placeholder for a package which could not be found.
+            return
+
+        self.rating = package.rating(session)
+        self.usage = m.Usage.usage_of_package(session, package.id)
+        self.icon = package.icon(session)
+        if not self.summary:
+            self.summary = package.xapian_summary(session)
+
+    @classmethod
+    def get(cls, session, package):
+        """ Return the card of the specified package, from the cache if
+        it is still up to date.
+        """
+        card = cards.get(package.id)
+        if card is None or card.revision != package.revision:
+            card = cls(package, session)
+            if package.id is not None:
+                cards.set(package.id, card)
+        return card
+
+
+cards = LRUCache(ft.CONFIG.get('CARD_CACHE_SIZE', 1000))
+
+
+def user_usages(names):
+    """ Return the set of the names of the packages the current user uses.
+
+    The set is kept for the duration of the request, the usages of the
+    given packages are loaded with a single query the first time one of
+    these packages is asked for.
+    """
+    if not hasattr(flask.g, 'user_usages'):
+        flask.g.user_usages = set()
+        flask.g.user_usages_packages = set()
+
+    missing = set(names) - flask.g.user_usages_packages
+    if missing:
+        flask.g.user_usages_packages.update(missing)
+        user = flask.g.fas_user
+        if user:
+            flask.g.user_usages.update(
+                user.uses_packages(ft.SESSION, list(missing)))
+
+    return flask.g.user_usages
+
+
 class CardWidget(tw2.forms.LabelField):
     """ Tiny Voting Widget """
 
@@ -45,6 +114,7 @@ class CardWidget(tw2.forms.LabelField):
     package = tw2.core.Param(default=None)
     session = tw2.core.Param(default=None)
     tags = tw2.core.params.Variable()
+    card = tw2.core.params.Variable()
     css_class = 'card'
     rating = None
     resources = [
@@ -65,20 +135,23 @@ class CardWidget(tw2.forms.LabelField):
         if not self.package:
             self.package = m.Package.random(ft.SESSION)
 
-        allowed_tags = filter(lambda t: not t.banned, self.package.tags)
-
-        if len(allowed_tags) >= self.N:
-            picked_tags = random.sample(allowed_tags, self.N)
-        else:
-            picked_tags = allowed_tags
-
-        self.tags = [TagWidget(tag=tag) for tag in picked_tags]
+        self.card = PackageCard.get(ft.SESSION, self.package)
+        picked_tags = []
+        if self.package.id is not None:
+            picked_tags = m.Tag.random_visible(
+                ft.SESSION, self.package.id, self.N)
+
+        self.tags = [
+            TagWidget(tag=CardTag(tag.id, tag.label, tag.total,
+                                  tag.package_id, self.package.name))
+            for tag in picked_tags
+        ]
         if self.tags:
             self.tags[0].css_class += " selected"
 
     def rating_selected(self, i, N):
         if self.rating is None:
-            self.rating = self.package.rating(ft.SESSION) or 50
+            self.rating = self.card.rating or 50
             if self.rating:
                 self.rating = self.rating - 1
 
@@ -88,4 +161,4 @@ class CardWidget(tw2.forms.LabelField):
 
     @property
     def including_you(self):
-        return flask.g.fas_user.uses(ft.SESSION, self.package)
+        return self.package.name in user_usages([self.package.name])
@@ -19,18 +19,27 @@ import tw2.core as twc
 from tw2.jqplugins.ui import DialogWidget
 
 import codecs
-import docutils.examples
+import os
 
+# The rendered hotkeys section, see hotkeys_readme.
+_hotkeys = []
 
-def hotkeys_readme():
-    """ Pick the README.rst off of disk and render the hotkeys section """
 
-    root = '/'.join(__file__.split('/')[:-4])
-    fname = root + '/README.rst'
-    with codecs.open(fname, 'r', 'utf-8') as f:
-        rst = f.read()
-        hotkeys = rst.split('.. hotkeys')[1]
-        return docutils.examples.html_body(hotkeys)
+def hotkeys_readme():
+    """ Pick the README.rst off of disk and render the hotkeys section.
+
+    It is only rendered once, the first time the dialog is displayed.
+    """
+    if not _hotkeys:
+        import docutils.examples
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            *[os.path.pardir] * 3)
+        fname = os.path.join(root, 'README.rst')
+        with codecs.open(fname, 'r', 'utf-8') as f:
+            rst = f.read()
+            hotkeys = rst.split('.. hotkeys')[1]
+            _hotkeys.append(docutils.examples.html_body(hotkeys))
+    return _hotkeys[0]
 
 
 class HotkeysDialog(DialogWidget):
@@ -42,7 +51,10 @@ class HotkeysDialog(DialogWidget):
         'autoOpen': False,
         'width': 550,
     }
-    value = hotkeys_readme()
+
+    def prepare(self):
+        self.value = hotkeys_readme()
+        super(HotkeysDialog, self).prepare()
 
 
 search_action_js = twc.JSLink(link="javascript/search.js")
@@ -4,8 +4,8 @@
     <div class="package_header">
       <div class="title">
         % if w.package.name:
-          % if w.package.icon(w.session):
-            <div class="icon"><img src="${w.package.icon(w.session)}"/></div>
+          % if w.card.icon:
+            <div class="icon"><img src="${w.card.icon}"/></div>
           % endif
           <div>
             <h2>
@@ -16,11 +16,7 @@
             </h2>
           </div>
           <div class="summary">
-           % if w.package.summary:
-             ${w.package.summary}
-           % else:
-             ${w.package.xapian_summary(w.session)}
-           % endif
+           ${w.card.summary}
           </div>
           <div>
           % if w.package.name:
@@ -36,9 +32,9 @@
           % if w.not_anonymous:
             <div class="usage">
               <a href="javascript:toggle_usage('${w.package.name}');">
-                <span id='count'>${w.package.usage}</span>
+                <span id='count'>${w.card.usage}</span>
                 <span id='count_suffix'>
-                  % if w.package.usage == 1:
+                  % if w.card.usage == 1:
                     person uses this
                   % else:
                     people use this
@@ -1,4 +1,4 @@
-<li id="tag-${w.tag.package.name.replace(' ', '-') + "-" + w.tag.label.replace(' ', '-')}" class="${w.css_class}">
+<li id="tag-${w.tag.package_name.replace(' ', '-') + "-" + w.tag.label.replace(' ', '-')}" class="${w.css_class}">
 <a href="#">${w.tag.label}</a>
 <div id="${str(w.tag.id)}" class="voter">
   <span class="arrow up${w.upcls}"></span>
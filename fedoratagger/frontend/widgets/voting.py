@@ -17,7 +17,6 @@
 # Refer to the README.rst and LICENSE files for full details of the license
 
 import flask
-from sqlalchemy.orm.exc import NoResultFound
 
 import tw2.core
 import tw2.forms
@@ -37,6 +36,30 @@ voting_js = tw2.core.JSLink(
     ],
 )
 
+
+def user_votes(package_ids):
+    """ Return the votes of the current user as a dictionnary mapping tag
+    identifiers to the `like` of the vote.
+
+    The dictionnary is kept for the duration of the request, the votes on
+    the tags of the given packages are loaded with a single query the
+    first time one of these packages is asked for.
+    """
+    if not hasattr(flask.g, 'user_votes'):
+        flask.g.user_votes = {}
+        flask.g.user_votes_packages = set()
+
+    missing = set(package_ids) - flask.g.user_votes_packages
+    if missing:
+        flask.g.user_votes_packages.update(missing)
+        user = flask.g.fas_user
+        if user and user.id is not None:
+            flask.g.user_votes.update(
+                m.Vote.likes_of_user(ft.SESSION, user.id, missing))
+
+    return flask.g.user_votes
+
+
 class TagWidget(tw2.forms.LabelField):
     """ Tiny Voting Widget """
 
@@ -46,16 +69,10 @@ class TagWidget(tw2.forms.LabelField):
 
     @property
     def _like(self):
-        user = flask.g.fas_user
-        if not user:
+        vote = user_votes([self.tag.package_id]).get(self.tag.id)
+        if vote is None:
             return 0
-
-        try:
-            voteobj = m.Vote.get(ft.SESSION, user_id=user.id, tag_id=self.tag.id)
-        except NoResultFound:
-            return 0
-
-        if voteobj.like:
+        elif vote:
             return 1
         else:
             return -1
@@ -22,21 +22,166 @@
 import base64
 import random
 import string
+import threading
+import time
 from datetime import date
 
 import fedmsg
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.pool import QueuePool
 
 import model
+import vote_buffer
 
+from blacklist import blacklisted
 from sqlite_export import sqlitebuildtags
+from columnar_export import columnarratings, columnartags
 
 
-def create_session(db_url, debug=False, pool_recycle=3600):
+class RoutingSession(Session):
+    """ A session able to send its reads to a read-only replica.
+
+    By default everything goes to the primary database, use_replica()
+    makes the following queries go to one of the replicas until something
+    is written: from the first flush on, the session sticks to the primary
+    so it reads its own writes.
+    """
+
+    def __init__(self, replicas=(), **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = list(replicas)
+        self.replica = None
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None:
+            return self.replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def use_replica(self):
+        """ Send the reads to a random replica, if there are any. """
+        if self.replicas and not self.wrote:
+            self.replica = random.choice(self.replicas)
+
+    def use_primary(self):
+        """ Send everything to the primary database. """
+        self.replica = None
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _stick_to_primary(session, flush_context, instances):
+    session.wrote = True
+    session.use_primary()
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool keeping track of the time spent waiting for a
+    connection, see stats().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.time()
+        timeout = False
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except TimeoutError:
+            timeout = True
+            raise
+        finally:
+            wait = time.time() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timeout
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+    def stats(self):
+        """ Return the usage of the pool and the checkout waits (in
+        seconds) since the pool was created, in this process.
+        """
+        with self._stats_lock:
+            return dict(
+                size=self.size(),
+                checked_out=self.checkedout(),
+                overflow=self.overflow(),
+                checkouts=self.checkouts,
+                timeouts=self.timeouts,
+                wait_total=self.wait_total,
+                wait_max=self.wait_max,
+                wait_mean=self.wait_total / self.checkouts
+                if self.checkouts else 0.0,
+            )
+
+
+def _set_statement_timeout(engine, timeout):
+    """ Abort the statements of the engine lasting more than `timeout`
+    milliseconds, on PostgreSQL and MySQL.
+    """
+    queries = {
+        'postgresql': 'SET statement_timeout = %i',
+        'mysql': 'SET SESSION max_execution_time = %i',
+    }
+    if engine.dialect.name not in queries:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(queries[engine.dialect.name] % timeout)
+        cursor.close()
+        # Otherwise the first rollback of the connection reverts it.
+        dbapi_connection.commit()
+
+
+def create_db_engine(db_url, debug=False, pool_recycle=3600,
+                     pool_size=None, max_overflow=None, pool_timeout=None,
+                     pool_pre_ping=False, statement_timeout=None):
+    """ Create the engine connecting to a database.
+
+    :arg db_url: URL used to connect to the database.
+    :arg debug: a boolean specifying wether we should have the verbose
+        output of sqlalchemy or not.
+    :kwarg pool_size, max_overflow, pool_timeout: the settings of the
+        connection pool, a TimedQueuePool.  They are ignored with SQLite,
+        which keeps its default pool.  None keeps the default of
+        sqlalchemy.
+    :kwarg pool_pre_ping: a boolean specifying wether the connections are
+        tested before being used.
+    :kwarg statement_timeout: a number of milliseconds after which the
+        statements are aborted, see _set_statement_timeout.
+    """
+    kwargs = dict(echo=debug, pool_recycle=pool_recycle,
+                  pool_pre_ping=pool_pre_ping)
+    if not make_url(db_url).drivername.startswith('sqlite'):
+        kwargs['poolclass'] = TimedQueuePool
+        for key, value in [('pool_size', pool_size),
+                           ('max_overflow', max_overflow),
+                           ('pool_timeout', pool_timeout)]:
+            if value is not None:
+                kwargs[key] = value
+    engine = create_engine(db_url, **kwargs)
+    if statement_timeout:
+        _set_statement_timeout(engine, statement_timeout)
+    return engine
+
+
+def create_session(db_url, debug=False, pool_recycle=3600, read_urls=None,
+                   **kwargs):
     """ Create the Session object to use to query the database.
 
     :arg db_url: URL used to connect to the database. The URL contains
@@ -45,13 +190,38 @@ def create_session(db_url, debug=False, pool_recycle=3600):
       ie: <engine>://<user>:<password>@<host>/<dbname>
     :arg debug: a boolean specifying wether we should have the verbose
         output of sqlalchemy or not.
+    :kwarg read_urls: a list of URLs of read-only replicas of the database
+        the reads can be sent to, see RoutingSession.
+    :kwarg kwargs: the settings of the connection pools and the statement
+        timeout, see create_db_engine.
     :return a Session that can be used to query the database.
     """
-    engine = create_engine(db_url, echo=debug, pool_recycle=pool_recycle)
-    scopedsession = scoped_session(sessionmaker(bind=engine))
+    engine = create_db_engine(db_url, debug, pool_recycle, **kwargs)
+    replicas = [
+        create_db_engine(url, debug, pool_recycle, **kwargs)
+        for url in read_urls or []
+    ]
+    scopedsession = scoped_session(sessionmaker(
+        bind=engine, class_=RoutingSession, replicas=replicas))
     return scopedsession
 
 
+def pool_stats(session):
+    """ Return the statistics of the connection pools of a scoped session,
+    for the primary database and for each of its replicas.
+    """
+    def _stats(engine):
+        if isinstance(engine.pool, TimedQueuePool):
+            return engine.pool.stats()
+        return dict(status=engine.pool.status())
+
+    kwargs = session.session_factory.kw
+    return dict(
+        primary=_stats(kwargs['bind']),
+        replicas=[_stats(engine) for engine in kwargs.get('replicas', [])],
+    )
+
+
 def add_tag(session, pkgname, tag, user):
     """ Add a provided tag to the specified package. """
 
@@ -73,6 +243,8 @@ def add_tag(session, pkgname, tag, user):
         session.flush()
         user.score += 2
     voteobj = model.Vote(user_id=user.id, tag_id=tagobj.id, like=True)
+    package.touch()
+    model.Change.record(session, 'tag', package.id, tagobj.label)
     session.add(user)
     session.add(voteobj)
     session.flush()
@@ -109,6 +281,9 @@ def set_usage(session, pkgname, user, usage):
         session.add(usageobj)
         usage = True
 
+    model.Usage.cache(session)[(user.id, package.id)] = usage
+    package.touch()
+    model.Change.record(session, 'usage', package.id)
     session.flush()
     fedmsg.publish('usage.toggle', msg=dict(
         user=user.__json__(session),
@@ -145,8 +320,13 @@ def add_rating(session, pkgname, rating, user):
         session.add(user)
         message = 'Rating "%s" added to the package "%s"' % (rating, pkgname)
 
+    package.touch()
+    model.Change.record(session, 'rating', package.id)
     session.add(ratingobj)
     session.flush()
+    # Now that the rating is stored, update the average of the package.
+    package.update_rating()
+    session.flush()
 
     fedmsg.publish('rating.update', msg=dict(
         rating=ratingobj.__json__(session),
@@ -164,6 +344,7 @@ def add_vote(session, pkgname, tag, vote, user):
         raise TaggerapiException('This tag could not be found associated'
                                  ' to this package')
     verb = 'changed'
+    score = 0
     try:
         # if the vote already exist, replace it
         voteobj = model.Vote.get(session, user_id=user.id,
@@ -173,24 +354,31 @@ def add_vote(session, pkgname, tag, vote, user):
                    'not change' % (tag, pkgname)
         else:
             if voteobj.like:
-                tagobj.like -= 1
-                tagobj.dislike += 1
+                likes, dislikes = -1, 1
             else:
-                tagobj.dislike -= 1
-                tagobj.like += 1
+                likes, dislikes = 1, -1
             voteobj.like = vote
     except NoResultFound:
         # otherwise, create it
         verb = 'added'
         voteobj = model.Vote(user_id=user.id, tag_id=tagobj.id, like=vote)
-        if vote:
-            tagobj.like += 1
-        else:
-            tagobj.dislike += 1
-        user.score += 0.5
-
-    session.add(user)
-    session.add(tagobj)
+        likes, dislikes = (1, 0) if vote else (0, 1)
+        score = 0.5
+
+    if vote_buffer.BUFFER.running:
+        # The counters are updated by the buffer once the vote is
+        # committed, it also records the change.
+        session.info.setdefault('vote_buffer', []).append((
+            tagobj.id, package.id, tagobj.label, likes, dislikes, user.id,
+            score))
+    else:
+        tagobj.like += likes
+        tagobj.dislike += dislikes
+        user.score += score
+        package.touch()
+        model.Change.record(session, 'tag', package.id, tagobj.label)
+        session.add(user)
+        session.add(tagobj)
     session.add(voteobj)
     session.flush()
 
@@ -256,35 +444,41 @@ def statistics(session):
     }
 
 
-def statistics_by_user(session, user, fields="all"):
+def statistics_by_user(session, user, fields="all", after=None, limit=None):
     """ Handles the /statistics/<user> path.
 
     Returns a dictionnary of statistics of an user votes.
-    """
-    votes = model.Vote.get_votes_user(session, user.id)
-
-    votes_like = votes_dislike = dict()
-    total_like = total_dislike = total_votes = 0
-
-    if votes:
-        votes_like = \
-            [(v.tag.package.name, v.tag.label) for v in votes if v.like]
-        votes_dislike = \
-            [(v.tag.package.name, v.tag.label) for v in votes if not v.like]
 
-        total_like = len(votes_like)
-        total_dislike = len(votes_dislike)
-        total_votes = total_like + total_dislike
+    With fields set to "all", the votes themselves are listed, at most
+    `limit` of them after the vote identifier `after`, and `next` holds the
+    identifier to continue from (None when all the votes were listed).
+    """
+    total_like, total_dislike = model.Vote.count_votes_user(session, user.id)
+    total_votes = total_like + total_dislike
 
-    if fields == "all":
-        return dict(like=votes_like, total_like=total_like,
-                    dislike=votes_dislike, total_dislike=total_dislike,
-                    total=total_votes)
-    else:
+    if fields != "all":
         return dict(total_like=total_like,
                     total_dislike=total_dislike,
                     total=total_votes)
 
+    votes = model.Vote.get_votes_user(
+        session, user.id, after=after,
+        limit=limit + 1 if limit is not None else None)
+    next_vote = None
+    if limit is not None and len(votes) > limit:
+        votes = votes[:limit]
+        next_vote = votes[-1].id
+
+    votes_like = \
+        [(v.tag.package.name, v.tag.label) for v in votes if v.like]
+    votes_dislike = \
+        [(v.tag.package.name, v.tag.label) for v in votes if not v.like]
+
+    return dict(like=votes_like, total_like=total_like,
+                dislike=votes_dislike, total_dislike=total_dislike,
+                total=total_votes, next=next_vote)
+
+
 def leaderboard(session):
     """ Handles the /leaderboard/ path.
 
@@ -347,17 +541,3 @@ class TaggerapiException(Exception):
     """ Generic exception class used to manage exception from taggerapi. """
     pass
 
-
-def blacklisted(tag):
-    """ Return true if the given string is blacklisted (not allowed) """
-    return tag in _dirty_words
-
-
-def _load_dirty_words():
-    import os
-    sep = os.path.sep
-    dirname = sep.join(os.path.abspath(__file__).split(sep)[:-2])
-    with open(dirname + "/dirtywords.txt") as f:
-        return [line.strip() for line in f.readlines()]
-
-_dirty_words = _load_dirty_words()
@@ -0,0 +1,391 @@
+"""
+Tagger benchmark: populate a database with a large synthetic dataset, then
+drive the API and frontend endpoints through the Flask test client and
+report the latency percentiles, the number of queries per request and the
+peak memory of the process as JSON, to be compared between commits.
+
+The script Should be run as:
+
+fedoratagger-bench --db-url sqlite:////tmp/tagger-bench.sqlite > before.json
+
+and, to run the requests again on an already populated database:
+
+fedoratagger-bench --db-url sqlite:////tmp/tagger-bench.sqlite --no-populate
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+
+from sqlalchemy import and_, event, func, select
+
+import model as m
+import fedoratagger as ft
+
+import logging
+
+log = logging.getLogger("fedoratagger-bench")
+log.setLevel(logging.DEBUG)
+logging.basicConfig()
+
+BATCH = 10000
+
+
+def zipf_counts(total, n, exponent=0.8):
+    """ Split `total` items over `n` owners following a Zipf law: the
+    owner of rank i gets a share proportional to 1 / (i + 1) ** exponent.
+    """
+    weights = [1.0 / (i + 1) ** exponent for i in xrange(n)]
+    scale = float(total) / sum(weights)
+    return [int(round(weight * scale)) for weight in weights]
+
+
+def skewed_sample(rand, n, k, skew=3):
+    """ Return k distinct integers out of range(n), the lowest ones being
+    the most likely to be picked.
+    """
+    k = min(k, n)
+    if k * 2 > n:
+        return rand.sample(xrange(n), k)
+    picked = set()
+    while len(picked) < k:
+        picked.add(int(n * rand.random() ** skew))
+    return picked
+
+
+def populate(session, packages=50000, tags=500000, votes=5000000,
+             users=200000, ratings=200000, usages=200000, labels=20000,
+             seed=42):
+    """ Fill the database with a synthetic dataset whose distributions are
+    skewed like on the real instance: a few packages get most of the tags,
+    a few labels are used on most packages and a few users cast most of
+    the votes, ratings and usages.
+
+    The tag counters, user scores and package ratings are then computed
+    from the votes and ratings, so that the dataset is consistent.
+
+    :arg session: the session used to query the database
+    :return: a dictionnary with the number of rows of each table.
+    """
+    rand = random.Random(seed)
+    engine = session.bind
+
+    def insert(table, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH:
+                engine.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            engine.execute(table.insert(), batch)
+
+    log.info('Inserting %i packages' % packages)
+    insert(m.Package.__table__, ({
+        'id': i + 1,
+        'name': u'package-%i' % i,
+        'summary': u'' if rand.random() < 0.05 else u'Package number %i' % i,
+        # Avoid hitting fedora-packages for the icons and summaries.
+        '_meta': u'{"icon": "package-%i", "summary": ""}' % i,
+    } for i in xrange(packages)))
+
+    log.info('Inserting %i users' % users)
+    insert(m.FASUser.__table__, ({
+        'id': i + 1,
+        'username': u'user-%i' % i,
+        'anonymous': rand.random() < 0.3,
+        'score': 0,
+    } for i in xrange(users)))
+
+    # The lowest identifiers are the most popular packages, labels and
+    # users.
+    log.info('Inserting %i tags' % tags)
+
+    def tag_rows():
+        tag_id = 0
+        for package, count in enumerate(zipf_counts(tags, packages)):
+            for label in skewed_sample(rand, labels, count):
+                tag_id += 1
+                yield {
+                    'id': tag_id,
+                    'package_id': package + 1,
+                    'label': u'label-%i' % label,
+                    'like': 0,
+                    'dislike': 0,
+                }
+    insert(m.Tag.__table__, tag_rows())
+    n_tags = session.query(func.count(m.Tag.id)).scalar()
+
+    log.info('Inserting %i votes' % votes)
+
+    def vote_rows():
+        for user, count in enumerate(zipf_counts(votes, users)):
+            for tag in skewed_sample(rand, n_tags, count):
+                yield {
+                    'user_id': user + 1,
+                    'tag_id': tag + 1,
+                    'like': rand.random() < 0.8,
+                }
+    insert(m.Vote.__table__, vote_rows())
+
+    for cls, total in ((m.Rating, ratings), (m.Usage, usages)):
+        log.info('Inserting %i %s' % (total, cls.__tablename__))
+
+        def rows():
+            for user, count in enumerate(zipf_counts(total, users)):
+                for package in skewed_sample(rand, packages, count):
+                    row = {'user_id': user + 1, 'package_id': package + 1}
+                    if cls is m.Rating:
+                        row['rating'] = rand.choice([0, 25, 50, 75, 100])
+                    yield row
+        insert(cls.__table__, rows())
+
+    log.info('Computing the counters')
+    tag = m.Tag.__table__
+    vote = m.Vote.__table__
+    user = m.FASUser.__table__
+    package = m.Package.__table__
+    rating = m.Rating.__table__
+
+    def count_votes(*where):
+        return select([func.count(vote.c.id)]).where(and_(*where)).as_scalar()
+
+    engine.execute(tag.update().values(
+        like=count_votes(vote.c.tag_id == tag.c.id, vote.c.like == True),
+        dislike=count_votes(vote.c.tag_id == tag.c.id, vote.c.like == False),
+    ))
+    engine.execute(user.update().values(
+        score=count_votes(vote.c.user_id == user.c.id)))
+    engine.execute(package.update().values(
+        avg_rating=select([func.avg(rating.c.rating)]).where(
+            rating.c.package_id == package.c.id).as_scalar(),
+        n_ratings=select([func.count(rating.c.id)]).where(
+            rating.c.package_id == package.c.id).as_scalar(),
+    ))
+
+    return dict([
+        (cls.__tablename__, session.query(func.count(cls.id)).scalar())
+        for cls in (m.Package, m.Tag, m.Vote, m.FASUser, m.Rating, m.Usage)
+    ])
+
+
+def endpoints(session, seed=42):
+    """ Return the requests to benchmark, as a list of (name, method,
+    number of runs relative to the others, function returning the url and
+    the data of a request) tuples.  The requests use the popular packages,
+    labels and users more often, like the real traffic.
+    """
+    rand = random.Random(seed)
+    n_packages = session.query(func.max(m.Package.id)).scalar()
+    n_tags = session.query(func.max(m.Tag.id)).scalar()
+    n_users = session.query(func.max(m.FASUser.id)).scalar()
+
+    def one(cls, column, n):
+        ident = list(skewed_sample(rand, n, 1))[0] + 1
+        return session.query(column).filter(cls.id >= ident).order_by(
+            cls.id).limit(1).scalar()
+
+    def package():
+        return one(m.Package, m.Package.name, n_packages)
+
+    def label():
+        return one(m.Tag, m.Tag.label, n_tags)
+
+    def username():
+        return one(m.FASUser, m.FASUser.username, n_users)
+
+    def tag_of(name):
+        return session.query(m.Tag.label).join(
+            m.Package, m.Package.id == m.Tag.package_id
+        ).filter(m.Package.name == name).limit(1).scalar() or u'label-0'
+
+    def get(url):
+        return lambda: (url(), None)
+
+    def put(url, **fields):
+        def request():
+            name = package()
+            data = dict([(key, value(name) if callable(value) else value)
+                         for key, value in fields.items()])
+            data['pkgname'] = name
+            return url % name, data
+        return request
+
+    return [
+        ('frontend home', 'GET', 1, get(lambda: '/')),
+        ('frontend package', 'GET', 1, get(lambda: '/%s' % package())),
+        ('frontend card', 'GET', 1, get(lambda: '/card/%s' % package())),
+        ('frontend details', 'GET', 1,
+         get(lambda: '/details/%s' % package())),
+        ('frontend leaderboard', 'GET', 1, get(lambda: '/leaderboard')),
+        ('frontend heartbeat', 'GET', 1, get(lambda: '/_heartbeat')),
+        ('frontend raw', 'GET', 1, get(lambda: '/raw/%s' % package())),
+        ('api package', 'GET', 1, get(lambda: '/api/v1/%s/' % package())),
+        ('api package tags', 'GET', 1,
+         get(lambda: '/api/v1/%s/tag/' % package())),
+        ('api package rating', 'GET', 1,
+         get(lambda: '/api/v1/%s/rating/' % package())),
+        ('api package usage', 'GET', 1,
+         get(lambda: '/api/v1/%s/usage/' % package())),
+        ('api package suggest', 'GET', 1,
+         get(lambda: '/api/v1/%s/suggest/' % package())),
+        ('api package similar', 'GET', 1,
+         get(lambda: '/api/v1/%s/similar/' % package())),
+        ('api ratings', 'GET', 1, get(lambda: '/api/v1/ratings/%s/' % ','.join(
+            [package() for _ in range(10)]))),
+        ('api tag', 'GET', 1, get(lambda: '/api/v1/tag/%s/' % label())),
+        ('api rating', 'GET', 1, get(lambda: '/api/v1/rating/75/')),
+        ('api rating range', 'GET', 1,
+         get(lambda: '/api/v1/rating/range/?min=50&max=60')),
+        ('api rating top', 'GET', 1, get(lambda: '/api/v1/rating/top/')),
+        ('api random', 'GET', 1, get(lambda: '/api/v1/random/')),
+        ('api leaderboard', 'GET', 1, get(lambda: '/api/v1/leaderboard/')),
+        ('api score', 'GET', 1,
+         get(lambda: '/api/v1/score/%s/' % username())),
+        ('api statistics user', 'GET', 1,
+         get(lambda: '/api/v1/statistics-user/%s/all' % username())),
+        ('api changes', 'GET', 1, get(lambda: '/api/v1/changes/?since=0')),
+        ('api statistics', 'GET', 0.1, get(lambda: '/api/v1/statistics/')),
+        ('api tag dump', 'GET', 0.1, get(lambda: '/api/v1/tag/dump/')),
+        ('api tag export', 'GET', 0.1, get(lambda: '/api/v1/tag/export/')),
+        ('api tag sqlite', 'GET', 0.1,
+         get(lambda: '/api/v1/tag/sqlitebuildtags/')),
+        ('api tag columnar', 'GET', 0.1,
+         get(lambda: '/api/v1/tag/columnar/')),
+        ('api rating dump', 'GET', 0.1, get(lambda: '/api/v1/rating/dump/')),
+        ('api rating columnar', 'GET', 0.1,
+         get(lambda: '/api/v1/rating/columnar/')),
+        ('api add tag', 'PUT', 1, put(
+            '/api/v1/tag/%s/',
+            tag=lambda name: u'bench-%i' % rand.randint(0, 99))),
+        ('api add rating', 'PUT', 1, put(
+            '/api/v1/rating/%s/',
+            rating=lambda name: rand.choice([20, 50, 100]))),
+        ('api vote', 'PUT', 1, put(
+            '/api/v1/vote/%s/', tag=tag_of,
+            vote=lambda name: rand.choice([1, -1]))),
+        ('api usage', 'PUT', 1, put(
+            '/api/v1/usage/%s/',
+            usage=lambda name: rand.choice(['true', 'false']))),
+    ]
+
+
+def percentile(values, percent):
+    """ Return the given percentile of a sorted list of values. """
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def run(session, requests=20, seed=42):
+    """ Run the requests of every endpoint through the test client.
+
+    :arg session: the session used to query the database
+    :kwarg requests: the number of requests sent to each endpoint, the
+        bulk exports get a tenth of it.
+    :return: a dictionnary of the statistics of each endpoint.
+    """
+    client = ft.APP.test_client()
+    rand = random.Random(seed)
+    queries = [0]
+
+    def count_queries(*args):
+        queries[0] += 1
+
+    event.listen(session.bind, 'before_cursor_execute', count_queries)
+    results = {}
+    try:
+        for name, method, weight, request in endpoints(session, seed):
+            durations, n_queries, errors = [], [], 0
+            for _ in xrange(max(1, int(requests * weight))):
+                url, data = request()
+                # Spread the anonymous writes over many users.
+                environ = {'REMOTE_ADDR': '10.0.%i.%i' % (
+                    rand.randint(0, 255), rand.randint(0, 255))}
+                queries[0] = 0
+                start = time.time()
+                response = client.open(
+                    url, method=method, data=data, environ_base=environ,
+                    buffered=True)
+                durations.append((time.time() - start) * 1000)
+                n_queries.append(queries[0])
+                if response.status_code >= 500:
+                    errors += 1
+            durations.sort()
+            results[name] = {
+                'requests': len(durations),
+                'errors': errors,
+                'p50_ms': percentile(durations, 50),
+                'p90_ms': percentile(durations, 90),
+                'p99_ms': percentile(durations, 99),
+                'max_ms': durations[-1],
+                'queries_mean': sum(n_queries) / float(len(n_queries)),
+                'queries_max': max(n_queries),
+            }
+            log.info('%s: p50 %.1fms, %.1f queries' % (
+                name, results[name]['p50_ms'],
+                results[name]['queries_mean']))
+    finally:
+        event.remove(session.bind, 'before_cursor_execute', count_queries)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark tagger on a synthetic dataset')
+    parser.add_argument('--db-url', dest='db_url',
+                        default='sqlite:////tmp/tagger-bench.sqlite',
+                        help="The database to populate and benchmark")
+    parser.add_argument('--no-populate', dest='populate',
+                        action='store_false', default=True,
+                        help="Benchmark the existing content of the database")
+    for name, default in (('packages', 50000), ('tags', 500000),
+                          ('votes', 5000000), ('users', 200000),
+                          ('ratings', 200000), ('usages', 200000),
+                          ('labels', 20000)):
+        parser.add_argument('--%s' % name, type=int, default=default,
+                            help="Number of %s to create" % name)
+    parser.add_argument('--requests', type=int, default=20,
+                        help="Number of requests sent to each endpoint")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None,
+                        help="File to write the JSON report to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    session = m.create_tables(args.db_url)
+    ft.SESSION = session
+    # Start from an empty in-process cache, like a fresh worker.
+    from fedoratagger.frontend.widgets.card import cards
+    cards.clear()
+
+    report = {'db_url': args.db_url.split('@')[-1]}
+    if args.populate:
+        start = time.time()
+        report['dataset'] = populate(
+            session, args.packages, args.tags, args.votes, args.users,
+            args.ratings, args.usages, args.labels, args.seed)
+        report['populate_s'] = time.time() - start
+        session.remove()
+
+    report['endpoints'] = run(session, args.requests, args.seed)
+    # ru_maxrss is in kilobytes on Linux.
+    report['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            stream.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" The words which are not allowed in the tags.
+
+The labels are normalized before being matched: accents, case,
+punctuation and the usual leetspeak substitutions are ignored.  A label
+is blacklisted when its normalized form or one of its words is in the
+list, or when it contains one of the words long enough (see
+SUBSTRING_MIN_LENGTH) not to ban legitimate words like 'shell' or
+'classes'.
+
+The word list is read from WORDS_FILE and reloaded when the file changes,
+so it can be edited without restarting the application.
+"""
+
+import collections
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from kitchen.text.converters import to_unicode
+
+from cache import LRUCache
+
+WORDS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'dirtywords.txt')
+
+# Number of seconds between two checks of the modification of WORDS_FILE.
+RELOAD_INTERVAL = 5
+
+# The shorter words are only matched as whole words.
+SUBSTRING_MIN_LENGTH = 6
+
+# The labels which are allowed but not shown on the cards, see banned.
+HIDDEN_PREFIXES = (u'x-',)
+HIDDEN_LABELS = frozenset([u'application', u'system', u'utility'])
+
+_leet = dict((ord(key), value) for key, value in {
+    u'0': u'o', u'1': u'i', u'3': u'e', u'4': u'a', u'5': u's',
+    u'7': u't', u'8': u'b', u'@': u'a', u'$': u's', u'!': u'i',
+    u'|': u'i', u'+': u't',
+}.items())
+_separators = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def tokens(label):
+    """ Return the normalized words of a label. """
+    label = unicodedata.normalize('NFKD', to_unicode(label))
+    label = u''.join(char for char in label
+                     if not unicodedata.combining(char))
+    label = label.lower().translate(_leet)
+    return [token for token in _separators.split(label) if token]
+
+
+def normalize(label):
+    """ Return the normalized form of a label, its words stuck together. """
+    return u''.join(tokens(label))
+
+
+class Matcher(object):
+    """ Find the words of a list in the labels.
+
+    The whole words are looked up in a set, the substrings with an
+    Aho-Corasick automaton built once, so matching a label is linear in
+    its length whatever the number of words.
+    """
+
+    def __init__(self, words, substring_min_length=SUBSTRING_MIN_LENGTH):
+        self.words = frozenset(normalize(word) for word in words) - \
+            frozenset([u''])
+        self._cache = LRUCache(10000)
+
+        # The automaton: transitions, failure links and the word found
+        # when reaching each state, the state 0 being the root.
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        for word in self.words:
+            if len(word) >= substring_min_length:
+                self._add(word)
+        self._link()
+
+    def _add(self, word):
+        state = 0
+        for char in word:
+            if char not in self._goto[state]:
+                self._goto[state][char] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = self._goto[state][char]
+        self._output[state] = word
+
+    def _link(self):
+        """ Compute the failure links, breadth first. """
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def search(self, text):
+        """ Return the first word of the automaton found in the text. """
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state] is not None:
+                return self._output[state]
+        return None
+
+    def match(self, label):
+        """ Return the word of the list found in the label, or None. """
+        found = self._cache.get(label, False)
+        if found is not False:
+            return found
+
+        words = tokens(label)
+        text = u''.join(words)
+        found = self.search(text)
+        for word in [text] + words:
+            if word in self.words:
+                found = word
+                break
+        self._cache.set(label, found)
+        return found
+
+
+class Blacklist(object):
+    """ The matcher of a word list file, rebuilt when the file changes. """
+
+    def __init__(self, filename=WORDS_FILE, interval=RELOAD_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self.version = 0
+        self._matcher = None
+        self._stat = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def matcher(self):
+        """ Return the Matcher of the current content of the file. """
+        if self._matcher is None \
+                or time.time() - self._checked >= self.interval:
+            with self._lock:
+                self._reload()
+        return self._matcher
+
+    def _reload(self):
+        self._checked = time.time()
+        stat = os.stat(self.filename)
+        stat = (stat.st_mtime, stat.st_size)
+        if stat == self._stat:
+            return
+        with open(self.filename) as f:
+            words = [line.decode('utf-8').strip() for line in f]
+        self._matcher = Matcher(words)
+        self._stat = stat
+        self.version += 1
+
+
+_blacklist = Blacklist()
+
+
+def blacklisted(label):
+    """ Return True if the label contains a word which is not allowed. """
+    return _blacklist.matcher().match(label) is not None
+
+
+def banned(label):
+    """ Return True if the label must not be shown on the cards.
+
+    https://github.com/ralphbean/fedora-tagger/issues/16
+    """
+    label = to_unicode(label)
+    return label.startswith(HIDDEN_PREFIXES) \
+        or label in HIDDEN_LABELS \
+        or blacklisted(label)
+
+
+def version():
+    """ Return a number changing each time the word list is reloaded. """
+    _blacklist.matcher()
+    return _blacklist.version
@@ -0,0 +1,69 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" Small in-process caches shared by the threads of a worker. """
+
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+class LRUCache(object):
+    """ A thread-safe mapping keeping at most `size` entries, the least
+    recently used entries are dropped first.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return the value stored for key, or default. """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """ Store value under key, evicting old entries if needed. """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ Remove key from the cache and return its value. """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """ Empty the cache. """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,232 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" Functions for exporting the tags and the ratings in a compact,
+columnar, binary form.
+
+All the numbers are little-endian and every section starts on a 4 bytes
+boundary, so the file can be memory-mapped and its columns used in place
+(for example with ``numpy.frombuffer(data, '<i4', count, offset)``).
+
+Layout of the tags::
+
+    magic           4 bytes, 'FTAG'
+    version         uint32, currently 1
+    n_packages      uint32
+    n_labels        uint32
+    n_tags          uint32
+
+    package names   uint32[n_packages + 1] offsets in the blob below,
+                    then the utf-8 names concatenated, padded to 4 bytes
+    tag labels      uint32[n_labels + 1] offsets in the blob below,
+                    then the utf-8 labels concatenated, padded to 4 bytes
+
+    package         int32[n_tags], index in the package names
+    label           int32[n_tags], index in the tag labels
+    score           int32[n_tags], likes minus dislikes of the tag
+
+Every package of the database is listed in the package names, including
+the ones without any tag.
+
+Layout of the ratings::
+
+    magic           4 bytes, 'FRAT'
+    version         uint32, currently 1
+    n_packages      uint32
+
+    package names   uint32[n_packages + 1] offsets in the blob below,
+                    then the utf-8 names concatenated, padded to 4 bytes
+
+    rating          int32[n_packages], average rating times 10, rounded,
+                    -1 for the packages never rated
+    n_ratings       int32[n_packages], number of ratings
+    usage           int32[n_packages], number of users
+
+Only the packages rated or used are listed.
+"""
+
+import array
+import struct
+import sys
+
+MAGIC = 'FTAG'
+VERSION = 1
+RATINGS_MAGIC = 'FRAT'
+RATINGS_VERSION = 1
+
+_header = struct.Struct('<4sIIII')
+_ratings_header = struct.Struct('<4sII')
+
+
+def _int_array(typecode, values=()):
+    """ Return an array.array of 4 bytes integers ('i' or 'I'). """
+    values = array.array(typecode, values)
+    assert values.itemsize == 4
+    return values
+
+
+def _to_bytes(values):
+    """ Return the little-endian representation of an array. """
+    if sys.byteorder == 'big':  # pragma: no cover
+        values = _int_array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def _from_bytes(typecode, data, offset, count):
+    """ Read `count` little-endian integers from data at offset. """
+    values = _int_array(typecode)
+    values.fromstring(data[offset:offset + 4 * count])
+    if sys.byteorder == 'big':  # pragma: no cover
+        values.byteswap()
+    return values
+
+
+def _pack_strings(strings):
+    """ Return the offsets + blob representation of a list of strings. """
+    blobs = [string.encode('utf-8') for string in strings]
+    offsets = _int_array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    blob = ''.join(blobs)
+    return _to_bytes(offsets) + blob + '\0' * (-len(blob) % 4)
+
+
+def _unpack_strings(data, offset, count):
+    """ Read a string table, return the strings and the next offset. """
+    offsets = _from_bytes('I', data, offset, count + 1)
+    start = offset + 4 * (count + 1)
+    strings = [
+        data[start + offsets[i]:start + offsets[i + 1]].decode('utf-8')
+        for i in range(count)
+    ]
+    end = start + offsets[count]
+    return strings, end + (-end % 4)
+
+
+def columnartags(rows):
+    """ Return the columnar dump of the tags.
+
+    :arg rows: an iterable of (package name, tag label, score) tuples
+        ordered by package as returned by `model.Tag.export`, the label
+        and the score being None for the packages without tags.
+    """
+    packages, labels = [], []
+    package_index, label_index = {}, {}
+    package_col = _int_array('i')
+    label_col = _int_array('i')
+    score_col = _int_array('i')
+
+    for name, label, score in rows:
+        if name not in package_index:
+            package_index[name] = len(packages)
+            packages.append(name)
+        if label is None:
+            continue
+        if label not in label_index:
+            label_index[label] = len(labels)
+            labels.append(label)
+        package_col.append(package_index[name])
+        label_col.append(label_index[label])
+        score_col.append(score)
+
+    return ''.join([
+        _header.pack(MAGIC, VERSION, len(packages), len(labels),
+                     len(score_col)),
+        _pack_strings(packages),
+        _pack_strings(labels),
+        _to_bytes(package_col),
+        _to_bytes(label_col),
+        _to_bytes(score_col),
+    ])
+
+
+def load_columnartags(data):
+    """ Parse a columnar dump of the tags.
+
+    Returns a dictionnary with the `packages` and `labels` lists and the
+    `package`, `label` and `score` columns as arrays of integers.
+
+    :arg data: the raw dump, a string or a mmap object.
+    """
+    magic, version, n_packages, n_labels, n_tags = \
+        _header.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version %i columnar tag dump' % VERSION)
+
+    packages, offset = _unpack_strings(data, _header.size, n_packages)
+    labels, offset = _unpack_strings(data, offset, n_labels)
+
+    output = dict(packages=packages, labels=labels)
+    for column in ('package', 'label', 'score'):
+        output[column] = _from_bytes('i', data, offset, n_tags)
+        offset += 4 * n_tags
+    return output
+
+
+def columnarratings(rows):
+    """ Return the columnar dump of the ratings.
+
+    :arg rows: an iterable of (package name, average rating, number of
+        ratings, number of users) tuples as returned by
+        `model.Rating.dump`, the average rating being None for the
+        packages never rated.
+    """
+    packages = []
+    rating_col = _int_array('i')
+    n_ratings_col = _int_array('i')
+    usage_col = _int_array('i')
+
+    for name, rating, n_ratings, n_usages in rows:
+        packages.append(name)
+        rating_col.append(-1 if rating is None
+                          else int(round(rating * 10)))
+        n_ratings_col.append(n_ratings)
+        usage_col.append(n_usages)
+
+    return ''.join([
+        _ratings_header.pack(RATINGS_MAGIC, RATINGS_VERSION, len(packages)),
+        _pack_strings(packages),
+        _to_bytes(rating_col),
+        _to_bytes(n_ratings_col),
+        _to_bytes(usage_col),
+    ])
+
+
+def load_columnarratings(data):
+    """ Parse a columnar dump of the ratings.
+
+    Returns a dictionnary with the `packages` list and the `rating`,
+    `n_ratings` and `usage` columns as arrays of integers.
+
+    :arg data: the raw dump, a string or a mmap object.
+    """
+    magic, version, n_packages = _ratings_header.unpack_from(data, 0)
+    if magic != RATINGS_MAGIC or version != RATINGS_VERSION:
+        raise ValueError(
+            'Not a version %i columnar rating dump' % RATINGS_VERSION)
+
+    packages, offset = _unpack_strings(data, _ratings_header.size,
+                                       n_packages)
+
+    output = dict(packages=packages)
+    for column in ('rating', 'n_ratings', 'usage'):
+        output[column] = _from_bytes('i', data, offset, n_packages)
+        offset += 4 * n_packages
+    return output
@@ -0,0 +1,169 @@
+"""
+Tagger stores anonymous users (hashed IP addresses) in the user table as
+soon as they vote.  This script removes the anonymous users that have
+nothing attached to them anymore and, on demand, expires all the
+contributions of the anonymous users in bulk.
+
+The expiration is not limited to the dormant users: every vote, rating
+and usage ever cast by an anonymous user is removed, whatever its age.
+
+It also removes the changes older than CHANGES_KEEP_DAYS days from the
+change feed.
+
+The script Should be run as:
+
+FEDORATAGGER_CONFIG = /etc/fedora-tagger/fedora-tagger.cfg fedoratagger-compact-users
+
+or, to also drop all the votes, ratings and usages of anonymous users:
+
+FEDORATAGGER_CONFIG = /etc/fedora-tagger/fedora-tagger.cfg fedoratagger-compact-users --expire-votes
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, select
+
+import model as m
+import fedoratagger as ft
+
+import logging
+
+log = logging.getLogger("fedoratagger-compact-users")
+log.setLevel(logging.DEBUG)
+logging.basicConfig()
+
+
+def _anonymous_ids():
+    """ Return a sub-select of the identifiers of all anonymous users. """
+    return select([m.FASUser.id]).where(m.FASUser.anonymous == True)
+
+
+def expire_anonymous_votes(session):
+    """ Remove every vote, rating and usage cast by an anonymous user, be
+    they active or not, and update the counters of the tags they voted on
+    and of the packages they rated accordingly.
+
+    Everything is done with a handful of UPDATE/DELETE statements, only
+    the tags and the packages that change are loaded in memory, for the
+    change feed.
+
+    :arg session: the session used to query the database
+    :return: the number of votes removed.
+    """
+    anonymous = _anonymous_ids()
+    vote = m.Vote.__table__
+    tag = m.Tag.__table__
+
+    # Feed the tags, ratings and usages about to change to the change feed.
+    touched = set()
+    for package_id, label in session.execute(
+            select([tag.c.package_id, tag.c.label]).where(
+                tag.c.id.in_(select([vote.c.tag_id]).where(
+                    vote.c.user_id.in_(anonymous)))
+            ).order_by(tag.c.id)):
+        m.Change.record(session, u'tag', package_id, label)
+        touched.add(package_id)
+    for kind, cls in ((u'rating', m.Rating), (u'usage', m.Usage)):
+        table = cls.__table__
+        for package_id, in session.execute(
+                select([table.c.package_id]).where(
+                    table.c.user_id.in_(anonymous)
+                ).group_by(table.c.package_id).order_by(table.c.package_id)):
+            m.Change.record(session, kind, package_id)
+            touched.add(package_id)
+
+    def anonymous_votes(like):
+        return select([func.count(vote.c.id)]).where(and_(
+            vote.c.tag_id == tag.c.id,
+            vote.c.like == like,
+            vote.c.user_id.in_(anonymous),
+        )).as_scalar()
+
+    session.execute(tag.update().where(
+        tag.c.id.in_(select([vote.c.tag_id]).where(
+            vote.c.user_id.in_(anonymous)))
+    ).values(
+        like=tag.c.like - anonymous_votes(True),
+        dislike=tag.c.dislike - anonymous_votes(False),
+    ))
+
+    rated = [package_id for (package_id,) in session.query(
+        m.Rating.package_id).filter(
+            m.Rating.user_id.in_(anonymous)).distinct()]
+
+    n_votes = session.query(m.Vote).filter(
+        m.Vote.user_id.in_(anonymous)).delete(synchronize_session=False)
+    for cls in (m.Rating, m.Usage):
+        session.query(cls).filter(
+            cls.user_id.in_(anonymous)).delete(synchronize_session=False)
+
+    # Recompute the stored averages of the packages that lost ratings.
+    package = m.Package.__table__
+    rating = m.Rating.__table__
+    for start in range(0, len(rated), 500):
+        session.execute(package.update().where(
+            package.c.id.in_(rated[start:start + 500])
+        ).values(
+            avg_rating=select([func.avg(rating.c.rating)]).where(
+                rating.c.package_id == package.c.id).as_scalar(),
+            n_ratings=select([func.count(rating.c.id)]).where(
+                rating.c.package_id == package.c.id).as_scalar(),
+        ))
+    m.Package.touch_all(session, touched)
+    return n_votes
+
+
+def compact_anonymous_users(session, expire_votes=False):
+    """ Remove the anonymous users having no vote, rating or usage.
+
+    :arg session: the session used to query the database
+    :kwarg expire_votes: a boolean specifying if the contributions of the
+        anonymous users should be removed first, in which case all the
+        anonymous users end up removed.
+    :return: the number of users removed.
+    """
+    if expire_votes:
+        n_votes = expire_anonymous_votes(session)
+        log.info('Expired %i votes of anonymous users' % n_votes)
+
+    return session.query(m.FASUser).filter(
+        m.FASUser.anonymous == True
+    ).filter(
+        ~m.FASUser.votes.any()
+    ).filter(
+        ~m.FASUser.ratings.any()
+    ).filter(
+        ~m.FASUser.usages.any()
+    ).delete(synchronize_session=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--expire-votes',
+        dest='expire_votes',
+        action='store_true',
+        default=False,
+        help="Also remove all the votes, ratings and usages of anonymous "
+        "users, recent or not")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    log.info('Compacting anonymous users.')
+    count = compact_anonymous_users(ft.SESSION, args.expire_votes)
+    ft.SESSION.commit()
+    log.info('Removed %i anonymous users.' % count)
+
+    days = ft.CONFIG.get('CHANGES_KEEP_DAYS')
+    if days:
+        count = m.Change.prune(
+            ft.SESSION, datetime.utcnow() - timedelta(days=days))
+        ft.SESSION.commit()
+        log.info('Removed %i changes older than %i days.' % (count, days))
+
+
+if __name__ == '__main__':
+    main()
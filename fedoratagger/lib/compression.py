@@ -0,0 +1,180 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" Compression of the HTTP answers and cache of the compressed exports.
+
+The encodings are the HTTP content codings: 'gzip' and 'deflate' (the
+zlib format) from the standard library, and 'zstd' when the zstandard
+module is installed.
+"""
+
+import contextlib
+import fcntl
+import glob
+import os
+import tempfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# The available encodings, preferred first.
+ENCODINGS = (['zstd'] if zstandard is not None else []) + ['gzip', 'deflate']
+
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def compressor(encoding, level=6):
+    """ Return an object compressing to `encoding` with compress(data) and
+    flush() methods, like zlib.compressobj.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+
+
+def compress(data, encoding, level=6):
+    """ Return data compressed to `encoding`. """
+    obj = compressor(encoding, level)
+    return obj.compress(data) + obj.flush()
+
+
+def compress_iter(chunks, encoding, level=6):
+    """ Compress an iterable of strings as they come, without holding more
+    than the state of the compressor.
+    """
+    obj = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            data = obj.compress(chunk)
+            if data:
+                yield data
+        yield obj.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class ExportCache(object):
+    """ The exports stored on disk, each one uncompressed and compressed
+    with every encoding, so serving them again costs no CPU.
+
+    An export is stored under a key identifying its content (the sequence
+    of the last change for example) and dropped `ttl` seconds after being
+    written, or when a new version of it is stored.  It is written to
+    temporary files first, named tmp-*.part, and removed by purge as well
+    once expired if the writer died.
+    """
+
+    def __init__(self, directory, encodings=ENCODINGS, ttl=3600, level=6):
+        self.directory = directory
+        self.encodings = encodings
+        self.ttl = ttl
+        self.level = level
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, name, key, encoding=None):
+        """ Return the path of an export, of a version of it. """
+        filename = '%s.%s' % (name, key)
+        if encoding:
+            filename += '.' + encoding
+        return os.path.join(self.directory, filename)
+
+    def get(self, name, key, encoding=None):
+        """ Return the path of the export with this encoding, or None if
+        it is not stored or expired.
+        """
+        path = self.path(name, key, encoding)
+        try:
+            if time.time() - os.path.getmtime(path) < self.ttl:
+                return path
+        except OSError:
+            pass
+        return None
+
+    def purge(self):
+        """ Remove the expired exports. """
+        limit = time.time() - self.ttl
+        for path in glob.glob(os.path.join(self.directory, '*.*')):
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.unlink(path)
+            except OSError:
+                # Removed by another process.
+                pass
+
+    @contextlib.contextmanager
+    def lock(self, name):
+        """ Hold the lock of an export, so that only one process builds it
+        while the others wait for it.
+        """
+        # Out of the way of purge and store.
+        directory = os.path.join(self.directory, 'locks')
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process.
+                pass
+        with open(os.path.join(directory, name), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def store(self, name, key, chunks):
+        """ Store an export given as an iterable of strings, replacing its
+        previous versions.
+        """
+        files = [(None, None)] + [
+            (encoding, compressor(encoding, self.level))
+            for encoding in self.encodings]
+        temporary = []
+        try:
+            for encoding, _ in files:
+                fd, tmp = tempfile.mkstemp(
+                    prefix='tmp-', suffix='.part', dir=self.directory)
+                temporary.append((os.fdopen(fd, 'wb'), tmp))
+            for chunk in chunks:
+                for (_, obj), (out, _) in zip(files, temporary):
+                    out.write(obj.compress(chunk) if obj else chunk)
+            for (_, obj), (out, _) in zip(files, temporary):
+                if obj:
+                    out.write(obj.flush())
+                out.close()
+
+            for path in glob.glob(self.path(name, '*')):
+                os.unlink(path)
+            # Rename the uncompressed export last, get() checks it first.
+            for (encoding, _), (_, tmp) in reversed(zip(files, temporary)):
+                os.rename(tmp, self.path(name, key, encoding))
+            self.purge()
+        finally:
+            for out, tmp in temporary:
+                out.close()
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
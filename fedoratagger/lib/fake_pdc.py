@@ -0,0 +1,127 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" A fake PDC server answering the queries of retired.py, to test and
+benchmark it offline.
+
+    with FakePDC({'f28': ['guake', 'gitg']}, page_size=1) as pdc:
+        names = list(retired.get_retired_packages(['f28'], url=pdc.url))
+"""
+
+import BaseHTTPServer
+import json
+import math
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep the connections open, like the real server.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        pdc = self.server.pdc
+        url = urlparse.urlparse(self.path)
+        args = dict(urlparse.parse_qsl(url.query))
+        pdc.requests.append(args)
+        if pdc.latency:
+            time.sleep(pdc.latency)
+
+        if url.path.rstrip('/') != '/rest_api/v1/component-branches' \
+                or args.get('active') != 'False':
+            return self._send(404, {'detail': 'Not found.'})
+
+        names = pdc.retired.get(args.get('name'), [])
+        page_size = int(args.get('page_size', pdc.page_size))
+        page = int(args.get('page', 1))
+        pages = max(1, int(math.ceil(len(names) / float(page_size))))
+        if page > pages:
+            return self._send(404, {'detail': 'Invalid page.'})
+
+        following = None
+        if page < pages:
+            following = '%s?%s' % (pdc.url, urllib.urlencode(
+                sorted(dict(args, page=page + 1).items())))
+        start = (page - 1) * page_size
+        self._send(200, {
+            'count': len(names),
+            'next': following,
+            'previous': None,
+            'results': [
+                {'global_component': name, 'name': args['name'],
+                 'active': False}
+                for name in names[start:start + page_size]
+            ],
+        })
+
+    def _send(self, status, output):
+        body = json.dumps(output)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePDC(object):
+    """ Serve the component branches of `retired`, a dictionnary of the
+    retired packages per branch, on a local port.
+
+    :kwarg page_size: the default number of packages per page
+    :kwarg latency: the number of seconds each answer takes
+    """
+
+    def __init__(self, retired, page_size=20, latency=0):
+        self.retired = retired
+        self.page_size = page_size
+        self.latency = latency
+        # The arguments of each request received.
+        self.requests = []
+        self._server = None
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.pdc = self
+        self.url = 'http://127.0.0.1:%i/rest_api/v1/component-branches/' \
+            % self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
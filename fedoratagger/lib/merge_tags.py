@@ -62,6 +62,10 @@ def process_values():
         for rdel in duplicate:
             vote = ft.SESSION.query(m.Vote).filter(m.Vote.tag_id == rdel.id)
             vote.delete()
+            m.Change.record(ft.SESSION, u'tag', r.package_id, rdel.label)
+        kept = ft.SESSION.query(m.Tag.label).filter(m.Tag.id == r.id).scalar()
+        m.Change.record(ft.SESSION, u'tag', r.package_id, kept)
+        m.Package.touch_all(ft.SESSION, [r.package_id])
 
         duplicate.delete(synchronize_session='fetch')
 
@@ -75,10 +79,19 @@ def process_values():
         to = func.lower(l.label)
         print "[%i - %i] -- [%s]" % (c, total, l.label)
         c += 1
+        if l.label != l.label.lower():
+            # The old label is gone, the new one appears.
+            m.Change.record(ft.SESSION, u'tag', l.package_id, l.label)
+            m.Change.record(ft.SESSION, u'tag', l.package_id, l.label.lower())
+            l.package.touch()
         l.label = func.lower(l.label)
 
     ft.SESSION.commit()
 
+    print "Updating the banned flag of the tags..."
+    m.Tag.update_banned(ft.SESSION)
+    ft.SESSION.commit()
+
     ft.SESSION.close()
 
 def create_backup():
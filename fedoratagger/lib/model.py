@@ -21,6 +21,7 @@
 
 import json
 import os
+import random
 from datetime import datetime
 
 import pkgwat.api
@@ -28,19 +29,29 @@ import fedmsg
 
 from sqlalchemy import *
 from sqlalchemy import Table, ForeignKey, Column
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relation, backref, synonym
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import relation, backref, synonym, joinedload
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
 from sqlalchemy.types import Integer, Unicode
 
 from kitchen.text.converters import to_unicode
 
-import fedora.client
-fas = fedora.client.AccountSystem()
+import blacklist
+import vote_buffer
+
+# The client of the account system, created on first use by _gravatar.
+fas = None
 
 DeclarativeBase = declarative_base()
 
+# The packages whose summary is still to be retrieved.
+MISSING_SUMMARY = u"summary IN ('', '(no summary)')"
+
+# Number of identifiers drawn by Package.random before counting.
+RANDOM_DRAWS = 5
+
 
 def create_tables(db_url, alembic_ini=None, debug=False):
     """ Create the tables in the database using the information from the
@@ -71,16 +82,24 @@ def create_tables(db_url, alembic_ini=None, debug=False):
     return scopedsession
 
 
-def tag_sorter(tag1, tag2):
+def tag_sort_key(tag):
     """ The tag list for each package should be sorted in descending order by
     the total score, ties are broken by the number of votes cast and if there
     is still a tie, alphabetically by the tag.
+
+    Use it as the `key` of sorted(), see `Tag.sort_order` for the same
+    order in SQL.
     """
-    for attr in ['total', 'votes', 'label']:
-        result = cmp(getattr(tag1, attr), getattr(tag2, attr))
-        if result != 0:
-            return result
-    return result
+    return (-tag.total, -tag.total_votes, tag.label)
+
+
+def tag_sorter(tag1, tag2):
+    """ Compare two tags by total score, number of votes cast and label.
+
+    Kept for the callers using cmp functions, prefer `tag_sort_key`.
+    """
+    return cmp((tag1.total, tag1.total_votes, tag1.label),
+               (tag2.total, tag2.total_votes, tag2.label))
 
 
 class YumTags(DeclarativeBase):
@@ -103,20 +122,38 @@ class Package(DeclarativeBase):
     __tablename__ = 'package'
     __table_args__ = (
         UniqueConstraint('name'),
+        # Partial index of the packages still waiting for their summary,
+        # see update.update_summaries.
+        Index('ix_package_missing_summary', 'id',
+              postgresql_where=text(MISSING_SUMMARY),
+              sqlite_where=text(MISSING_SUMMARY)),
     )
 
     id = Column(Integer, primary_key=True)
     name = Column(Unicode(255), nullable=False)
     summary = Column(UnicodeText(convert_unicode=False), nullable=False)
     _meta = Column(Unicode, server_default='{}', nullable=False)
+    # Bumped by every write touching the package, used as cache key.
+    revision = Column(Integer, default=0, server_default='0', nullable=False)
+    # Maintained by update_rating(), avg_rating is None until rated.
+    avg_rating = Column(Float, default=None, index=True)
+    n_ratings = Column(Integer, default=0, server_default='0', nullable=False)
 
-    tags = relation('Tag', backref=('package'))
+    tags = relation('Tag', backref=('package'), order_by='Tag.label')
     ratings = relation('Rating', backref=('package'))
     usages = relation('Usage', backref=('package'))
 
     def rating(self, session):
-        return session.query(func.avg(Rating.rating))\
-            .filter_by(package_id=self.id).one()[0]
+        return self.avg_rating
+
+    def update_rating(self):
+        """ Recompute the stored average rating and number of ratings of
+        the package from its ratings, when the session is next flushed.
+        """
+        self.avg_rating = select([func.avg(Rating.rating)]).where(
+            Rating.package_id == self.id).as_scalar()
+        self.n_ratings = select([func.count(Rating.id)]).where(
+            Rating.package_id == self.id).as_scalar()
 
     def meta(self, session):
         meta = json.loads(self._meta or '{}')
@@ -156,15 +193,58 @@ class Package(DeclarativeBase):
 
     @classmethod
     def random(cls, session):
-        """ Returns a random package from the database.
+        """ Returns a random package from the database, all the packages
+        being equally likely.
 
         :arg session: the session used to query the database
-        :arg pkgname: the name of the package (string)
+        :raise sqlalchemy.orm.exc.NoResultFound: when there is no package.
         """
-        result = session.query(cls).order_by(func.random()).first()
-        if not result:
+        low, high = session.query(func.min(cls.id), func.max(cls.id)).one()
+        if low is None:
             raise NoResultFound()
-        return result
+        # Draw identifiers until one exists, rather than sorting the whole
+        # table with ORDER BY random().  Taking the package following the
+        # identifier drawn would favour the ones following a gap.
+        for _ in range(RANDOM_DRAWS):
+            package = session.query(cls).get(random.randint(low, high))
+            if package is not None:
+                return package
+        # The identifiers are sparse, count the packages instead.
+        count = session.query(func.count(cls.id)).scalar()
+        package = count and session.query(cls).order_by(cls.id).offset(
+            random.randrange(count)).first()
+        if not package:
+            raise NoResultFound()
+        return package
+
+    def touch(self):
+        """ Mark the package as changed, see `revision`. """
+        self.revision = Package.revision + 1
+
+    @classmethod
+    def touch_all(cls, session, package_ids, chunk=500):
+        """ Mark the given packages as changed, see `revision`.
+
+        :arg session: the session used to query the database
+        :arg package_ids: the identifiers of the packages
+        :kwarg chunk: the number of packages updated by each statement
+        """
+        package_ids = sorted(package_ids)
+        for start in range(0, len(package_ids), chunk):
+            session.query(cls).filter(
+                cls.id.in_(package_ids[start:start + chunk])
+            ).update({'revision': cls.revision + 1},
+                     synchronize_session=False)
+
+    @classmethod
+    def count_and_last(cls, session):
+        """ Return the number of packages and the greatest identifier, they
+        change when packages are added or removed.
+
+        :arg session: the session used to query the database
+        """
+        count, last = session.query(func.count(cls.id), func.max(cls.id)).one()
+        return count, last or 0
 
     @classmethod
     def all(cls, session):
@@ -181,14 +261,21 @@ class Package(DeclarativeBase):
     def __unicode__(self):
         return self.name
 
-    def __json__(self, session):
+    def sorted_tags(self, top=None):
+        """ Return the tags of the package, best first (see tag_sort_key).
+
+        :kwarg top: if set, only return this number of tags
+        """
+        return sorted(self.tags, key=tag_sort_key)[:top]
+
+    def __json__(self, session, top=None):
         """ JSON.. kinda. """
 
         tags = []
-        for tag in self.tags:
+        for tag in self.sorted_tags(top):
             tags.append(tag.__json__())
 
-        rating = Rating.rating_of_package(session, self.id) or -1
+        rating = self.avg_rating or -1
         result = {
             'name': self.name,
             'summary': self.summary,
@@ -200,10 +287,10 @@ class Package(DeclarativeBase):
 
         return result
 
-    def __tag_json__(self):
+    def __tag_json__(self, top=None):
 
         tags = []
-        for tag in self.tags:
+        for tag in self.sorted_tags(top):
             tags.append(tag.__json__())
 
         result = {
@@ -215,7 +302,7 @@ class Package(DeclarativeBase):
 
     def __rating_json__(self, session):
 
-        rating = Rating.rating_of_package(session, self.id) or -1
+        rating = self.avg_rating or -1
         result = {
             'name': self.name,
             'rating': float(rating),
@@ -234,47 +321,61 @@ class Package(DeclarativeBase):
             'hover_html':
             u"<h2>Package: {name}</h2><ul>" +
             " ".join([
-                "<li>{tag.label.label} - {tag.like} / {tag.dislike}</li>"
-                .format(tag=tag) for tag in self.tags
+                u"<li>{0} - {1} / {2}</li>".format(
+                    tag.label, *vote_buffer.BUFFER.tag_counts(tag))
+                for tag in self.tags
             ]) + "</ul>"
         }
 
 
+def _banned_default(context):
+    """ Flag the new tags whose label must not be shown on the cards. """
+    return blacklist.banned(context.current_parameters['label'])
+
+
 class Tag(DeclarativeBase):
     __tablename__ = 'tag'
     __table_args__ = (
         UniqueConstraint('package_id', 'label'),
+        # For the cards, see random_visible.
+        Index('ix_tag_package_id_banned', 'package_id', 'banned'),
     )
 
     id = Column(Integer, primary_key=True)
     package_id = Column(Integer, ForeignKey('package.id'))
-    label = Column(Unicode(255), nullable=False)
+    label = Column(Unicode(255), nullable=False, index=True)
     votes = relation('Vote', backref=('tag'))
 
     like = Column(Integer, default=1)
     dislike = Column(Integer, default=0)
-
-    @property
-    def banned(self):
-        """ We want to exclude some tags permanently.
-
-        https://github.com/ralphbean/fedora-tagger/issues/16
-        """
-
-        return any([
-            self.label.startswith('x-'),
-            self.label == 'application',
-            self.label == 'system',
-            self.label == 'utility',
-        ])
+    updated_on = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow, index=True)
+    # We want to exclude some tags permanently, see blacklist.banned and
+    # update_banned.
+    banned = Column(Boolean, nullable=False, default=_banned_default)
 
     @property
     def total(self):
-        return self.like - self.dislike
+        """ The likes minus the dislikes, including the votes still in the
+        vote buffer.
+        """
+        like, dislike = vote_buffer.BUFFER.tag_counts(self)
+        return like - dislike
 
     @property
     def total_votes(self):
-        return self.like + self.dislike
+        like, dislike = vote_buffer.BUFFER.tag_counts(self)
+        return like + dislike
+
+    @classmethod
+    def sort_order(cls):
+        """ Return the ORDER BY clauses sorting the tags like tag_sort_key.
+        """
+        return [
+            (cls.like - cls.dislike).desc(),
+            (cls.like + cls.dislike).desc(),
+            cls.label,
+        ]
 
     @classmethod
     def get(cls, session, package_id, label):
@@ -282,8 +383,105 @@ class Tag(DeclarativeBase):
                                             ).filter_by(label=label).one()
 
     @classmethod
-    def by_label(cls, session, label):
-        return session.query(cls).filter_by(label=label).all()
+    def by_label(cls, session, label, after=None, limit=None):
+        """ Return the tags having the specified label, with their package,
+        ordered by identifier.
+
+        :arg session: the session used to query the database
+        :arg label: the label of the tags
+        :kwarg after: only return the tags whose identifier is greater
+        :kwarg limit: the maximum number of tags to return
+        """
+        query = session.query(cls).filter_by(label=label).options(
+            joinedload(cls.package))
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def random_visible(cls, session, package_id, limit):
+        """ Return at most `limit` tags of a package picked at random,
+        leaving out the banned ones.
+
+        :arg session: the session used to query the database
+        :arg package_id: the identifier of the package
+        :arg limit: the maximum number of tags to return
+        """
+        return session.query(cls).filter(
+            cls.package_id == package_id,
+            cls.banned == False,
+        ).order_by(func.random()).limit(limit).all()
+
+    @classmethod
+    def update_banned(cls, session, chunk=500):
+        """ Recompute the banned flag of the tags, after a change of the
+        blacklist or of their labels.  Returns the number of labels whose
+        flag changed.
+
+        :arg session: the session used to query the database
+        :kwarg chunk: the number of labels updated by each statement
+        """
+        changed = {True: [], False: []}
+        for label, banned in session.query(cls.label, cls.banned).distinct():
+            if blacklist.banned(label) != banned:
+                changed[not banned].append(label)
+
+        package_ids = set()
+        for banned, labels in changed.items():
+            for start in range(0, len(labels), chunk):
+                query = session.query(cls).filter(
+                    cls.label.in_(labels[start:start + chunk]))
+                for package_id, label in query.with_entities(
+                        cls.package_id, cls.label).order_by(cls.id):
+                    Change.record(session, u'tag', package_id, label)
+                    package_ids.add(package_id)
+                query.update({'banned': banned}, synchronize_session=False)
+        Package.touch_all(session, package_ids, chunk)
+        return len(changed[True]) + len(changed[False])
+
+    @classmethod
+    def export(cls, session, since=None, top=None):
+        """ Iterate over all the tags of all the packages with a single
+        query, this is the base of all the bulk exports.
+
+        Yields (package name, tag label, total) tuples ordered by package
+        and label.  Packages without tags are yielded once, with None as
+        label and total.
+
+        :arg session: the session used to query the database
+        :kwarg since: a datetime, if set only the tags created or voted on
+            since then are returned (and no package without tags).
+        :kwarg top: if set, only the `top` best tags of each package are
+            returned (see sort_order), best first.  This relies on window
+            functions, available in SQLite >= 3.25, PostgreSQL and
+            MySQL >= 8.
+        """
+        if top is None:
+            tags = cls.__table__
+            order = tags.c.label
+            join = tags.c.package_id == Package.id
+        else:
+            tags = session.query(
+                cls.package_id, cls.label, cls.like, cls.dislike,
+                cls.updated_on,
+                func.row_number().over(
+                    partition_by=cls.package_id,
+                    order_by=cls.sort_order(),
+                ).label('rank'),
+            ).subquery()
+            order = tags.c.rank
+            join = and_(tags.c.package_id == Package.id, tags.c.rank <= top)
+
+        query = session.query(
+            Package.name, tags.c.label, tags.c.like - tags.c.dislike
+        ).outerjoin(
+            tags, join
+        )
+        if since is not None:
+            query = query.filter(tags.c.updated_on >= since)
+        return query.order_by(
+            Package.id, order
+        ).yield_per(1000)
 
     @classmethod
     def count_unique_label(cls, session):
@@ -293,12 +491,13 @@ class Tag(DeclarativeBase):
         return self.label + " on " + self.package.name
 
     def __pkg_json__(self):
+        like, dislike = vote_buffer.BUFFER.tag_counts(self)
         result = {
             'tag': self.label,
-            'like': self.like,
-            'dislike': self.dislike,
-            'total': self.total,
-            'votes': self.total_votes,
+            'like': like,
+            'dislike': dislike,
+            'total': like - dislike,
+            'votes': like + dislike,
             'package': self.package.name
         }
 
@@ -307,6 +506,7 @@ class Tag(DeclarativeBase):
     __json__ = __pkg_json__
 
     def __jit_data__(self):
+        like, dislike = vote_buffer.BUFFER.tag_counts(self)
         return {
             'hover_html':
             u""" <h2>Tag: {label}</h2>
@@ -318,9 +518,9 @@ class Tag(DeclarativeBase):
             </ul>
             """.format(
                 label=unicode(self),
-                like=self.like,
-                dislike=self.dislike,
-                total=self.total,
+                like=like,
+                dislike=dislike,
+                total=like - dislike,
                 votes=self.votes,
             )
         }
@@ -335,7 +535,7 @@ class Vote(DeclarativeBase):
     id = Column(Integer, primary_key=True)
     like = Column(Boolean, nullable=False)
     user_id = Column(Integer, ForeignKey('user.id'))
-    tag_id = Column(Integer, ForeignKey('tag.id'))
+    tag_id = Column(Integer, ForeignKey('tag.id'), index=True)
 
     @classmethod
     def get(cls, session, user_id, tag_id):
@@ -343,8 +543,52 @@ class Vote(DeclarativeBase):
                                             ).filter_by(tag_id=tag_id).one()
 
     @classmethod
-    def get_votes_user(cls, session, user_id):
-        return session.query(cls).filter_by(user_id=user_id).all()
+    def get_votes_user(cls, session, user_id, after=None, limit=None):
+        """ Return the votes of a user, with their tag and package, ordered
+        by identifier.
+
+        :arg session: the session used to query the database
+        :arg user_id: the identifier of the user in the database
+        :kwarg after: only return the votes whose identifier is greater
+        :kwarg limit: the maximum number of votes to return
+        """
+        query = session.query(cls).filter_by(user_id=user_id).options(
+            joinedload(cls.tag).joinedload(Tag.package))
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def count_votes_user(cls, session, user_id):
+        """ Return the number of votes of a user as a (likes, dislikes)
+        tuple.
+
+        :arg session: the session used to query the database
+        :arg user_id: the identifier of the user in the database
+        """
+        counts = dict(session.query(cls.like, func.count(cls.id)).filter_by(
+            user_id=user_id).group_by(cls.like).all())
+        return counts.get(True, 0), counts.get(False, 0)
+
+    @classmethod
+    def likes_of_user(cls, session, user_id, package_ids):
+        """ Return a dictionnary of the votes of a user on the tags of the
+        specified packages, mapping the tag identifier to the `like` of
+        the vote.
+
+        :arg session: the session used to query the database
+        :arg user_id: the identifier of the user in the database
+        :arg package_ids: a list of package identifiers
+        """
+        if not package_ids:
+            return {}
+        return dict(session.query(cls.tag_id, cls.like).join(
+            Tag, Tag.id == cls.tag_id
+        ).filter(
+            cls.user_id == user_id
+        ).filter(
+            Tag.package_id.in_(package_ids)
+        ).all())
 
     def __json__(self):
 
@@ -364,7 +608,7 @@ class Usage(DeclarativeBase):
     )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'))
-    package_id = Column(Integer, ForeignKey('package.id'))
+    package_id = Column(Integer, ForeignKey('package.id'), index=True)
 
     @classmethod
     def get(cls, session, package_id, user_id):
@@ -373,6 +617,13 @@ class Usage(DeclarativeBase):
                 .filter_by(package_id=package_id)\
                 .filter_by(user_id=user_id).one()
 
+    @classmethod
+    def cache(cls, session):
+        """ Return the dictionnary, stored in the session, remembering
+        which (user_id, package_id) usages are known to exist or not.
+        """
+        return session.info.setdefault('usages', {})
+
     @classmethod
     def usage_of_package(cls, session, pkgid):
         """ Return the usage count of the package specified by a id
@@ -421,9 +672,12 @@ class Rating(DeclarativeBase):
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'))
-    package_id = Column(Integer, ForeignKey('package.id'))
+    package_id = Column(Integer, ForeignKey('package.id'), index=True)
     rating = Column(Integer, nullable=False)
 
+    # Tolerance used when looking up the packages by average rating.
+    EPSILON = 1e-6
+
     @classmethod
     def get(cls, session, package_id, user_id):
         """ Return a specific user's rating on a specific package. """
@@ -467,21 +721,84 @@ class Rating(DeclarativeBase):
         ).all()
 
     @classmethod
-    def by_rating(cls, session, ratingscore):
-        """ Return all the packages in the database having the specified
-        rating.
+    def dump(cls, session):
+        """ Return the rating and usage summary of all the packages having
+        been rated or used, with a single query.
+
+        Yields tuples of the form::
+
+            (package name, average rating, number of ratings, number of users)
+
+        ordered by package, the average rating is None for the packages
+        that have not been rated.
+
+        :arg session: the session used to query the database
+        """
+        usages = session.query(
+            Usage.package_id.label('package_id'),
+            func.count(Usage.id).label('n_usages'),
+        ).group_by(Usage.package_id).subquery()
+
+        return session.query(
+            Package.name,
+            Package.avg_rating,
+            Package.n_ratings,
+            func.coalesce(usages.c.n_usages, 0),
+        ).outerjoin(
+            usages, usages.c.package_id == Package.id
+        ).filter(or_(
+            Package.n_ratings > 0,
+            usages.c.package_id != None,
+        )).order_by(Package.id).yield_per(1000)
+
+    @classmethod
+    def by_rating(cls, session, ratingscore, after=None, limit=None):
+        """ Return the packages in the database having the specified
+        rating (within EPSILON), ordered by identifier.
 
         :arg session: the session used to query the database
+        :arg ratingscore: the average rating of the packages
+        :kwarg after: only return the packages whose identifier is greater
+        :kwarg limit: the maximum number of packages to return
         """
-        subquery = session.query(
-            cls.package_id.label('package_id'),
-            func.avg(cls.rating).label('avg'),
-        ).group_by(cls.package_id).subquery()
+        return cls.by_range(session, ratingscore - cls.EPSILON,
+                            ratingscore + cls.EPSILON, after, limit)
 
-        return session.query(Package).filter(and_(
-            Package.id == subquery.c.package_id,
-            subquery.c.avg == ratingscore,
-        )).all()
+    @classmethod
+    def by_range(cls, session, min_rating=None, max_rating=None,
+                 after=None, limit=None):
+        """ Return the packages in the database whose average rating is
+        between min_rating and max_rating (both included), ordered by
+        identifier.
+
+        :arg session: the session used to query the database
+        :kwarg min_rating: the lowest average rating, no lower bound if None
+        :kwarg max_rating: the highest average rating, no upper bound if None
+        :kwarg after: only return the packages whose identifier is greater
+        :kwarg limit: the maximum number of packages to return
+        """
+        query = session.query(Package).filter(Package.avg_rating != None)
+        if min_rating is not None:
+            query = query.filter(Package.avg_rating >= min_rating)
+        if max_rating is not None:
+            query = query.filter(Package.avg_rating <= max_rating)
+        if after is not None:
+            query = query.filter(Package.id > after)
+        return query.order_by(Package.id).limit(limit).all()
+
+    @classmethod
+    def top(cls, session, limit=10):
+        """ Return the best rated packages, the most rated first among
+        the packages having the same average rating.
+
+        :arg session: the session used to query the database
+        :kwarg limit: the number of packages to return
+        """
+        return session.query(Package).filter(
+            Package.avg_rating != None
+        ).order_by(
+            Package.avg_rating.desc(), Package.n_ratings.desc(), Package.id
+        ).limit(limit).all()
 
     def __json__(self, session):
 
@@ -497,10 +814,194 @@ class Rating(DeclarativeBase):
         return result
 
 
+class Change(DeclarativeBase):
+    """ The change feed: every write records which package, or which tag,
+    rating or usage of which package changed, the identifier is the change
+    sequence.
+
+    The changes of a transaction are written when it commits, while
+    holding the lock of ChangeLock: the sequences follow the order of the
+    commits, a reader never sees a change appear behind the last sequence
+    it read.
+
+    The rows outlive the packages they are about, hence no foreign key: a
+    removed package is recorded as a change of kind 'delete' whose label is
+    the name of the package.  The old changes are pruned, see prune().
+    """
+    __tablename__ = 'changes'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(Unicode(16), nullable=False)
+    package_id = Column(Integer, nullable=False, index=True)
+    label = Column(Unicode(255), default=None)
+    created_on = Column(DateTime, default=datetime.utcnow, index=True)
+
+    @classmethod
+    def record(cls, session, kind, package_id, label=None):
+        """ Record that something changed on a package.
+
+        :arg session: the session used to query the database
+        :arg kind: 'tag', 'rating', 'usage', 'package' (added, or its
+            summary changed) or 'delete' (removed)
+        :arg package_id: the identifier of the package
+        :kwarg label: the label of the tag for changes of kind 'tag', the
+            name of the package for changes of kind 'delete'
+        """
+        session.info.setdefault('changes', []).append(dict(
+            kind=kind, package_id=package_id, label=label,
+            created_on=datetime.utcnow()))
+
+    @classmethod
+    def record_deletion(cls, session, package_ids):
+        """ Record the removal of packages, and forget the older changes
+        about them.  Call it before deleting the packages.
+
+        :arg session: the session used to query the database
+        :arg package_ids: the identifiers of the packages removed
+        """
+        session.query(cls).filter(
+            cls.package_id.in_(package_ids)
+        ).delete(synchronize_session=False)
+        for package_id, name in session.query(Package.id, Package.name).filter(
+                Package.id.in_(package_ids)).order_by(Package.id):
+            cls.record(session, u'delete', package_id, name)
+
+    @classmethod
+    def prune(cls, session, before):
+        """ Remove the changes recorded before the given date, but the last
+        one so that the sequences never go back.
+
+        The consumers which read up to a sequence older than the changes
+        kept cannot catch up with the feed anymore, see pruned().
+
+        :arg session: the session used to query the database
+        :arg before: a datetime, the changes older than it are removed
+        :return: the number of changes removed.
+        """
+        pruned = session.query(func.max(cls.id)).filter(
+            cls.created_on < before
+        ).filter(
+            cls.id < cls.last(session)
+        ).scalar()
+        if pruned is None or pruned <= cls.pruned(session):
+            return 0
+        session.execute(ChangeLock.__table__.update().values(pruned=pruned))
+        return session.query(cls).filter(
+            cls.id <= pruned).delete(synchronize_session=False)
+
+    @classmethod
+    def pruned(cls, session):
+        """ Return the sequence up to which the changes were pruned, 0 if
+        none were.
+        """
+        return session.query(ChangeLock.pruned).scalar() or 0
+
+    @classmethod
+    def last(cls, session):
+        """ Return the sequence of the last change, 0 if there is none. """
+        return session.query(func.max(cls.id)).scalar() or 0
+
+    @classmethod
+    def since(cls, session, since, limit):
+        """ Return the changes recorded after the `since` sequence, with
+        the current state of what changed.
+
+        Returns a list of dictionnaries ordered by sequence, at most
+        `limit` of them.
+
+        :arg session: the session used to query the database
+        :arg since: the sequence of the last change already known
+        :arg limit: the maximum number of changes to return
+        """
+        rows = session.query(
+            cls.id, cls.kind, cls.package_id, Package.name, cls.label,
+            Tag.like - Tag.dislike, Package.avg_rating, Package.n_ratings,
+            Package.summary,
+        ).outerjoin(
+            Package, Package.id == cls.package_id
+        ).outerjoin(
+            Tag, and_(Tag.package_id == cls.package_id,
+                      Tag.label == cls.label)
+        ).filter(
+            cls.id > since
+        ).filter(
+            # Skip what was recorded about a package while it was removed.
+            or_(cls.kind == u'delete', Package.id != None)
+        ).order_by(cls.id).limit(limit).all()
+
+        # The usages of all the packages of the page are counted with one
+        # query.
+        package_ids = set([row[2] for row in rows if row[1] == 'usage'])
+        usages = {}
+        if package_ids:
+            usages = dict(session.query(
+                Usage.package_id, func.count(Usage.id)
+            ).filter(
+                Usage.package_id.in_(package_ids)
+            ).group_by(Usage.package_id).all())
+
+        output = []
+        for seq, kind, package_id, name, label, total, rating, count, \
+                summary in rows:
+            change = {'seq': seq, 'type': kind, 'package': name}
+            if kind == 'tag':
+                change['tag'] = label
+                # None when the tag was removed.
+                change['total'] = total
+            elif kind == 'package':
+                change['summary'] = summary
+            elif kind == 'delete':
+                change['package'] = label
+            elif kind == 'rating':
+                change['rating'] = -1 if rating is None else float(rating)
+                change['votes'] = count
+            else:
+                change['usage'] = usages.get(package_id, 0)
+            output.append(change)
+        return output
+
+
+class ChangeLock(DeclarativeBase):
+    """ A single row, locked by the transactions writing their changes
+    until they commit, see Change.  It also holds the sequence up to which
+    the changes were pruned.
+    """
+    __tablename__ = 'changes_lock'
+
+    id = Column(Integer, primary_key=True)
+    commits = Column(Integer, nullable=False, default=0)
+    pruned = Column(Integer, nullable=False, default=0)
+
+
+event.listen(ChangeLock.__table__, 'after_create', DDL(
+    'INSERT INTO changes_lock (id, commits, pruned) VALUES (1, 0, 0)'))
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_changes(session):
+    """ Write the changes recorded in the transaction, after everything
+    else so that the lock is the last one taken.
+    """
+    changes = session.info.pop('changes', None)
+    if changes:
+        session.flush()
+        session.execute(ChangeLock.__table__.update().values(
+            commits=ChangeLock.commits + 1))
+        session.execute(Change.__table__.insert(), changes)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_changes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('changes', None)
+
+
 class FASUser(DeclarativeBase):
     __tablename__ = 'user'
     __table_args__ = (
         UniqueConstraint('username'),
+        # Used to rank the users, see top() and rank().
+        Index('ix_user_anonymous_score', 'anonymous', 'score'),
     )
 
     id = Column(Integer, primary_key=True)
@@ -523,10 +1024,42 @@ class FASUser(DeclarativeBase):
         return len(self.votes)
 
     def uses(self, session, package):
-        for usage in self.usages:
-            if usage.package == package:
-                return True
-        return False
+        """ Return whether the user marked that they use the package.
+
+        The answer is kept in the session (thus for the duration of the
+        request) so asking several times is free.
+        """
+        cache = Usage.cache(session)
+        key = (self.id, package.id)
+        if key not in cache:
+            cache[key] = self.id is not None and session.query(exists().where(
+                and_(Usage.user_id == self.id,
+                     Usage.package_id == package.id)
+            )).scalar()
+        return cache[key]
+
+    def uses_packages(self, session, pkgnames):
+        """ Return the set of the specified package names that the user
+        uses, using a single query.
+
+        :arg session: the session used to query the database.
+        :arg pkgnames: a list of package names.
+        """
+        if self.id is None or not pkgnames:
+            return set()
+
+        rows = session.query(Package.id, Package.name).join(
+            Usage, Usage.package_id == Package.id
+        ).filter(
+            Usage.user_id == self.id
+        ).filter(
+            Package.name.in_(pkgnames)
+        ).all()
+
+        cache = Usage.cache(session)
+        for package_id, name in rows:
+            cache[(self.id, package_id)] = True
+        return set([name for package_id, name in rows])
 
     def rank(self, session):
         _rank = self._rank
@@ -534,10 +1067,11 @@ class FASUser(DeclarativeBase):
         if self.anonymous:
             return -1
 
-        users = session.query(FASUser)\
-                .filter(FASUser.username != 'anonymous').all()
-        lookup = sorted(set([u.score for u in users]), reverse=True)
-        rank = lookup.index(self.score) + 1
+        # Count the distinct scores above ours in the database rather than
+        # loading every user, the table holds one row per voter.
+        scores = session.query(func.count(distinct(FASUser.score)))\
+                .filter(FASUser.anonymous == False)
+        rank = scores.filter(FASUser.score > self.score).scalar() + 1
 
         # If their rank has changed.
         changed = (rank != _rank)
@@ -548,7 +1082,7 @@ class FASUser(DeclarativeBase):
         # in and votes once, *all* the users in last place get bumped down
         # one notch.
         # No need to spew that to the message bus.
-        is_last = (rank == len(lookup))
+        is_last = (rank == scores.scalar())
 
         if changed:
             self._rank = rank
@@ -575,6 +1109,10 @@ class FASUser(DeclarativeBase):
         return self._gravatar(s=32)
 
     def _gravatar(self, s):
+        global fas
+        if fas is None:
+            import fedora.client
+            fas = fedora.client.AccountSystem()
         url = fas.avatar_url(self.username, size=s, lookup_email=False)
         return "<img src='%s'></img>" % url
 
@@ -605,6 +1143,29 @@ class FASUser(DeclarativeBase):
             session.flush()
         return user
 
+    @classmethod
+    def get_or_stub(cls, session, username):
+        """ Return the anonymous user known under the provided username.
+        If that person never wrote anything to the database, return a
+        transient FASUser instead which is *not* added to the session.
+
+        Anonymous visitors only get a row in the database once they
+        actually vote (see get_or_create), this way simply browsing the
+        frontend does not fill the user table.
+
+        :arg session: the session used to query the database.
+        :arg username: the (hashed) username of the anonymous user.
+        """
+        try:
+            user = session.query(cls).filter_by(username=username).one()
+        except NoResultFound:
+            user = FASUser(username=username,
+                           anonymous=True,
+                           notifications_on=True,
+                           score=0,
+                           _rank=-1)
+        return user
+
     @classmethod
     def top(cls, session, limit=10):
         """ Return the top contributors ordered by their scores.
@@ -614,7 +1175,7 @@ class FASUser(DeclarativeBase):
         """
         return session.query(cls
                             ).filter(FASUser.anonymous == False
-                            ).order_by(FASUser.score.desc()
+                            ).order_by(FASUser.score.desc(), FASUser.id
                             ).limit(limit
                             ).all()
 
@@ -634,7 +1195,7 @@ class FASUser(DeclarativeBase):
         obj = {
             'username': self.anonymous and 'anonymous' or self.username,
             'votes': self.total_votes,
-            'score': self.score,
+            'score': vote_buffer.BUFFER.user_score(self),
             'rank': self._rank,
             'anonymous': self.anonymous,
         }
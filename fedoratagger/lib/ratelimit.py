@@ -0,0 +1,151 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" Token bucket rate limiting of the writes.
+
+Each client (a user name or the hash of an IP address) has a bucket of
+`burst` tokens, refilled at `rate` tokens per second.  A request takes one
+token and is refused when the bucket is empty.
+
+The buckets are kept either in the memory of the process (MemoryBackend,
+each worker then allows `rate` on its own) or in redis (RedisBackend,
+shared by all the workers).
+"""
+
+import threading
+import time
+
+from cache import LRUCache
+
+
+class MemoryBackend(object):
+    """ Buckets kept in the memory of the process, for at most `size`
+    clients.
+    """
+
+    def __init__(self, size=100000):
+        self._buckets = LRUCache(size)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """ Take a token from the bucket of `key`.
+
+        Returns 0 if a token was available, otherwise the number of
+        seconds before one is.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            # Nothing is refilled if the clock went backwards.
+            tokens = min(burst, tokens + max(0, now - stamp) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / float(rate)
+            self._buckets.set(key, (tokens, now))
+        return wait
+
+
+class RedisBackend(object):
+    """ Buckets kept in redis, shared by all the processes using the same
+    server.  Needs the redis module.
+    """
+
+    # Same computation as MemoryBackend.take, atomically on the server.
+    SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]),
+    tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+    'stamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url, prefix='fedoratagger:ratelimit:'):
+        import redis
+        self.prefix = prefix
+        self._client = redis.StrictRedis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now=None):
+        """ Take a token from the bucket of `key`, see MemoryBackend.take.
+        """
+        now = time.time() if now is None else now
+        return float(self._take(
+            keys=[self.prefix + key], args=[rate, burst, repr(now)]))
+
+
+class RateLimiter(object):
+    """ Allow `rate` requests per second and per client, with bursts of
+    `burst` requests, and count the requests allowed and refused.
+    """
+
+    def __init__(self, backend, rate, burst):
+        self.backend = backend
+        self.rate = float(rate)
+        self.burst = burst
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    def take(self, key, now=None):
+        """ Returns 0 if the client `key` may proceed, otherwise the number
+        of seconds to wait before trying again.
+        """
+        wait = self.backend.take(key, self.rate, self.burst, now=now)
+        with self._lock:
+            if wait:
+                self.throttled += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def stats(self):
+        """ Return the number of requests allowed and refused. """
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+        }
+
+
+def create_limiter(config):
+    """ Return the RateLimiter set up by the WRITE_RATE_* settings, or
+    None if the writes are not limited.
+
+    :arg config: a dictionnary of settings, like fedoratagger.CONFIG
+    """
+    rate = config.get('WRITE_RATE_LIMIT')
+    if not rate:
+        return None
+    url = config.get('WRITE_RATE_REDIS_URL')
+    backend = RedisBackend(url) if url else MemoryBackend()
+    return RateLimiter(backend, rate, config.get('WRITE_RATE_BURST', 10))
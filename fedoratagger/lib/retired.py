@@ -3,7 +3,15 @@ Tagger need to remove the packages in retired status.
 Is that the script Should be run as:
 
 FEDORATAGGER_CONFIG = /etc/fedora-tagger/fedora-tagger.cfg python /path/to/fedoratagger/lib/retired.py
+
+The branches default to the PDC_BRANCHES setting, -b f28 -b f29 overrides
+them.  fedoratagger/lib/fake_pdc.py serves a fake PDC to run it offline.
 """
+import argparse
+import itertools
+import math
+from multiprocessing.pool import ThreadPool
+
 import requests
 
 import model as m
@@ -17,58 +25,97 @@ logging.basicConfig()
 
 PDC_URL = 'https://pdc.fedoraproject.org/rest_api/v1/component-branches'
 
-
-def get_retired_packages():
-
-    packages = []
-
-    args = {
-        'name': 'f28',
-        'active': False,
-    }
-
-    response = requests.get(PDC_URL, args)
-    if response.ok:
-        output = response.json()
-    else:
-        response.raise_for_status()
-    for pkg in output['results']:
-        pkg_name = pkg['global_component']
-        packages.append(pkg_name)
-    pdc_api_url = output['next']
-
-    while pdc_api_url:
-        response = requests.get(pdc_api_url)
-        if response.ok:
-            output = response.json()
-        else:
-            response.raise_for_status()
-        for pkg in output['results']:
-            pkg_name = pkg['global_component']
-            packages.append(pkg_name)
-
-        pdc_api_url = output['next']
-
-    return packages
-
-
-def del_packages():
+# Number of packages per page and number of pages fetched at once.
+PAGE_SIZE = 100
+WORKERS = 8
+
+
+def pdc_session(workers=WORKERS):
+    """ Return a requests session keeping up to `workers` connections to
+    the server open.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_page(session, url, args):
+    response = session.get(url, params=args)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_retired_packages(branches=('f28',), url=PDC_URL, workers=WORKERS,
+                         page_size=PAGE_SIZE, session=None):
+    """ Yield the names of the packages retired on the given branches, as
+    the pages of the PDC arrive.
+
+    The first page of each branch gives the number of pages, the others
+    are then fetched `workers` at a time.  Each name is yielded once.
+
+    :kwarg branches: the names of the branches, ie: ['f28', 'f29']
+    :kwarg url: the url of the component-branches endpoint of the PDC
+    :kwarg workers: the number of pages fetched at once
+    :kwarg page_size: the number of packages per page
+    :kwarg session: the requests session to use, see pdc_session
+    """
+    session = session or pdc_session(workers)
+    pool = ThreadPool(workers)
+    seen = set()
+    try:
+        for branch in branches:
+            args = {'name': branch, 'active': False, 'page_size': page_size}
+            output = _get_page(session, url, args)
+            pages = [output]
+            if output.get('count') is not None:
+                n_pages = int(math.ceil(output['count'] / float(page_size)))
+                pages = itertools.chain(pages, pool.imap_unordered(
+                    lambda page: _get_page(
+                        session, url, dict(args, page=page)),
+                    range(2, n_pages + 1)))
+            else:
+                # Without the count, follow the links one page at a time.
+                def follow(output):
+                    while output['next']:
+                        output = _get_page(session, output['next'], {})
+                        yield output
+                pages = itertools.chain(pages, follow(output))
+
+            for output in pages:
+                for pkg in output['results']:
+                    name = pkg['global_component']
+                    if name not in seen:
+                        seen.add(name)
+                        yield name
+    finally:
+        pool.terminate()
+
+
+def del_packages(branches=('f28',), url=PDC_URL, workers=WORKERS):
+    """ Delete the packages retired on the given branches, and everything
+    attached to them, 100 at a time as their names come from the PDC.
+    """
 
     log.info('Deleting packages.')
 
     s = 0
-    e = 100
-    pkgs = get_retired_packages()
-    l = len(pkgs)
-    while (pkgs[s:e]):
-        log.info('searching packages [%i] to [%i] of [%i]' % (s, e, l))
+    pkgs = get_retired_packages(branches, url=url, workers=workers)
+    while True:
+        chunk = list(itertools.islice(pkgs, 100))
+        if not chunk:
+            break
+        log.info('searching packages [%i] to [%i]' % (s, s + len(chunk)))
         package = ft.SESSION.query(
             m.Package).filter(
-            m.Package.name.in_(pkgs[s:e]))
-        s = e
-        e = e + 100
+            m.Package.name.in_(chunk))
+        s += len(chunk)
 
-        for r in package:
+        removed = package.all()
+        m.Change.record_deletion(ft.SESSION, [r.id for r in removed])
+        for r in removed:
             tag = ft.SESSION.query(m.Tag).filter(m.Tag.package_id == r.id)
             usage = ft.SESSION.query(m.Usage).filter(m.Usage.package_id == r.id)
             rating = ft.SESSION.query(
@@ -85,9 +132,28 @@ def del_packages():
         ft.SESSION.commit()
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-b', '--branch', dest='branches', action='append',
+        help="Branch whose retired packages are removed, can be repeated "
+        "(defaults to the PDC_BRANCHES setting)"
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int,
+        default=ft.CONFIG.get('PDC_WORKERS', WORKERS),
+        help="Number of pages fetched at once from the PDC"
+    )
+    return parser.parse_args()
+
 
-    del_packages()
+def main():
+    args = parse_args()
+    del_packages(
+        args.branches or ft.CONFIG.get('PDC_BRANCHES', ['f28']),
+        url=ft.CONFIG.get('PDC_URL', PDC_URL),
+        workers=args.workers,
+    )
 
 
 if __name__ == '__main__':
@@ -70,11 +70,6 @@ def _prepare_sqlite_tuples():
     import fedoratagger as ft
     import fedoratagger.lib.model as m
 
-    packages = ft.SESSION.query(m.Package).all()
-    for package in packages:
-        for tag in package.tags:
-            yield (
-                package.name,
-                tag.label,
-                tag.total,
-            )
+    for name, label, total in m.Tag.export(ft.SESSION):
+        if label is not None:
+            yield (name, label, total)
@@ -0,0 +1,336 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" In-memory statistics on the tags of all the packages, used to suggest
+tags and to find similar packages.
+
+Only the visible tags the users agree with (not banned, with more likes
+than dislikes) are taken into account.  The index is built from the `tag`
+table, then kept up to date from the change feed: the packages with new
+changes of kind 'tag' or 'delete' are read again and their contribution
+to the counts replaced.
+
+Each worker has its own index, INDEX, loaded on first use (or at start,
+see apache/fedoratagger.wsgi) then rebuilt from a background thread, see
+TagIndex.start.  The new index is built aside and swapped in, the readers
+are never blocked for longer than the swap.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from operator import itemgetter
+
+from model import Change, Tag
+
+log = logging.getLogger(__name__)
+
+# Pairs of labels seen together on fewer packages are not trusted.
+MIN_COOCCURRENCE = 2
+
+# Number of packages sharing a label with a package that are compared with
+# it when looking for similar packages, see `TagIndex.similar`.
+SIMILAR_CANDIDATES = 1000
+
+# Above this number of changed packages, refreshing is slower than
+# loading everything again.
+REFRESH_LIMIT = 5000
+
+# Only the best tags of each package are counted in the pairs of labels:
+# their number grows with the square of the number of tags.
+PAIR_TAGS = 20
+
+
+class TagIndex(object):
+    """ The labels of the packages and their co-occurrence counts. """
+
+    # The attributes replaced by load.
+    _STATE = ('labels', 'label_ids', 'tags', 'norms', 'postings', 'counts',
+              'pairs', 'seq', 'loaded_on', 'refreshed_on')
+
+    def __init__(self, min_cooccurrence=MIN_COOCCURRENCE,
+                 pair_tags=PAIR_TAGS):
+        self.min_cooccurrence = min_cooccurrence
+        self.pair_tags = pair_tags
+        # Held by the readers and while changing the index.
+        self._lock = threading.RLock()
+        # Held while querying the database to update the index, by one
+        # thread at a time.
+        self._update_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.clear()
+
+    def clear(self):
+        """ Forget everything, the next update loads the index again. """
+        with self._lock:
+            # The labels are stored as integers, indexes in `labels`.
+            self.labels = []
+            self.label_ids = {}
+            # package id -> {label id: total of the tag}
+            self.tags = {}
+            # package id -> euclidean norm of the totals of its tags
+            self.norms = {}
+            # label id -> ids of the packages having it
+            self.postings = collections.defaultdict(set)
+            # label id -> number of packages having it
+            self.counts = collections.Counter()
+            # label id -> {label id: number of packages having both}
+            self.pairs = collections.defaultdict(collections.Counter)
+            self.seq = 0
+            self.loaded_on = None
+            self.refreshed_on = None
+
+    def _label_id(self, label):
+        if label not in self.label_ids:
+            self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self.label_ids[label]
+
+    @staticmethod
+    def _query(session):
+        return session.query(
+            Tag.package_id, Tag.label, Tag.like - Tag.dislike
+        ).filter(
+            Tag.banned == False,
+            Tag.like > Tag.dislike,
+        )
+
+    def _best(self, tags):
+        """ Return the `pair_tags` best labels of a package. """
+        if len(tags) <= self.pair_tags:
+            return tags
+        return heapq.nsmallest(
+            self.pair_tags, tags, key=lambda label: (-tags[label], label))
+
+    def _count(self, tags, step):
+        """ Add (step=1) or remove (step=-1) the labels of a package from
+        the counts.
+        """
+        for label in tags:
+            self.counts[label] += step
+            if not self.counts[label]:
+                del self.counts[label]
+        for label, other in itertools.permutations(self._best(tags), 2):
+            neighbours = self.pairs[label]
+            neighbours[other] += step
+            if not neighbours[other]:
+                del neighbours[other]
+                if not neighbours:
+                    del self.pairs[label]
+
+    def _set_package(self, package_id, tags):
+        old = self.tags.pop(package_id, {})
+        self.norms.pop(package_id, None)
+        self._count(old, -1)
+        for label in old:
+            self.postings[label].discard(package_id)
+            if not self.postings[label]:
+                del self.postings[label]
+        if tags:
+            self.tags[package_id] = tags
+            self.norms[package_id] = math.sqrt(
+                sum(total * total for total in tags.itervalues()))
+            self._count(tags, 1)
+            for label in tags:
+                self.postings[label].add(package_id)
+
+    def load(self, session):
+        """ Build the index from the tag table, aside, then swap it in. """
+        index = TagIndex(self.min_cooccurrence, self.pair_tags)
+        # Read the sequence first, the changes recorded while loading will
+        # be applied again by the next refresh.
+        index.seq = Change.last(session)
+        rows = self._query(session).order_by(Tag.package_id)
+        for package_id, tags in itertools.groupby(
+                rows.yield_per(1000), itemgetter(0)):
+            index._set_package(package_id, dict(
+                (index._label_id(label), total)
+                for _, label, total in tags))
+        index.loaded_on = index.refreshed_on = time.time()
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(index, name))
+
+    def refresh(self, session):
+        """ Apply the changes of the tags recorded since the last load or
+        refresh, reload everything if there are too many of them.
+        """
+        last = Change.last(session)
+        package_ids = [
+            package_id for package_id, in session.query(
+                Change.package_id
+            ).filter(
+                Change.id > self.seq,
+                Change.id <= last,
+                Change.kind.in_([u'tag', u'delete']),
+            ).distinct().limit(REFRESH_LIMIT + 1)
+        ]
+        if len(package_ids) > REFRESH_LIMIT:
+            return self.load(session)
+
+        tags = dict((package_id, []) for package_id in package_ids)
+        for start in range(0, len(package_ids), 500):
+            for package_id, label, total in self._query(session).filter(
+                    Tag.package_id.in_(package_ids[start:start + 500])):
+                tags[package_id].append((label, total))
+        with self._lock:
+            for package_id, package_tags in tags.items():
+                self._set_package(package_id, dict(
+                    (self._label_id(label), total)
+                    for label, total in package_tags))
+            self.seq = last
+            self.refreshed_on = time.time()
+
+    def update(self, session, refresh=10):
+        """ Load the index if it never was, refresh it when it is older
+        than the given number of seconds.
+
+        Only one thread updates the index at a time, the others go on with
+        the current one.
+
+        :arg session: the session used to query the database
+        :kwarg refresh: the number of seconds between two refreshes from
+            the change feed
+        """
+        if self.loaded_on is None:
+            with self._update_lock:
+                if self.loaded_on is None:
+                    self.load(session)
+        elif time.time() - self.refreshed_on >= refresh \
+                and self._update_lock.acquire(False):
+            try:
+                self.refresh(session)
+            finally:
+                self._update_lock.release()
+        return self
+
+    def start(self, session, interval):
+        """ Load the index now, then again every `interval` seconds, from
+        a background thread.
+
+        :arg session: the scoped_session used by the thread
+        :arg interval: the number of seconds between two loads
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(session, interval), name='tag-index')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, session, interval):
+        while True:
+            try:
+                with self._update_lock:
+                    self.load(session())
+            except Exception:
+                log.exception('Could not load the tag index')
+            finally:
+                session.remove()
+            if self._stop.wait(interval):
+                break
+
+    def stop(self):
+        """ Stop the background thread. """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def suggest(self, package_id, exclude=(), limit=10):
+        """ Return the labels most likely to apply to a package, as a list
+        of (label, score) tuples, best first.
+
+        The score of a label is the sum of its positive pointwise mutual
+        information with each of the labels of the package.
+
+        :arg package_id: the identifier of the package
+        :kwarg exclude: labels not to suggest, like the tags the package
+            already has
+        :kwarg limit: the maximum number of labels to return
+        """
+        with self._lock:
+            tags = self.tags.get(package_id, {})
+            n_packages = float(len(self.tags))
+            exclude = set(self.label_ids.get(label) for label in exclude)
+            scores = collections.defaultdict(float)
+            for tag in self._best(tags):
+                n_tag = self.counts[tag]
+                for other, n_pair in self.pairs.get(tag, {}).iteritems():
+                    if n_pair < self.min_cooccurrence or other in tags \
+                            or other in exclude:
+                        continue
+                    pmi = math.log(
+                        n_pair * n_packages / (n_tag * self.counts[other]))
+                    if pmi > 0:
+                        scores[other] += pmi
+
+            best = heapq.nsmallest(limit, (
+                (-score, self.labels[label])
+                for label, score in scores.iteritems()))
+            return [(label, -score) for score, label in best]
+
+    def similar(self, package_id, limit=10, candidates=SIMILAR_CANDIDATES):
+        """ Return the packages whose tags are the most similar to the ones
+        of a package, as a list of (package id, score) tuples, best first.
+
+        The score is the cosine similarity of the vectors of the totals of
+        the tags of the two packages.  Only the packages sharing the rarest
+        labels of the package are compared, the rarest label first, until
+        at least `candidates` of them are found: the common labels would
+        bring most of the catalogue for little similarity.
+
+        :arg package_id: the identifier of the package
+        :kwarg limit: the maximum number of packages to return
+        :kwarg candidates: the number of packages compared with the given
+            one, above which the search stops
+        """
+        with self._lock:
+            tags = self.tags.get(package_id)
+            if not tags:
+                return []
+
+            found = set()
+            for label in sorted(tags, key=lambda l: len(self.postings[l])):
+                if len(found) >= candidates:
+                    break
+                found.update(self.postings[label])
+            found.discard(package_id)
+
+            norm = self.norms[package_id]
+            scores = []
+            for other in found:
+                other_tags = self.tags[other]
+                dot = sum(total * other_tags[label]
+                          for label, total in tags.iteritems()
+                          if label in other_tags)
+                scores.append((-dot / (norm * self.norms[other]), other))
+
+            best = heapq.nsmallest(limit, scores)
+            return [(other, -score) for score, other in best]
+
+
+INDEX = TagIndex()
@@ -32,6 +32,7 @@ import yaml
 
 from kitchen.text.converters import to_unicode
 
+from sqlalchemy import text
 from sqlalchemy.orm.exc import NoResultFound
 
 # Relative import
@@ -81,6 +82,14 @@ def get_yum_query(require=True):
     return YumQuery()
 
 
+def _record_packages(packages):
+    """ Record the given packages, new or updated, in the change feed. """
+    # The new packages get their identifier.
+    ft.SESSION.flush()
+    for package in packages:
+        m.Change.record(ft.SESSION, u'package', package.id)
+
+
 def import_koji_pkgs():
     """ Get the latest packages from koji.  These might not have made it into
     yum yet, so we won't even check for their summary until later.
@@ -92,6 +101,7 @@ def import_koji_pkgs():
     tagbp = 230 # id of el6-docs tag to bypass
     packages = session.listPackages()
     log.info("Looking through %i packages from koji." % len(packages))
+    new = []
     for package in packages:
         name = to_unicode(package['package_name'])
         pkg_tagstatus = session.getPackageConfig(tagbp, package['package_id'])
@@ -104,7 +114,9 @@ def import_koji_pkgs():
         except NoResultFound:
             log.debug(name + ' -')
             count += 1
-            ft.SESSION.add(m.Package(name=name, summary=u''))
+            new.append(m.Package(name=name, summary=u''))
+            ft.SESSION.add(new[-1])
+    _record_packages(new)
 
     log.info("Got %i new packages from koji (with no summaries yet)" % count)
 
@@ -122,8 +134,8 @@ def update_summaries(N=100):
         log.warn("No access to yum.  Aborting.")
         return
 
-    query = ft.SESSION.query(m.Package).filter(
-                                  m.Package.summary.in_([u'', u'(no summary)']))
+    # Spelled as in the partial index so that the database picks it up.
+    query = ft.SESSION.query(m.Package).filter(text(m.MISSING_SUMMARY))
     log.info("There are %i such packages... hold on." % query.count())
 
     # We limit this to only getting the first N summaries, since querying yum
@@ -145,6 +157,8 @@ def update_summaries(N=100):
             count += 1
         else:
             package.summary = '(no summary)'
+        package.touch()
+        m.Change.record(ft.SESSION, u'package', package.id)
 
         if count > N:
             break
@@ -175,16 +189,19 @@ def import_meta_applications(url):
         return
 
     count = 0
+    new = []
     for package in packages:
         try:
             p = m.Package.by_name(ft.SESSION, package['name'])
         except NoResultFound:
             log.debug(package['name'] + ' - ' + package['summary'])
             count += 1
-            ft.SESSION.add(m.Package(
+            new.append(m.Package(
                 name=package['name'],
                 summary=package['summary']
             ))
+            ft.SESSION.add(new[-1])
+    _record_packages(new)
 
     log.info("Done importing %i meta applications for gnome-software" % count)
 
@@ -212,6 +229,9 @@ def main():
     import_koji_pkgs()
     update_summaries(int(args.summaries_to_process))
     import_meta_applications(args.url_for_meta_applications)
+    # Follow the changes of the blacklist.
+    count = m.Tag.update_banned(ft.SESSION)
+    log.info("Updated the banned flag of %i labels" % count)
 
     ft.SESSION.commit()
 
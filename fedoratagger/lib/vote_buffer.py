@@ -0,0 +1,237 @@
+# This file is a part of Fedora Tagger
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301  USA
+#
+# Refer to the README.rst and LICENSE files for full details of the license
+# -*- coding: utf-8 -*-
+""" Write-behind buffer of the counters updated by the votes.
+
+Every vote increments the like/dislike counters of a tag and the score of
+the voter, so under bursts of votes the transactions queue on the locks of
+the same few rows.  When the buffer is running (see VOTE_BUFFER_INTERVAL),
+add_vote still stores the Vote row right away but the increments are
+accumulated here once the vote is committed, and written by a background
+thread every `interval` seconds, one UPDATE per tag and per user.  The
+changes of the tags are recorded in the change feed at that time.
+
+The serialized tags and users (Tag.__json__, FASUser.__json__) include the
+increments not written yet, the SQL queries (rankings, exports) see them
+after the next flush.  The increments of a worker that dies before
+flushing are lost, the Vote rows are not.
+"""
+
+import atexit
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import model
+
+log = logging.getLogger(__name__)
+
+
+class VoteBuffer(object):
+    """ The increments of the tag counters and of the user scores not
+    written to the database yet.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.interval = None
+        self._reset()
+        # The increments being written by flush, still to be counted by
+        # the readers until they are committed.
+        self._flushing = ({}, {})
+
+    def _reset(self):
+        # tag id -> [likes, dislikes, package id, label]
+        self.tags = {}
+        # user id -> score
+        self.scores = {}
+
+    @property
+    def running(self):
+        """ Wether the increments are buffered, see start. """
+        return self._thread is not None
+
+    def add(self, tag_id, package_id, label, likes, dislikes, user_id,
+            score):
+        """ Buffer the increments of a committed vote. """
+        self._merge({tag_id: [likes, dislikes, package_id, label]},
+                    {user_id: score} if score else {})
+
+    def _merge(self, tags, scores):
+        with self._lock:
+            for tag_id, (likes, dislikes, package_id, label) in \
+                    tags.iteritems():
+                pending = self.tags.setdefault(
+                    tag_id, [0, 0, package_id, label])
+                pending[0] += likes
+                pending[1] += dislikes
+            for user_id, score in scores.iteritems():
+                self.scores[user_id] = self.scores.get(user_id, 0) + score
+
+    def tag_counts(self, tag):
+        """ Return the likes and dislikes of a tag, including the ones not
+        written yet.
+        """
+        like, dislike = tag.like, tag.dislike
+        for tags in (self.tags, self._flushing[0]):
+            pending = tags.get(tag.id)
+            if pending:
+                like += pending[0]
+                dislike += pending[1]
+        return like, dislike
+
+    def user_score(self, user):
+        """ Return the score of a user, including the points not written
+        yet.
+        """
+        return user.score + self.scores.get(user.id, 0) \
+            + self._flushing[1].get(user.id, 0)
+
+    def flush(self, session):
+        """ Write the buffered increments, returns the number of tags
+        updated.
+
+        The increments are kept for the next flush if the database cannot
+        be reached.  If one of them cannot be written, they are written
+        one by one and the faulty ones dropped.  The tags and users
+        removed in the meantime are skipped.
+
+        :arg session: the session used to query the database
+        """
+        with self._lock:
+            tags, scores = self.tags, self.scores
+            self._reset()
+            self._flushing = (tags, scores)
+        try:
+            return self._write(session, tags, scores)
+        except OperationalError:
+            session.rollback()
+            self._merge(tags, scores)
+            raise
+        except Exception:
+            session.rollback()
+            log.exception('Could not write the vote counters at once')
+            count = 0
+            for tag_id in sorted(tags):
+                count += self._write_or_drop(
+                    session, {tag_id: tags[tag_id]}, {})
+            for user_id in sorted(scores):
+                self._write_or_drop(session, {}, {user_id: scores[user_id]})
+            return count
+        finally:
+            with self._lock:
+                self._flushing = ({}, {})
+
+    def _write_or_drop(self, session, tags, scores):
+        try:
+            return self._write(session, tags, scores)
+        except Exception:
+            session.rollback()
+            log.exception('Dropping the vote counters %r %r', tags, scores)
+            return 0
+
+    @staticmethod
+    def _write(session, tags, scores):
+        """ Write and commit increments, returns the number of tags
+        updated.
+        """
+        # Always lock the rows in the same order, to avoid deadlocks
+        # between the workers.
+        count = 0
+        package_ids = set()
+        for tag_id, (likes, dislikes, package_id, label) in sorted(
+                tags.items()):
+            updated = session.query(model.Tag).filter_by(id=tag_id).update({
+                'like': model.Tag.like + likes,
+                'dislike': model.Tag.dislike + dislikes,
+            }, synchronize_session=False)
+            if updated:
+                count += 1
+                model.Change.record(session, 'tag', package_id, label)
+                package_ids.add(package_id)
+        model.Package.touch_all(session, package_ids)
+        for user_id, score in sorted(scores.items()):
+            session.query(model.FASUser).filter_by(id=user_id).update(
+                {'score': model.FASUser.score + score},
+                synchronize_session=False)
+        session.commit()
+        return count
+
+    def start(self, session, interval):
+        """ Start buffering the increments, and flushing them every
+        `interval` seconds from a background thread.
+
+        :arg session: the scoped_session used by the thread
+        :arg interval: the number of seconds between two flushes
+        """
+        if self._thread is not None:
+            return
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(session,), name='vote-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop, session)
+
+    def _run(self, session):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush(session())
+            except Exception:
+                log.exception('Could not write the vote counters')
+            finally:
+                session.remove()
+
+    def stop(self, session):
+        """ Stop the background thread and write what is left.
+
+        :arg session: the scoped_session used to write
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.flush(session())
+        finally:
+            session.remove()
+
+
+BUFFER = VoteBuffer()
+
+
+@event.listens_for(Session, 'after_commit')
+def _add_committed(session):
+    """ Buffer the increments of the votes once they are committed, see
+    fedoratagger.lib.add_vote.
+    """
+    for increments in session.info.pop('vote_buffer', ()):
+        BUFFER.add(*increments)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back(session):
+    session.info.pop('vote_buffer', None)
@@ -55,5 +55,7 @@ setup(
     fedoratagger-update-db = fedoratagger.lib.update:main
     fedoratagger-remove-pkgs = fedoratagger.lib.retired:main
     fedoratagger-merge-tag = fedoratagger.lib.merge_tags:main
+    fedoratagger-compact-users = fedoratagger.lib.compact:main
+    fedoratagger-bench = fedoratagger.lib.bench:main
     '''
 )
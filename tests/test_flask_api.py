@@ -26,20 +26,31 @@ __requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
 import pkg_resources
 
 import base64
+import datetime
 import json
+import math
 import unittest
 import tempfile
 import sqlite3
+import shutil
+import zlib
 import os
 import sys
+import sqlalchemy
 from werkzeug import wrappers
 
 sys.path.insert(0, os.path.join(os.path.dirname(
     os.path.abspath(__file__)), '..'))
 
 import fedoratagger
+import fedoratagger.flask_utils
 import fedoratagger.lib
 from fedoratagger.lib import model
+from fedoratagger.lib import ratelimit
+from fedoratagger.lib import tag_index
+from fedoratagger.lib.columnar_export import (
+    load_columnarratings, load_columnartags)
+from fedoratagger.frontend.widgets import card
 from tests import (
     Modeltests,
     FakeUser,
@@ -63,6 +74,10 @@ class Flasktests(Modeltests):
         fedoratagger.APP.config['TESTING'] = True
         fedoratagger.SESSION = self.session
         fedoratagger.api.SESSION = self.session
+        card.cards.clear()
+        tag_index.INDEX.clear()
+        fedoratagger.APP.extensions['ratelimit'] = ratelimit.create_limiter(
+            fedoratagger.APP.config)
         self.app = fedoratagger.APP.test_client()
         wrappers.BaseRequest.remote_addr = '1.2.3'
         user = FakeUser()
@@ -139,6 +154,91 @@ class Flasktests(Modeltests):
         self.assertEqual(output['tags'][0]['like'], 2)
         self.assertEqual(output['tags'][0]['dislike'], 0)
 
+        output = self.app.get('/api/v1/guake/tag/?top=1')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual([tag['tag'] for tag in output['tags']], [u'gnóme'])
+
+        output = self.app.get('/api/v1/guake/?top=abc')
+        self.assertEqual(output.status_code, 500)
+        output = json.loads(output.data)
+        self.assertEqual(output['error'], 'Invalid top argument submitted')
+
+    def test_pkg_get_suggest(self):
+        """ Test the pkg_get_suggest function.  """
+        fedoratagger.APP.config['TAG_INDEX_REFRESH'] = 0
+
+        output = self.app.get('/api/v1/geany/suggest/')
+        self.assertEqual(output.status_code, 404)
+        output = json.loads(output.data)
+        self.assertEqual(output['output'], 'notok')
+        self.assertEqual(output['error'], 'Package "geany" not found')
+
+        create_package(self.session)
+        create_tag(self.session)
+
+        output = self.app.get('/api/v1/geany/suggest/')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output, {'name': 'geany', 'suggestions': []})
+
+        user = model.FASUser.by_name(self.session, 'pingou')
+        self.session.add(model.Package(name='mc', summary=u'file manager'))
+        fedoratagger.lib.add_tag(self.session, 'mc', 'console', user)
+        fedoratagger.lib.add_tag(self.session, 'gitg', u'gnóme', user)
+        fedoratagger.lib.add_tag(self.session, 'gitg', 'terminal', user)
+        self.session.commit()
+
+        output = self.app.get('/api/v1/geany/suggest/')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['name'], 'geany')
+        self.assertEqual(len(output['suggestions']), 1)
+        self.assertEqual(output['suggestions'][0]['tag'], 'terminal')
+        self.assertAlmostEqual(
+            output['suggestions'][0]['score'], math.log(4 / 3.))
+
+        output = self.app.get('/api/v1/guake/suggest/')
+        output = json.loads(output.data)
+        self.assertEqual(output['suggestions'], [])
+
+        output = self.app.get('/api/v1/geany/suggest/?limit=abc')
+        self.assertEqual(output.status_code, 500)
+
+    def test_pkg_get_similar(self):
+        """ Test the pkg_get_similar function.  """
+        fedoratagger.APP.config['TAG_INDEX_REFRESH'] = 0
+
+        output = self.app.get('/api/v1/geany/similar/')
+        self.assertEqual(output.status_code, 404)
+        output = json.loads(output.data)
+        self.assertEqual(output['output'], 'notok')
+        self.assertEqual(output['error'], 'Package "geany" not found')
+
+        create_package(self.session)
+
+        output = self.app.get('/api/v1/geany/similar/')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output, {'name': 'geany', 'similar': []})
+
+        create_tag(self.session)
+
+        output = self.app.get('/api/v1/geany/similar/')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['name'], 'geany')
+        self.assertEqual(len(output['similar']), 1)
+        self.assertEqual(output['similar'][0]['name'], 'guake')
+        self.assertAlmostEqual(output['similar'][0]['score'], 0.5)
+
+        output = self.app.get('/api/v1/gitg/similar/')
+        output = json.loads(output.data)
+        self.assertEqual(output['similar'], [])
+
+        output = self.app.get('/api/v1/geany/similar/?limit=0')
+        self.assertEqual(output.status_code, 500)
+
     def test_tag_get(self):
         """ Test the tag_get function.  """
 
@@ -160,6 +260,27 @@ class Flasktests(Modeltests):
         self.assertEqual(output['tag'], u'gnóme')
         self.assertEqual(len(output['packages']), 2)
         self.assertEqual(output['packages'][0]['package'], 'guake')
+        self.assertEqual(output['next'], None)
+
+        output = self.app.get(u'/api/v1/tag/gnóme/?limit=1')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(len(output['packages']), 1)
+        self.assertEqual(output['packages'][0]['package'], 'guake')
+        self.assertEqual(output['next'], 1)
+
+        output = self.app.get(u'/api/v1/tag/gnóme/?limit=1&after=1')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(len(output['packages']), 1)
+        self.assertEqual(output['packages'][0]['package'], 'geany')
+        self.assertEqual(output['next'], None)
+
+        output = self.app.get(u'/api/v1/tag/gnóme/?limit=0')
+        self.assertEqual(output.status_code, 500)
+        output = json.loads(output.data)
+        self.assertEqual(output['error'],
+                         'Invalid after or limit argument submitted')
 
     def test_tag_put(self):
         """ Test the tag_pkg_put function.  """
@@ -231,13 +352,14 @@ class Flasktests(Modeltests):
         self.assertEqual(output.status_code, 200)
         output = json.loads(output.data)
         self.assertEqual(output['name'], 'guake')
-        self.assertEqual(output['tags'][0]['tag'], u'gnóme')
-        self.assertEqual(output['tags'][0]['votes'], 1)
-        self.assertEqual(output['tags'][0]['like'], 1)
+        # Best tag first.
+        self.assertEqual(output['tags'][0]['tag'], 'terminal')
+        self.assertEqual(output['tags'][0]['votes'], 2)
+        self.assertEqual(output['tags'][0]['like'], 2)
         self.assertEqual(output['tags'][0]['dislike'], 0)
-        self.assertEqual(output['tags'][1]['tag'], 'terminal')
-        self.assertEqual(output['tags'][1]['votes'], 2)
-        self.assertEqual(output['tags'][1]['like'], 2)
+        self.assertEqual(output['tags'][1]['tag'], u'gnóme')
+        self.assertEqual(output['tags'][1]['votes'], 1)
+        self.assertEqual(output['tags'][1]['like'], 1)
         self.assertEqual(output['tags'][1]['dislike'], 0)
 
         #This tests that invalid tags are rejected.
@@ -385,6 +507,51 @@ class Flasktests(Modeltests):
         self.assertEqual(output['rating'], 75)
         self.assertEqual(len(output['packages']), 1)
         self.assertEqual(output['packages'][0], 'guake')
+        self.assertEqual(output['next'], None)
+
+        output = self.app.get('/api/v1/rating/75/?after=1')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['packages'], [])
+
+        output = self.app.get('/api/v1/rating/75/?after=a')
+        self.assertEqual(output.status_code, 500)
+
+    def test_rating_range(self):
+        """ Test rating_range and rating_top """
+        output = self.app.get('/api/v1/rating/range/?min=70')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['packages'], [])
+
+        create_package(self.session)
+        create_rating(self.session)
+
+        output = self.app.get('/api/v1/rating/range/?min=70')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['packages'], [
+            {'name': 'guake', 'rating': 75.0},
+            {'name': 'geany', 'rating': 100.0},
+        ])
+
+        output = self.app.get('/api/v1/rating/range/?min=70&max=80')
+        output = json.loads(output.data)
+        self.assertEqual(output['packages'], [
+            {'name': 'guake', 'rating': 75.0},
+        ])
+
+        output = self.app.get('/api/v1/rating/range/?max=a')
+        self.assertEqual(output.status_code, 500)
+        output = json.loads(output.data)
+        self.assertEqual(output['error'], 'Invalid max rating provided "a"')
+
+        output = self.app.get('/api/v1/rating/top/?limit=1')
+        self.assertEqual(output.status_code, 200)
+        output = json.loads(output.data)
+        self.assertEqual(output['packages'], [
+            {'name': 'geany', 'rating': 100.0},
+        ])
 
     def test_rating_put(self):
         """ Test the rating_pkg_put function.  """
@@ -554,13 +721,14 @@ class Flasktests(Modeltests):
         self.assertEqual(output.status_code, 200)
         output = json.loads(output.data)
         self.assertEqual(output['name'], 'guake')
-        self.assertEqual(output['tags'][0]['tag'], u'gnóme')
-        self.assertEqual(output['tags'][0]['votes'], 2)
-        self.assertEqual(output['tags'][0]['like'], 2)
+        # Best tag first.
+        self.assertEqual(output['tags'][0]['tag'], 'terminal')
+        self.assertEqual(output['tags'][0]['votes'], 3)
+        self.assertEqual(output['tags'][0]['like'], 3)
         self.assertEqual(output['tags'][0]['dislike'], 0)
-        self.assertEqual(output['tags'][1]['tag'], 'terminal')
-        self.assertEqual(output['tags'][1]['votes'], 3)
-        self.assertEqual(output['tags'][1]['like'], 3)
+        self.assertEqual(output['tags'][1]['tag'], u'gnóme')
+        self.assertEqual(output['tags'][1]['votes'], 2)
+        self.assertEqual(output['tags'][1]['like'], 2)
         self.assertEqual(output['tags'][1]['dislike'], 0)
 
     def test_api(self):
@@ -585,6 +753,22 @@ class Flasktests(Modeltests):
         u'guake\tterminal\n'
         u'geany\tgnóme\ngeany\tide')
 
+        output = self.app.get('/api/v1/tag/dump/?since=2100-01-01')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data, '')
+
+        tag = model.Tag.get(self.session, 2, u'ide')
+        tag.updated_on = datetime.datetime(2100, 1, 2, 3, 4, 5)
+        self.session.commit()
+        output = self.app.get('/api/v1/tag/dump/?since=2100-01-01T12:00:00')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data, 'geany\tide')
+
+        output = self.app.get('/api/v1/tag/dump/?since=yesterday')
+        self.assertEqual(output.status_code, 500)
+        data = json.loads(output.data)
+        self.assertEqual(data['output'], 'notok')
+
     def test_tag_export(self):
         """ Test tag_pkg_export.
 
@@ -625,6 +809,69 @@ class Flasktests(Modeltests):
         }
         self.assertEqual(json.loads(output.data), target)
 
+        fedoratagger.lib.add_vote(
+            self.session, 'geany', 'ide', True,
+            model.FASUser.by_name(self.session, 'ralph'))
+        self.session.commit()
+
+        output = self.app.get('/api/v1/tag/export/?top=1')
+        self.assertEqual(output.status_code, 200)
+        target = {
+            u'packages': [
+                {u'guake': [{u'tag': u'gnóme', u'total': 2}]},
+                {u'geany': [{u'tag': u'ide', u'total': 3}]},
+                {u'gitg': []},
+            ]
+        }
+        self.assertEqual(json.loads(output.data), target)
+
+        output = self.app.get('/api/v1/tag/export/?top=0')
+        self.assertEqual(output.status_code, 500)
+        output = json.loads(output.data)
+        self.assertEqual(output['error'], 'Invalid top argument submitted')
+
+    def test_json(self):
+        """ Test the JSON encoding of the answers. """
+        create_package(self.session)
+        create_tag(self.session)
+
+        output = self.app.get('/api/v1/guake/')
+        self.assertEqual(output.mimetype, 'application/json')
+        self.assertFalse('\n' in output.data)
+        self.assertTrue('"name":"guake"' in output.data)
+
+        with fedoratagger.APP.test_request_context('/'):
+            # Dates are left to the flask encoder.
+            date = datetime.datetime(2013, 5, 27)
+            expected = {'a': [1, u'gnóme'],
+                        'b': 'Mon, 27 May 2013 00:00:00 GMT'}
+            for backend in (None, 'json', 'ujson'):
+                fedoratagger.APP.config['JSON_BACKEND'] = backend
+                self.assertEqual(json.loads(fedoratagger.flask_utils.dumps(
+                    {'a': [1, u'gnóme'], 'b': date})), expected)
+            fedoratagger.APP.config['JSON_BACKEND'] = 'json'
+
+            fedoratagger.APP.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+            try:
+                self.assertEqual(fedoratagger.flask_utils.dumps({'a': 1}),
+                                 '{\n  "a": 1\n}')
+            finally:
+                fedoratagger.APP.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+
+            for kwargs in ({}, {'output': 'ok'}):
+                response = fedoratagger.flask_utils.jsonify_stream(
+                    'items', iter([{'a': 1}, 2]), **kwargs)
+                expected = dict(kwargs, items=[{'a': 1}, 2])
+                self.assertEqual(
+                    json.loads(''.join(response.response)), expected)
+            response = fedoratagger.flask_utils.jsonify_stream(
+                'items', iter([]))
+            self.assertEqual(''.join(response.response), '{"items":[]}')
+            response = fedoratagger.flask_utils.jsonify_stream(
+                'items', xrange(1234))
+            self.assertEqual(json.loads(''.join(response.response)),
+                             {'items': range(1234)})
+
     def test_tag_sqlite(self):
         """ Test tag_pkg_sqlite.
 
@@ -657,6 +904,172 @@ class Flasktests(Modeltests):
         for actual, target in zip(rows, target_rows):
             self.assertEqual(actual, target)
 
+    def test_tag_columnar(self):
+        """ Test tag_pkg_columnar """
+        create_package(self.session)
+        create_tag(self.session)
+
+        output = self.app.get('/api/v1/tag/columnar/')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.mimetype, 'application/octet-stream')
+        self.assertEqual(len(output.data) % 4, 0)
+
+        data = load_columnartags(output.data)
+        self.assertEqual(data['packages'], [u'guake', u'geany', u'gitg'])
+        self.assertEqual(data['labels'], [u'gnóme', u'terminal', u'ide'])
+        rows = [
+            (data['packages'][package], data['labels'][label], score)
+            for package, label, score in zip(
+                data['package'], data['label'], data['score'])
+        ]
+        self.assertEqual(rows, [
+            (u'guake', u'gnóme', 2),
+            (u'guake', u'terminal', 2),
+            (u'geany', u'gnóme', 2),
+            (u'geany', u'ide', 2),
+        ])
+
+        etag = output.headers['ETag']
+        # Answered without building the export.
+        columnartags = fedoratagger.lib.columnartags
+        fedoratagger.lib.columnartags = None
+        try:
+            output = self.app.get('/api/v1/tag/columnar/',
+                                  headers={'If-None-Match': etag})
+        finally:
+            fedoratagger.lib.columnartags = columnartags
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.headers['ETag'], etag)
+
+        data = {'pkgname': 'gitg', 'tag': 'vcs'}
+        output = self.app.put('/api/v1/tag/gitg/', data=data)
+        self.assertEqual(output.status_code, 200)
+        output = self.app.get('/api/v1/tag/columnar/',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertNotEqual(output.headers['ETag'], etag)
+
+    def test_rating_columnar(self):
+        """ Test rating_pkg_columnar """
+        create_package(self.session)
+        create_rating(self.session)
+        set_usages(self.session, True)
+
+        output = self.app.get('/api/v1/rating/columnar/')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.mimetype, 'application/octet-stream')
+        self.assertEqual(len(output.data) % 4, 0)
+
+        data = load_columnarratings(output.data)
+        self.assertEqual(data['packages'], [u'guake', u'geany', u'gitg'])
+        self.assertEqual(list(data['rating']), [750, 1000, -1])
+        self.assertEqual(list(data['n_ratings']), [2, 1, 0])
+        self.assertEqual(list(data['usage']), [2, 1, 1])
+
+        etag = output.headers['ETag']
+        output = self.app.get('/api/v1/rating/columnar/',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+
+    def test_compression(self):
+        """ Test the compression of the answers. """
+        create_package(self.session)
+        create_tag(self.session)
+        plain = self.app.get('/api/v1/tag/dump/').data
+
+        # Streamed answers are compressed as they are sent.
+        output = self.app.get('/api/v1/tag/dump/',
+                              headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(output.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(zlib.decompress(output.data, 16 + zlib.MAX_WBITS),
+                         plain)
+
+        output = self.app.get('/api/v1/tag/export/',
+                              headers={'Accept-Encoding': 'deflate'})
+        self.assertEqual(output.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(json.loads(zlib.decompress(output.data))[
+            'packages'][2], {'gitg': []})
+
+        output = self.app.get('/api/v1/tag/dump/',
+                              headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertFalse('Content-Encoding' in output.headers)
+        self.assertEqual(output.data, plain)
+
+        # Small answers are not worth it.
+        output = self.app.get('/api/v1/guake/',
+                              headers={'Accept-Encoding': 'gzip'})
+        self.assertFalse('Content-Encoding' in output.headers)
+        json.loads(output.data)
+
+        # The compressed answers have their own ETag.
+        fedoratagger.APP.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            output = self.app.get('/api/v1/tag/columnar/',
+                                  headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(output.headers['Content-Encoding'], 'gzip')
+            etag = output.headers['ETag']
+            self.assertTrue(etag.endswith('-gzip"'))
+            output = self.app.get('/api/v1/tag/columnar/', headers={
+                'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(output.status_code, 304)
+        finally:
+            fedoratagger.APP.config['COMPRESS_MIN_SIZE'] = 1024
+
+    def test_export_cache(self):
+        """ Test that the exports are served from the export cache. """
+        directory = tempfile.mkdtemp()
+        fedoratagger.APP.config['EXPORT_CACHE_DIR'] = directory
+        try:
+            create_package(self.session)
+            create_tag(self.session)
+
+            plain = self.app.get('/api/v1/tag/dump/')
+            self.assertEqual(plain.status_code, 200)
+            self.assertFalse('Content-Encoding' in plain.headers)
+            self.assertEqual(plain.data.decode('utf-8'), u'guake\tgnóme\n'
+                             u'guake\tterminal\ngeany\tgnóme\ngeany\tide')
+            # Three files, and the directory of the locks.
+            self.assertEqual(len(os.listdir(directory)), 4)
+
+            output = self.app.get('/api/v1/tag/dump/',
+                                  headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(output.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(
+                zlib.decompress(output.data, 16 + zlib.MAX_WBITS),
+                plain.data)
+            self.assertEqual(output.headers['X-Change-Sequence'],
+                             plain.headers['X-Change-Sequence'])
+
+            # Each set of arguments is another export.
+            output = self.app.get('/api/v1/tag/dump/?since=2100-01-01')
+            self.assertEqual(output.data, '')
+            self.assertEqual(len(os.listdir(directory)), 7)
+
+            # A change replaces the export.
+            fedoratagger.lib.add_tag(
+                self.session, 'gitg', 'git',
+                model.FASUser.by_name(self.session, 'pingou'))
+            self.session.commit()
+            output = self.app.get('/api/v1/tag/dump/')
+            self.assertTrue(output.data.endswith('gitg\tgit'))
+            self.assertEqual(len(os.listdir(directory)), 7)
+
+            # So does a tag removed like by fedoratagger-merge-tag.
+            gitg = model.Package.by_name(self.session, 'gitg')
+            tag = model.Tag.get(self.session, gitg.id, 'git')
+            for vote in tag.votes:
+                self.session.delete(vote)
+            self.session.delete(tag)
+            model.Change.record(self.session, u'tag', gitg.id, u'git')
+            self.session.commit()
+            output = self.app.get('/api/v1/tag/dump/')
+            self.assertTrue(output.data.endswith('geany\tide'))
+        finally:
+            fedoratagger.APP.config['EXPORT_CACHE_DIR'] = None
+            shutil.rmtree(directory)
+
     def test_rating_dump(self):
         """ Test rating_pkg_dump """
         output = self.app.get('/api/v1/rating/dump/')
@@ -667,10 +1080,251 @@ class Flasktests(Modeltests):
         create_rating(self.session)
         set_usages(self.session, usage=True)
 
-        output = self.app.get('/api/v1/rating/dump/')
+        statements = []
+
+        def count_selects(conn, cursor, statement, *args):
+            if 'FROM package' in statement:
+                statements.append(statement)
+
+        engine = self.session.bind
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count_selects)
+        try:
+            output = self.app.get('/api/v1/rating/dump/', buffered=True)
+        finally:
+            sqlalchemy.event.remove(
+                engine, 'before_cursor_execute', count_selects)
         self.assertEqual(output.status_code, 200)
         expected = 'guake\t75.0\t2\t2\ngeany\t100.0\t1\t1\ngitg\t-1.0\t0\t1'
         self.assertEqual(output.data, expected)
+        self.assertEqual(1, len(statements))
+
+    def test_changes(self):
+        """ Test the change feed """
+        output = self.app.get('/api/v1/changes/')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['changes'], [])
+        self.assertEqual(data['last'], 0)
+        self.assertFalse(data['more'])
+
+        create_package(self.session)
+        create_tag(self.session)
+        user_pingou = model.FASUser.by_name(self.session, 'pingou')
+        user_toshio = model.FASUser.by_name(self.session, 'toshio')
+        user_ralph = model.FASUser.by_name(self.session, 'ralph')
+        fedoratagger.lib.add_rating(self.session, 'guake', 100, user_pingou)
+        fedoratagger.lib.add_rating(self.session, 'guake', 50, user_toshio)
+        fedoratagger.lib.add_rating(self.session, 'geany', 100, user_ralph)
+        self.session.commit()
+
+        output = self.app.get('/api/v1/tag/dump/')
+        self.assertEqual(output.headers['X-Change-Sequence'], '11')
+
+        output = self.app.get('/api/v1/changes/')
+        data = json.loads(output.data)
+        self.assertEqual(len(data['changes']), 11)
+        self.assertEqual(data['changes'][0], {
+            'seq': 1, 'type': 'tag', 'package': 'guake', 'tag': u'gnóme',
+            'total': 2})
+
+        output = self.app.get('/api/v1/changes/?since=8&limit=2')
+        data = json.loads(output.data)
+        self.assertEqual(data['changes'], [
+            {'seq': 9, 'type': 'rating', 'package': 'guake',
+             'rating': 75.0, 'votes': 2},
+            {'seq': 10, 'type': 'rating', 'package': 'guake',
+             'rating': 75.0, 'votes': 2},
+        ])
+        self.assertTrue(data['more'])
+        self.assertEqual(data['last'], 10)
+
+        output = self.app.get('/api/v1/changes/?since=10')
+        data = json.loads(output.data)
+        self.assertEqual(data['changes'], [
+            {'seq': 11, 'type': 'rating', 'package': 'geany',
+             'rating': 100.0, 'votes': 1},
+        ])
+        self.assertFalse(data['more'])
+
+        # The removed tags and packages.
+        guake = model.Package.by_name(self.session, 'guake')
+        gitg = model.Package.by_name(self.session, 'gitg')
+        tag = model.Tag.get(self.session, guake.id, 'terminal')
+        for vote in tag.votes:
+            self.session.delete(vote)
+        self.session.delete(tag)
+        model.Change.record(self.session, u'tag', guake.id, u'terminal')
+        model.Change.record_deletion(self.session, [gitg.id])
+        self.session.delete(gitg)
+        self.session.commit()
+
+        output = self.app.get('/api/v1/changes/?since=11')
+        data = json.loads(output.data)
+        self.assertEqual(data['changes'], [
+            {'seq': 12, 'type': 'tag', 'package': 'guake',
+             'tag': 'terminal', 'total': None},
+            {'seq': 13, 'type': 'delete', 'package': 'gitg'},
+        ])
+
+        output = self.app.get('/api/v1/changes/?since=abc')
+        self.assertEqual(output.status_code, 500)
+        data = json.loads(output.data)
+        self.assertEqual(data['output'], 'notok')
+
+        # Pruning keeps the last change, the consumers left behind are
+        # told to start again from an export.
+        future = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.assertTrue(model.Change.prune(self.session, future) > 0)
+        self.session.commit()
+        self.assertEqual(12, model.Change.pruned(self.session))
+        self.assertEqual(1, self.session.query(model.Change).count())
+        self.assertEqual(0, model.Change.prune(self.session, future))
+
+        output = self.app.get('/api/v1/changes/?since=11')
+        self.assertEqual(output.status_code, 410)
+        self.assertEqual(json.loads(output.data)['output'], 'notok')
+        output = self.app.get('/api/v1/changes/?since=12')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual([13], [change['seq'] for change in json.loads(
+            output.data)['changes']])
+
+    def test_read_replica(self):
+        """ Test that the anonymous GET requests read from the replicas. """
+        fd, db_filename = tempfile.mkstemp()
+        os.close(fd)
+        replica = model.create_tables('sqlite:///%s' % db_filename)
+        create_package(replica)
+        create_rating(replica)
+        create_package(self.session)
+
+        fedoratagger.SESSION = sqlalchemy.orm.scoped_session(
+            sqlalchemy.orm.sessionmaker(
+                bind=self.session.bind,
+                class_=fedoratagger.lib.RoutingSession,
+                replicas=[replica.bind]))
+        fedoratagger.APP.config['DB_READ_URLS'] = [
+            'sqlite:///%s' % db_filename]
+        try:
+            output = self.app.get('/api/v1/guake/rating/')
+            self.assertEqual(json.loads(output.data)['rating'], 75.0)
+
+            # Writes go to the primary, which is read for a while after.
+            data = {'pkgname': 'guake', 'rating': 100}
+            output = self.app.put('/api/v1/rating/guake/', data=data)
+            self.assertEqual(output.status_code, 200)
+            output = self.app.get('/api/v1/guake/rating/')
+            self.assertEqual(json.loads(output.data)['rating'], 100.0)
+
+            fedoratagger.APP.config['DB_READ_STICKINESS'] = -1
+            output = self.app.get('/api/v1/guake/rating/')
+            self.assertEqual(json.loads(output.data)['rating'], 75.0)
+            output = self.app.get(
+                '/api/v1/guake/rating/',
+                headers={'Authorization': 'Basic Zm9vOmJhcg=='})
+            self.assertEqual(json.loads(output.data)['rating'], 100.0)
+
+            # The GET requests writing read the user from the primary.
+            states = []
+            for _ in range(2):
+                output = self.app.get('/notifs_toggle/')
+                self.assertEqual(output.status_code, 200)
+                states.append(json.loads(output.data)['notifications_on'])
+            self.assertEqual([False, True], states)
+        finally:
+            fedoratagger.APP.config['DB_READ_URLS'] = []
+            fedoratagger.APP.config['DB_READ_STICKINESS'] = 10
+            replica.close()
+            os.unlink(db_filename)
+
+    def test_heartbeat(self):
+        """ Test that the heartbeat and the pool statistics do not use the
+        database.
+        """
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.session.bind
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            output = self.app.get('/_heartbeat')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(output.data, 'Lub-Dub')
+
+            # Only for the local host by default.
+            output = self.app.get('/_stats')
+            self.assertEqual(output.status_code, 403)
+
+            fedoratagger.APP.config['STATS_ALLOWED_IPS'] = ['1.2.3']
+            output = self.app.get('/_stats')
+            self.assertEqual(output.status_code, 200)
+            output = json.loads(output.data)
+            self.assertEqual(output['replicas'], [])
+            self.assertFalse('url' in output['primary'])
+
+            # Not through a proxy.
+            output = self.app.get(
+                '/_stats', headers={'X-Forwarded-For': '4.5.6.7'})
+            self.assertEqual(output.status_code, 403)
+        finally:
+            fedoratagger.APP.config['STATS_ALLOWED_IPS'] = [
+                '127.0.0.1', '::1']
+            sqlalchemy.event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(statements, [])
+
+    def test_rate_limit(self):
+        """ Test that the writes over the limit are refused before touching
+        the database.
+        """
+        create_package(self.session)
+        create_tag(self.session)
+        fedoratagger.APP.extensions['ratelimit'] = ratelimit.RateLimiter(
+            ratelimit.MemoryBackend(), 0.1, 2)
+        data = {'pkgname': 'guake', 'tag': 'terminal', 'vote': '1'}
+
+        for _ in range(2):
+            output = self.app.put('/api/v1/vote/guake/', data=data)
+            self.assertEqual(output.status_code, 200)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.session.bind
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            output = self.app.put('/api/v1/rating/guake/', data=data)
+        finally:
+            sqlalchemy.event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(statements, [])
+        self.assertEqual(output.status_code, 429)
+        self.assertEqual(output.headers['Retry-After'], '10')
+        output = json.loads(output.data)
+        self.assertEqual(output['output'], 'notok')
+        self.assertEqual(output['error'],
+                         'Too many requests, retry in 10 seconds')
+
+        # Claiming another user name does not give a new bucket.
+        output = self.app.put(
+            '/api/v1/rating/guake/', data=data,
+            headers={'Authorization': 'Basic ' + base64.b64encode('x:y')})
+        self.assertEqual(output.status_code, 429)
+
+        # The reads are not limited.
+        output = self.app.get('/api/v1/guake/')
+        self.assertEqual(output.status_code, 200)
+
+        fedoratagger.APP.config['STATS_ALLOWED_IPS'] = ['1.2.3']
+        try:
+            output = json.loads(self.app.get('/_stats').data)
+        finally:
+            fedoratagger.APP.config['STATS_ALLOWED_IPS'] = [
+                '127.0.0.1', '::1']
+        self.assertEqual(output['ratelimit'],
+                         {'rate': 0.1, 'burst': 2, 'allowed': 2,
+                          'throttled': 2})
 
     def test_random(self):
         """ Test pkg_random """
@@ -731,6 +1385,30 @@ class Flasktests(Modeltests):
         self.assertEqual(3, output['summary']['total_packages'])
         self.assertEqual(3, output['summary']['total_unique_tags'])
 
+    def test_statistics_by_user(self):
+        """ Test the votes listed by the statistics of a user """
+        create_package(self.session)
+        create_tag(self.session)
+        size = fedoratagger.APP.config.get('API_PAGE_SIZE')
+        fedoratagger.APP.config['API_PAGE_SIZE'] = 1
+        try:
+            # Paginated by default, like the other lists.
+            output = self.app.get('/api/v1/statistics-user/pingou/all')
+            self.assertEqual(output.status_code, 200)
+            output = json.loads(output.data)
+            self.assertTrue(output['total'] > 1)
+            self.assertEqual(1, len(output['like']) + len(output['dislike']))
+            self.assertNotEqual(None, output['next'])
+
+            output = self.app.get(
+                '/api/v1/statistics-user/pingou/all?limit=100')
+            output = json.loads(output.data)
+            self.assertEqual(output['total'],
+                             len(output['like']) + len(output['dislike']))
+            self.assertEqual(None, output['next'])
+        finally:
+            fedoratagger.APP.config['API_PAGE_SIZE'] = size
+
     def test_leaderboard(self):
         """ Test leaderboard """
         output = self.app.get('/api/v1/leaderboard/')
@@ -802,6 +1480,117 @@ class Flasktests(Modeltests):
         #self.assertEqual(output['name'], '1.2.3')
         #self.assertTrue(output['token'].startswith('dGFnZ2VyYXBp#'))
 
+    def test_card(self):
+        """ Test the cached rendering of the cards. """
+        create_package(self.session)
+        create_tag(self.session)
+        package = model.Package.by_name(self.session, 'guake')
+        # Avoid hitting fedora-packages for the icon.
+        package._meta = json.dumps({'icon': 'guake'})
+        self.session.commit()
+
+        output = self.app.get('/card/guake')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('icons/guake.png' in output.data)
+        self.assertTrue('terminal' in output.data)
+        cached = card.cards.get(package.id)
+        self.assertEqual(cached.revision, package.revision)
+        self.assertEqual(cached.usage, 0)
+
+        output = self.app.get('/card/guake')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(card.cards.get(package.id) is cached)
+
+        user = model.FASUser.by_name(self.session, 'ralph')
+        fedoratagger.lib.add_tag(self.session, 'guake', 'console', user)
+        self.session.commit()
+
+        output = self.app.get('/card/guake')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('console' in output.data)
+        self.assertFalse(card.cards.get(package.id) is cached)
+
+        # The banned tags are not shown.
+        user = model.FASUser.by_name(self.session, 'ralph')
+        fedoratagger.lib.add_tag(self.session, 'guake', 'x-console', user)
+        self.session.commit()
+        output = self.app.get('/card/guake')
+        self.assertTrue('console' in output.data)
+        self.assertFalse('x-console' in output.data)
+
+    def test_card_votes(self):
+        """ Test that the votes of the user are shown on the cards. """
+        create_package(self.session)
+        create_tag(self.session)
+        for package in model.Package.all(self.session):
+            package._meta = json.dumps({'icon': package.name})
+        username = fedoratagger.flask_utils.hsh(
+            '1.2.3', fedoratagger.APP.config['SECRET_SALT'])
+        user = model.FASUser.get_or_create(
+            self.session, username, anonymous=True)
+        fedoratagger.lib.add_vote(self.session, 'guake', 'terminal', False,
+                                  user)
+        self.session.commit()
+
+        statements = []
+
+        def count_votes(conn, cursor, statement, *args):
+            if 'FROM vote' in statement:
+                statements.append(statement)
+
+        engine = self.session.bind
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count_votes)
+        try:
+            output = self.app.get('/guake')
+        finally:
+            sqlalchemy.event.remove(
+                engine, 'before_cursor_execute', count_votes)
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('<span class="arrow downmod"></span>' in output.data)
+        self.assertEqual(1, len(statements))
+
+    def test_card_usages(self):
+        """ Test that the usages of the user are loaded at once. """
+        create_package(self.session)
+        create_user(self.session)
+        user = model.FASUser.by_name(self.session, 'pingou')
+        fedoratagger.lib.set_usage(self.session, 'guake', user, True)
+        self.session.commit()
+        with self.app.session_transaction() as session:
+            session['FLASK_FAS_OPENID_USER'] = {
+                'username': 'pingou', 'email': 'pingou@fp.o', 'groups': []}
+
+        statements = []
+
+        def count_usages(conn, cursor, statement, *args):
+            if 'usage.user_id =' in statement:
+                statements.append(statement)
+
+        engine = self.session.bind
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', count_usages)
+        try:
+            output = self.app.get('/guake')
+        finally:
+            sqlalchemy.event.remove(
+                engine, 'before_cursor_execute', count_usages)
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('(including you)' in output.data)
+        self.assertEqual(1, len(statements))
+
+    def test_anonymous_browsing(self):
+        """ Test that browsing does not store anonymous users. """
+        output = self.app.get('/notifs_state/')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(0, self.session.query(model.FASUser).count())
+
+        create_package(self.session)
+        data = {'pkgname': 'guake', 'rating': 100}
+        output = self.app.put('/api/v1/rating/guake/', data=data)
+        self.assertEqual(output.status_code, 200)
+        users = self.session.query(model.FASUser).all()
+        self.assertEqual(1, len(users))
+        self.assertTrue(users[0].anonymous)
+
     def test_toggle(self):
         """Test that toggle function reverses input"""
         response = self.app.get('/notifs_state/')
@@ -26,17 +26,30 @@ __requires__ = ['SQLAlchemy >= 0.7']
 import pkg_resources
 
 import unittest
+import subprocess
 import sys
 import os
+import tempfile
+import shutil
+import zlib
+import math
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import IntegrityError, TimeoutError
 from sqlalchemy.orm.exc import NoResultFound
 
 sys.path.insert(0, os.path.join(os.path.dirname(
     os.path.abspath(__file__)), '..'))
 
 import fedoratagger.lib
+from fedoratagger.lib import blacklist
+from fedoratagger.lib import compression
+from fedoratagger.lib import fake_pdc
 from fedoratagger.lib import model
+from fedoratagger.lib import ratelimit
+from fedoratagger.lib import retired
+from fedoratagger.lib import tag_index
+from fedoratagger.lib import vote_buffer
 from tests import Modeltests, FakeUser, create_package, create_tag, \
                   create_user
 
@@ -49,6 +62,27 @@ class TaggerLibtests(Modeltests):
         create_package(self.session)
         self.assertEqual(3, len(model.Package.all(self.session)))
 
+    def test_random_package(self):
+        """ Test that Package.random picks among the existing packages. """
+        self.assertRaises(NoResultFound, model.Package.random, self.session)
+        create_package(self.session)
+        # Leave a gap between guake and gitg.
+        self.session.delete(model.Package.by_name(self.session, 'geany'))
+        self.session.commit()
+        names = set(model.Package.random(self.session).name
+                    for _ in range(50))
+        self.assertEqual(set(['guake', 'gitg']), names)
+
+        # Without drawing identifiers.
+        draws = model.RANDOM_DRAWS
+        model.RANDOM_DRAWS = 0
+        try:
+            names = set(model.Package.random(self.session).name
+                        for _ in range(50))
+        finally:
+            model.RANDOM_DRAWS = draws
+        self.assertEqual(set(['guake', 'gitg']), names)
+
     def test_add_rating(self):
         """ Test the add_rating function of taggerlib. """
         create_user(self.session)
@@ -74,16 +108,24 @@ class TaggerLibtests(Modeltests):
         self.assertEqual(out, 'Rating on package "guake" did not change')
         self.session.commit()
 
+        revision = pkg.revision
         out = fedoratagger.lib.add_rating(self.session, 'guake', 100,
                                           user_ralph)
         self.assertEqual(out, 'Rating "100" added to the package "guake"')
         self.session.commit()
+        self.assertEqual(revision + 1, pkg.revision)
 
         rating = model.Rating.rating_of_package(self.session, pkg.id)
         self.assertEqual(75, rating)
 
         r = fedoratagger.lib.model.Package.rating(pkg, self.session)
         self.assertEquals(75, r)
+        self.assertEqual(2, pkg.n_ratings)
+
+        self.assertEqual([pkg], model.Rating.by_rating(self.session, 75))
+        self.assertEqual([pkg], model.Rating.by_range(self.session, 70, 75))
+        self.assertEqual([], model.Rating.by_range(self.session, 76))
+        self.assertEqual([pkg], model.Rating.top(self.session))
 
     def test_add_tag(self):
         """ Test the add_tag function of taggerlib. """
@@ -166,6 +208,74 @@ class TaggerLibtests(Modeltests):
         tagobj = model.Tag.get(self.session, pkg.id, 'application')
         self.assertEquals(True, tagobj.banned)
 
+        tags = model.Tag.random_visible(self.session, pkg.id, 5)
+        self.assertEqual([u'terminal'], [tag.label for tag in tags])
+        tags = model.Tag.random_visible(self.session, pkg.id, 0)
+        self.assertEqual([], tags)
+
+        # The flag follows the changes of the labels.
+        self.session.query(model.Tag).filter_by(label=u'x-test').update(
+            {'label': u'test'})
+        revision = pkg.revision
+        self.assertEqual(1, model.Tag.update_banned(self.session))
+        self.assertEqual(0, model.Tag.update_banned(self.session))
+        self.session.commit()
+        self.session.refresh(pkg)
+        self.assertEqual(revision + 1, pkg.revision)
+        change = self.session.query(model.Change).order_by(
+            model.Change.id.desc()).first()
+        self.assertEqual(('tag', pkg.id, 'test'),
+                         (change.kind, change.package_id, change.label))
+        tags = model.Tag.random_visible(self.session, pkg.id, 5)
+        self.assertEqual([u'terminal', u'test'],
+                         sorted(tag.label for tag in tags))
+
+    def test_blacklist(self):
+        """ Test the normalization and the matching of the blacklist. """
+        matcher = blacklist.Matcher(
+            ['ass', 'shit ', 'jack-off', 'motherfucker', ''])
+        self.assertEqual(u'shit', matcher.match('Sh1t'))
+        self.assertEqual(u'shit', matcher.match(u'S.H.I.T'))
+        self.assertEqual(u'ass', matcher.match('my-@ss'))
+        self.assertEqual(u'jackoff', matcher.match('Jack_Off'))
+        self.assertEqual(u'motherfucker',
+                         matcher.match(u'super-m0th\xe9rfucker-app'))
+        self.assertEqual(None, matcher.match('classes'))
+        self.assertEqual(None, matcher.match('shell'))
+        self.assertEqual(None, matcher.match(''))
+
+        self.assertTrue(blacklist.blacklisted(u'Fuck'))
+        self.assertFalse(blacklist.blacklisted(u'cluster'))
+        self.assertTrue(blacklist.banned(u'x-test'))
+        self.assertTrue(blacklist.banned(u'p0rn'))
+        self.assertFalse(blacklist.banned(u'terminal'))
+
+        create_user(self.session)
+        user_pingou = model.FASUser.by_name(self.session, 'pingou')
+        create_package(self.session)
+        self.assertRaises(ValueError, fedoratagger.lib.add_tag,
+                          self.session, 'guake', 'SH1T', user_pingou)
+
+    def test_blacklist_reload(self):
+        """ Test that the blacklist follows the changes of its file. """
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, 'foo\n')
+        os.close(fd)
+        try:
+            words = blacklist.Blacklist(filename, interval=0)
+            self.assertTrue(words.matcher().match('foo'))
+            self.assertFalse(words.matcher().match('bar'))
+            self.assertEqual(1, words.version)
+
+            with open(filename, 'w') as f:
+                f.write('bar\n')
+            os.utime(filename, (0, 0))
+            self.assertFalse(words.matcher().match('foo'))
+            self.assertTrue(words.matcher().match('bar'))
+            self.assertEqual(2, words.version)
+        finally:
+            os.unlink(filename)
+
     def test_tag_sorter(self):
         """ Test the tag_sorter function of model. """
         self.test_add_tag()
@@ -188,6 +298,127 @@ class TaggerLibtests(Modeltests):
 
         self.assertEqual(-1, result)
 
+        self.assertEqual(['terminal', u'gnóme'], [
+            tag.label for tag in sorted(
+                [tagobj2, tagobj1], key=fedoratagger.lib.model.tag_sort_key)])
+        self.assertEqual(
+            ['terminal'], [tag.label for tag in pkg.sorted_tags(1)])
+        query = self.session.query(model.Tag).filter_by(
+            package_id=pkg.id).order_by(*model.Tag.sort_order())
+        self.assertEqual(['terminal', u'gnóme'], [tag.label for tag in query])
+
+    def test_tag_index(self):
+        """ Test the suggestions of the TagIndex. """
+        create_user(self.session)
+        user = model.FASUser.by_name(self.session, 'pingou')
+        create_package(self.session)
+        self.session.add(model.Package(name='mc', summary=u'file manager'))
+        self.session.commit()
+        for pkgname, labels in [('geany', ['gtk', 'editor']),
+                                ('gitg', ['gtk', 'editor', 'git']),
+                                ('guake', ['gtk']),
+                                ('mc', ['console'])]:
+            for label in labels:
+                fedoratagger.lib.add_tag(self.session, pkgname, label, user)
+        self.session.commit()
+        guake = model.Package.by_name(self.session, 'guake')
+
+        index = tag_index.TagIndex().update(self.session)
+        # gtk is on 3 packages out of 4, editor on 2 of them: the only
+        # other pair, (gtk, git), was seen only once.
+        self.assertEqual(
+            [('editor', math.log(4 / 3.))], index.suggest(guake.id))
+        self.assertEqual([], index.suggest(guake.id, exclude=['editor']))
+        loaded_on = index.loaded_on
+
+        fedoratagger.lib.add_tag(self.session, 'guake', 'editor', user)
+        fedoratagger.lib.add_tag(self.session, 'geany', 'git', user)
+        self.session.commit()
+        # Not refreshed yet.
+        self.assertEqual(
+            [('editor', math.log(4 / 3.))], index.suggest(guake.id))
+
+        index.update(self.session, refresh=0)
+        self.assertEqual(loaded_on, index.loaded_on)
+        self.assertEqual(
+            [('git', 2 * math.log(4 / 3.))], index.suggest(guake.id))
+        self.assertEqual([], index.suggest(guake.id, limit=0))
+
+        index.load(self.session)
+        self.assertNotEqual(loaded_on, index.loaded_on)
+        self.assertEqual(
+            [('git', 2 * math.log(4 / 3.))], index.suggest(guake.id))
+
+        # With two tags per package paired, geany, gitg and guake give two
+        # (ordered) pairs each.
+        index = tag_index.TagIndex(pair_tags=2)
+        index.load(self.session)
+        self.assertEqual(
+            6, sum(sum(others.values()) for others in index.pairs.values()))
+
+        # Loaded by a background thread, with its own connection.
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            session = model.create_tables('sqlite:///%s' % filename)
+            index = tag_index.TagIndex()
+            index.start(session, 3600)
+            index.stop()
+            self.assertTrue(index.loaded_on)
+        finally:
+            os.unlink(filename)
+
+    def test_tag_index_similar(self):
+        """ Test the similar packages of the TagIndex. """
+        create_user(self.session)
+        user = model.FASUser.by_name(self.session, 'pingou')
+        create_package(self.session)
+        for pkgname, labels in [('geany', ['gtk', 'editor']),
+                                ('gitg', ['gtk', 'editor', 'git']),
+                                ('guake', ['gtk', 'terminal'])]:
+            for label in labels:
+                fedoratagger.lib.add_tag(self.session, pkgname, label, user)
+        self.session.commit()
+        geany = model.Package.by_name(self.session, 'geany')
+        gitg = model.Package.by_name(self.session, 'gitg')
+        guake = model.Package.by_name(self.session, 'guake')
+
+        index = tag_index.TagIndex().update(self.session)
+        similar = index.similar(geany.id)
+        self.assertEqual([gitg.id, guake.id], [pkg for pkg, _ in similar])
+        self.assertAlmostEqual(2 / math.sqrt(6), similar[0][1])
+        self.assertAlmostEqual(0.5, similar[1][1])
+        self.assertEqual([gitg.id], [pkg for pkg, _ in index.similar(
+            geany.id, limit=1)])
+        # editor, the rarest label of geany, is enough to find a candidate.
+        self.assertEqual([gitg.id], [pkg for pkg, _ in index.similar(
+            geany.id, candidates=1)])
+
+        # The votes change the totals of the tags.
+        fedoratagger.lib.add_vote(
+            self.session, 'guake', 'gtk', True,
+            model.FASUser.by_name(self.session, 'ralph'))
+        fedoratagger.lib.add_tag(self.session, 'gitg', 'terminal', user)
+        self.session.commit()
+        index.update(self.session, refresh=0)
+        similar = index.similar(guake.id)
+        self.assertEqual([gitg.id, geany.id], [pkg for pkg, _ in similar])
+        self.assertAlmostEqual(3 / math.sqrt(5 * 4), similar[0][1])
+        self.assertAlmostEqual(2 / math.sqrt(5 * 2), similar[1][1])
+
+        for label in ('gtk', 'editor', 'git', 'terminal'):
+            tag = model.Tag.get(self.session, gitg.id, label)
+            for vote in tag.votes:
+                self.session.delete(vote)
+            self.session.delete(tag)
+            model.Change.record(self.session, u'tag', gitg.id, label)
+        self.session.commit()
+        index.update(self.session, refresh=0)
+        self.assertEqual([], index.similar(gitg.id))
+        similar = index.similar(guake.id)
+        self.assertEqual([geany.id], [pkg for pkg, _ in similar])
+        self.assertAlmostEqual(2 / math.sqrt(5 * 2), similar[0][1])
+
     def test_rank_changes(self):
         """ Test that user rank changes appropriately. """
         self.test_add_tag()
@@ -218,6 +449,120 @@ class TaggerLibtests(Modeltests):
                              anonymous=True)
         self.assertEqual(user.rank(self.session), -1)
 
+    def test_get_or_stub(self):
+        """ Test that unknown anonymous users are not stored. """
+        user = model.FASUser.get_or_stub(self.session, 'abcdef')
+        self.assertEqual(user.id, None)
+        self.assertTrue(user.anonymous)
+        self.assertEqual(user.score, 0)
+        self.assertEqual(user.rank(self.session), -1)
+        self.session.commit()
+        self.assertEqual(0, self.session.query(model.FASUser).count())
+
+        model.FASUser.get_or_create(self.session, 'abcdef', anonymous=True)
+        self.session.commit()
+        user = model.FASUser.get_or_stub(self.session, 'abcdef')
+        self.assertNotEqual(user.id, None)
+
+    def test_compact_anonymous_users(self):
+        """ Test the removal of the dormant anonymous users. """
+        from fedoratagger.lib.compact import compact_anonymous_users
+
+        self.test_add_tag()
+        dormant = model.FASUser.get_or_create(
+            self.session, 'dormant', anonymous=True)
+        voter = model.FASUser.get_or_create(
+            self.session, 'voter', anonymous=True)
+        fedoratagger.lib.add_vote(self.session, 'guake', 'terminal', False,
+                                  voter)
+        fedoratagger.lib.add_rating(self.session, 'guake', 20, voter)
+        self.session.commit()
+
+        pkg = model.Package.by_name(self.session, 'guake')
+        tagobj = model.Tag.get(self.session, pkg.id, 'terminal')
+        self.assertEqual(1, tagobj.dislike)
+        self.assertEqual(20, pkg.avg_rating)
+        revision = pkg.revision
+
+        self.assertEqual(1, compact_anonymous_users(self.session))
+        self.session.commit()
+        self.assertEqual(7, self.session.query(model.FASUser).count())
+
+        self.assertEqual(
+            1, compact_anonymous_users(self.session, expire_votes=True))
+        self.session.commit()
+        self.assertEqual(6, self.session.query(model.FASUser).count())
+        self.session.refresh(tagobj)
+        self.assertEqual(2, tagobj.like)
+        self.assertEqual(0, tagobj.dislike)
+        self.assertEqual(3, self.session.query(model.Vote).count())
+
+        self.session.refresh(pkg)
+        self.assertEqual(None, pkg.avg_rating)
+        self.assertEqual(0, pkg.n_ratings)
+        # The cached cards are refreshed.
+        self.assertEqual(revision + 1, pkg.revision)
+
+        # The expired votes and ratings are fed to the change feed.
+        changes = self.session.query(model.Change).order_by(
+            model.Change.id.desc()).limit(2).all()
+        self.assertEqual(
+            [('rating', pkg.id, None), ('tag', pkg.id, 'terminal')],
+            [(change.kind, change.package_id, change.label)
+             for change in changes])
+
+    def test_bench_populate(self):
+        """ Test the synthetic dataset of the benchmark. """
+        from fedoratagger.lib.bench import populate, zipf_counts
+
+        counts = zipf_counts(100, 10)
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertTrue(95 <= sum(counts) <= 105)
+
+        out = populate(self.session, packages=20, tags=100, votes=300,
+                       users=30, ratings=40, usages=40, labels=50)
+        self.assertEqual(20, out['package'])
+        self.assertEqual(30, out['user'])
+
+        # The counters are consistent with the votes and ratings.
+        likes, dislikes = self.session.query(
+            func.sum(model.Tag.like), func.sum(model.Tag.dislike)).one()
+        self.assertEqual(out['vote'], likes + dislikes)
+        self.assertEqual(out['vote'], self.session.query(
+            func.sum(model.FASUser.score)).scalar())
+        self.assertEqual(out['rating'], self.session.query(
+            func.sum(model.Package.n_ratings)).scalar())
+
+        # The first packages are the most tagged ones.
+        first, last = [
+            len(model.Package.by_name(self.session, name).tags)
+            for name in (u'package-0', u'package-19')]
+        self.assertTrue(first > last)
+
+    def test_uses(self):
+        """ Test the usage lookups of FASUser. """
+        create_user(self.session)
+        create_package(self.session)
+        user = model.FASUser.by_name(self.session, 'ralph')
+        guake = model.Package.by_name(self.session, 'guake')
+        geany = model.Package.by_name(self.session, 'geany')
+
+        self.assertFalse(user.uses(self.session, guake))
+        fedoratagger.lib.set_usage(self.session, 'guake', user, True)
+        self.session.commit()
+        self.assertTrue(user.uses(self.session, guake))
+        self.assertFalse(user.uses(self.session, geany))
+
+        self.assertEqual(
+            set(['guake']),
+            user.uses_packages(self.session, ['guake', 'geany', 'foo']))
+
+        fedoratagger.lib.set_usage(self.session, 'guake', user, False)
+        self.session.commit()
+        self.assertFalse(user.uses(self.session, guake))
+        self.assertEqual(
+            set(), user.uses_packages(self.session, ['guake', 'geany']))
+
     def test_add_vote(self):
         """ Test the add_vote function of taggerlib. """
         self.test_add_tag()
@@ -368,6 +713,21 @@ class TaggerLibtests(Modeltests):
         self.assertEqual(out["like"][0][0], 'guake')
         self.assertEqual(out["like"][0][1], 'terminal')
 
+        fedoratagger.lib.add_vote(self.session, 'guake',
+                                  u'gnóme', False, user_yograterol)
+
+        out = fedoratagger.lib.statistics_by_user(self.session,
+                                                  user_yograterol, limit=1)
+        self.assertEqual(out["total"], 2)
+        self.assertEqual(out["like"], [('guake', 'terminal')])
+        self.assertEqual(out["dislike"], [])
+
+        out = fedoratagger.lib.statistics_by_user(
+            self.session, user_yograterol, after=out["next"], limit=1)
+        self.assertEqual(out["like"], [])
+        self.assertEqual(out["dislike"], [('guake', u'gnóme')])
+        self.assertEqual(out["next"], None)
+
     def test_leaderboard(self):
         """ Test the leaderboard method. """
         out = fedoratagger.lib.leaderboard(self.session)
@@ -422,6 +782,251 @@ class TaggerLibtests(Modeltests):
         dbuser = model.FASUser.by_name(self.session, infos['name'])
         self.assertTrue(infos['token'], dbuser.api_token)
 
+    def test_timed_pool(self):
+        """ Test the checkout statistics of TimedQueuePool. """
+        engine = create_engine(
+            'sqlite://', poolclass=fedoratagger.lib.TimedQueuePool,
+            pool_size=1, max_overflow=0, pool_timeout=0.1)
+        connection = engine.connect()
+        self.assertEqual(1, engine.pool.stats()['checked_out'])
+        self.assertRaises(TimeoutError, engine.connect)
+        connection.close()
+
+        stats = engine.pool.stats()
+        self.assertEqual(0, stats['checked_out'])
+        self.assertEqual(2, stats['checkouts'])
+        self.assertEqual(1, stats['timeouts'])
+        self.assertTrue(stats['wait_max'] >= 0.1)
+        self.assertTrue(stats['wait_total'] >= stats['wait_max'])
+
+    def test_rate_limiter(self):
+        """ Test the token buckets of RateLimiter. """
+        limiter = ratelimit.RateLimiter(ratelimit.MemoryBackend(), 2, 3)
+        self.assertEqual(0, limiter.take('ip:a', now=100))
+        self.assertEqual(0, limiter.take('ip:a', now=100))
+        self.assertEqual(0, limiter.take('ip:a', now=100))
+        self.assertEqual(0.5, limiter.take('ip:a', now=100))
+        # The buckets are per client.
+        self.assertEqual(0, limiter.take('ip:b', now=100))
+        # Two tokens per second, at most three.
+        self.assertEqual(0, limiter.take('ip:a', now=100.5))
+        self.assertEqual(0.5, limiter.take('ip:a', now=100.5))
+        self.assertEqual(0, limiter.take('ip:a', now=200))
+        self.assertEqual(0, limiter.take('ip:a', now=200))
+        self.assertEqual(0, limiter.take('ip:a', now=200))
+        self.assertEqual(0.5, limiter.take('ip:a', now=200))
+        self.assertEqual(
+            {'rate': 2, 'burst': 3, 'allowed': 8, 'throttled': 3},
+            limiter.stats())
+
+        # Nothing is taken back when the clock goes backwards.
+        backend = ratelimit.MemoryBackend()
+        self.assertEqual(0, backend.take('ip:a', 2, 1, now=100))
+        self.assertEqual(0.5, backend.take('ip:a', 2, 1, now=50))
+
+        self.assertEqual(None, ratelimit.create_limiter(
+            {'WRITE_RATE_LIMIT': None}))
+        # Disabled unless configured.
+        self.assertEqual(
+            None, ratelimit.create_limiter(fedoratagger.APP.config))
+        limiter = ratelimit.create_limiter({'WRITE_RATE_LIMIT': 1})
+        self.assertTrue(isinstance(limiter.backend, ratelimit.MemoryBackend))
+
+    def test_change_order(self):
+        """ Test that the change sequences follow the order of the commits.
+        """
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            first = model.create_tables('sqlite:///%s' % filename)
+            second = model.create_tables('sqlite:///%s' % filename)
+            model.Change.record(first, u'rating', 1)
+            model.Change.record(second, u'usage', 2)
+            second.commit()
+            self.assertEqual(1, model.Change.last(first))
+            first.commit()
+            self.assertEqual(
+                [(1, 'usage', 2), (2, 'rating', 1)],
+                first.query(model.Change.id, model.Change.kind,
+                            model.Change.package_id).order_by(
+                    model.Change.id).all())
+
+            # The changes of a rolled back transaction are dropped.
+            model.Change.record(first, u'rating', 3)
+            first.rollback()
+            first.commit()
+            self.assertEqual(2, model.Change.last(first))
+            first.close()
+            second.close()
+        finally:
+            os.unlink(filename)
+
+    def test_vote_buffer(self):
+        """ Test the write-behind buffer of the vote counters. """
+        create_package(self.session)
+        create_tag(self.session)
+        guake = model.Package.by_name(self.session, 'guake')
+        ralph = model.FASUser.by_name(self.session, 'ralph')
+        score = ralph.score
+        revision = guake.revision
+        last = model.Change.last(self.session)
+
+        buffer = vote_buffer.BUFFER
+        buffer.start(self.session, 3600)
+        try:
+            fedoratagger.lib.add_vote(
+                self.session, 'guake', u'gnóme', True, ralph)
+            self.session.commit()
+            fedoratagger.lib.add_vote(
+                self.session, 'guake', 'terminal', False, ralph)
+            self.session.rollback()
+
+            # The vote is stored, the counters are not updated yet.
+            tag = model.Tag.get(self.session, guake.id, u'gnóme')
+            self.assertEqual(3, len(tag.votes))
+            self.assertEqual(2, tag.like)
+            self.assertEqual(3, tag.__json__()['like'])
+            self.assertEqual(3, tag.__json__()['total'])
+            self.assertEqual(3, tag.total)
+            self.assertEqual(
+                [u'gnóme', u'terminal'],
+                [t.label for t in guake.sorted_tags()])
+            self.assertEqual(score, ralph.score)
+            self.assertEqual(score + 0.5, ralph.__json__()['score'])
+            self.assertEqual(last, model.Change.last(self.session))
+
+            self.assertEqual(1, buffer.flush(self.session))
+            tag = model.Tag.get(self.session, guake.id, u'gnóme')
+            self.assertEqual(3, tag.like)
+            self.assertEqual(3, tag.__json__()['like'])
+            self.assertEqual(revision + 1, guake.revision)
+            self.assertEqual(score + 0.5, ralph.score)
+            self.assertEqual(score + 0.5, ralph.__json__()['score'])
+            self.assertEqual(last + 1, model.Change.last(self.session))
+
+            # Changing a vote moves one like to the dislikes.
+            fedoratagger.lib.add_vote(
+                self.session, 'guake', u'gnóme', False, ralph)
+            self.session.commit()
+            self.assertEqual(1, buffer.flush(self.session))
+            self.assertEqual(0, buffer.flush(self.session))
+
+            # The increments of a tag removed in the meantime are dropped,
+            # they do not hold back the others.
+            buffer.add(999, guake.id, u'gone', 1, 0, ralph.id, 0)
+            buffer.add(tag.id, guake.id, u'gnóme', 0, 0, ralph.id, 0)
+            self.assertEqual(1, buffer.flush(self.session))
+            self.assertEqual(({}, {}), (buffer.tags, buffer.scores))
+        finally:
+            buffer.stop(self.session)
+        self.assertFalse(buffer.running)
+
+        # stop() flushed and removed the session.
+        guake = model.Package.by_name(self.session, 'guake')
+        tag = model.Tag.get(self.session, guake.id, u'gnóme')
+        self.assertEqual((2, 1), (tag.like, tag.dislike))
+        ralph = model.FASUser.by_name(self.session, 'ralph')
+        self.assertEqual(score + 0.5, ralph.score)
+
+    def test_compression(self):
+        """ Test the compressors and the ExportCache. """
+        data = 'guake\tterminal\n' * 1000
+        for encoding in compression.ENCODINGS:
+            compressed = ''.join(compression.compress_iter(
+                iter([data[:100], data[100:]]), encoding))
+            self.assertEqual(compressed,
+                             compression.compress(data, encoding))
+        self.assertEqual(data, zlib.decompress(
+            compression.compress(data, 'gzip'), 16 + zlib.MAX_WBITS))
+        self.assertEqual(data, zlib.decompress(
+            compression.compress(data, 'deflate')))
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = compression.ExportCache(
+                directory, encodings=['gzip'], ttl=60)
+            self.assertEqual(None, cache.get('dump', 1))
+            cache.store('dump', 1, iter([data[:100], data[100:]]))
+            with open(cache.get('dump', 1)) as stream:
+                self.assertEqual(data, stream.read())
+            with open(cache.get('dump', 1, 'gzip')) as stream:
+                self.assertEqual(data, zlib.decompress(
+                    stream.read(), 16 + zlib.MAX_WBITS))
+
+            # A new version replaces the old one.
+            cache.store('dump', 2, iter(['new']))
+            self.assertEqual(None, cache.get('dump', 1))
+            self.assertEqual(['dump.2', 'dump.2.gzip'],
+                             sorted(os.listdir(directory)))
+
+            # Expired, with the leftovers of a writer which died.
+            os.utime(cache.get('dump', 2), (0, 0))
+            self.assertEqual(None, cache.get('dump', 2))
+            leftover = os.path.join(directory, 'tmp-x1y2.part')
+            open(leftover, 'w').close()
+            os.utime(leftover, (0, 0))
+            cache.store('other', 1, iter(['other']))
+            self.assertEqual(['dump.2.gzip', 'other.1', 'other.1.gzip'],
+                             sorted(os.listdir(directory)))
+
+            with cache.lock('other'):
+                self.assertTrue(os.path.exists(
+                    os.path.join(directory, 'locks', 'other')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_web_free_import(self):
+        """ Test that the command line tools do not load the web stack. """
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, fedoratagger.lib.update, fedoratagger.lib.retired;'
+            'print sorted(set(["flask", "tw2.core", "docutils"])'
+            ' & set(sys.modules))',
+        ], cwd=os.path.join(os.path.dirname(__file__), '..'))
+        self.assertEqual('[]', output.strip())
+
+    def test_retired_packages(self):
+        """ Test the parallel fetch and the removal of retired packages. """
+        create_package(self.session)
+        create_tag(self.session)
+        fedoratagger.lib.add_rating(
+            self.session, 'guake', 100,
+            model.FASUser.by_name(self.session, 'pingou'))
+        self.session.commit()
+        if self.session.bind.dialect.name == 'sqlite':
+            # Enforce the foreign keys, like the other databases.
+            self.session.execute('PRAGMA foreign_keys=ON')
+            self.assertEqual(1, self.session.execute(
+                'PRAGMA foreign_keys').scalar())
+        guake = model.Package.by_name(self.session, 'guake')
+        # The tags, votes and ratings of the packages are in the feed.
+        self.assertTrue(self.session.query(model.Change).filter_by(
+            package_id=guake.id).count())
+        f28 = ['guake'] + ['pkg%02i' % i for i in range(25)]
+        with fake_pdc.FakePDC({'f28': f28, 'f29': ['geany', 'guake']}) as pdc:
+            names = retired.get_retired_packages(
+                ['f28', 'f29'], url=pdc.url, workers=4, page_size=10)
+            # The pages are yielded as they arrive, each name once.
+            self.assertEqual(sorted(f28 + ['geany']), sorted(names))
+            # Three pages for f28, one for f29, none followed twice.
+            self.assertEqual(
+                [('f28', None), ('f28', '2'), ('f28', '3'), ('f29', None)],
+                sorted((args['name'], args.get('page'))
+                       for args in pdc.requests))
+
+            fedoratagger.SESSION = self.session
+            retired.del_packages(['f29'], url=pdc.url, workers=2)
+        self.assertEqual(
+            ['gitg'], [pkg.name for pkg in model.Package.all(self.session)])
+        self.assertEqual(0, self.session.query(model.Tag).count())
+        self.assertEqual(0, self.session.query(model.Vote).count())
+        self.assertEqual(0, self.session.query(model.Rating).count())
+        # Only their removal is left in the feed.
+        self.assertEqual(
+            [('delete', 'guake'), ('delete', 'geany')],
+            [(change.kind, change.label) for change in self.session.query(
+                model.Change).order_by(model.Change.id)])
+
 
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TaggerLibtests)